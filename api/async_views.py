@@ -0,0 +1,103 @@
+import json
+import logging
+import traceback
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from api.commands import dispatch, match_command
+from api.idempotency import get_delivery_id, aclaim_delivery, arelease_delivery
+from api.mentions import aresolve_mentions
+from api.metrics import count, set_labels, timer
+from api.payloads import load_hook
+from api.queue import aenqueue_messages
+from api.routing import aget_route
+from api.serializers import TelegramWebhookSerializer
+from api.rendering import build_message
+from api.services import GITLAB_EVENTS, parse_gitlab_event, build_mentions, plan_delivery
+from api.sink import arecord_event
+
+logger = logging.getLogger(__name__)
+
+
+# Native async variants of GitlabWebhookAPIView and TelegramWebhookAPIView for ASGI deployments
+# (uvicorn root.asgi:application). DRF views are sync only, so these are plain Django async views.
+
+
+@csrf_exempt
+@require_POST
+async def gitlab_webhook(request):
+    delivery_id = None
+    try:
+        event_type = request.headers.get('X-Gitlab-Event')
+
+        if event_type not in GITLAB_EVENTS:
+            return JsonResponse({'status': 'ignored'})
+
+        delivery_id = get_delivery_id(request.headers)
+        if not await aclaim_delivery(delivery_id):
+            return JsonResponse({'status': 'duplicate'})
+
+        with timer('parse'):
+            try:
+                payload = load_hook(GITLAB_EVENTS[event_type], request.body)
+            except ValueError:
+                await arelease_delivery(delivery_id)
+                return JsonResponse({'error': 'Invalid JSON payload'}, status=400)
+            event = parse_gitlab_event(event_type, payload)
+        set_labels(event_type=event['gitlab_event'], project=event['project_name'] or '')
+
+        if not event['project_name']:
+            return JsonResponse({'error': 'Missing project name in payload'})
+
+        with timer('route'):
+            project = await aget_route(event['project_name'], create=settings.WEBHOOK_AUTO_CREATE_PROJECTS)
+        if project is None:
+            await arelease_delivery(delivery_id)
+            return JsonResponse({'error': 'Unknown project'}, status=403)
+
+        with timer('record'):
+            await arecord_event(event, project)
+
+        with timer('mentions'):
+            mention, assignee_mentions, reviewer_mentions = build_mentions(event, await aresolve_mentions(event))
+
+        with timer('render'):
+            message = build_message(event, project, mention, assignee_mentions, reviewer_mentions)
+
+        with timer('deliver'):
+            result, jobs = await sync_to_async(plan_delivery)(event, project, message)
+            await aenqueue_messages(jobs)
+
+        return JsonResponse({'status': result})
+
+    except Exception as e:
+        logger.exception("GitLab webhook failed")
+        count('errors_total', exception=type(e).__name__)
+        await arelease_delivery(delivery_id)
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@csrf_exempt
+@require_POST
+async def telegram_webhook(request):
+    try:
+        serializer = TelegramWebhookSerializer(data=json.loads(request.body))
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        message = data.get('message') or data.get('edited_message')
+        match = match_command(message)
+        if match is None:
+            count('telegram_updates_total', result='ignored')
+            return JsonResponse({'status': 'ignored'})
+
+        count('telegram_updates_total', result='command')
+        return JsonResponse({'status': await sync_to_async(dispatch)(message, match)})
+
+    except Exception as e:
+        traceback.print_exc()
+        return JsonResponse({'error': str(e)})
@@ -1,37 +1,93 @@
-import requests
+import json
 
-from django.conf import settings
+from api.client import get_client, get_async_client, TelegramError
 
 
 def send_message(chat_id, thread_id, text):
-    url = f"https://api.telegram.org/bot{settings.TELEGRAM_BOT_TOKEN}/sendMessage"
     data = {
         "chat_id": chat_id,
         "message_thread_id": thread_id,
         "text": text,
         "parse_mode": "Markdown"
     }
-    response = requests.post(url, data=data).json()
-    return response.get("result", {})
+    return get_client().call('sendMessage', data, chat_id=chat_id)
 
 
 def edit_message(chat_id, message_id, new_text):
-    url = f"https://api.telegram.org/bot{settings.TELEGRAM_BOT_TOKEN}/editMessageText"
     data = {
         "chat_id": chat_id,
         "message_id": message_id,
         "text": new_text,
         "parse_mode": "Markdown"
     }
-    requests.post(url, data=data)
+    try:
+        get_client().call('editMessageText', data, chat_id=chat_id)
+    except TelegramError as e:
+        # same text as before, nothing to update
+        if 'message is not modified' not in (e.description or ''):
+            raise
 
 
 def bot_answer(chat_id, text):
-    url = f"https://api.telegram.org/bot{settings.TELEGRAM_BOT_TOKEN}/sendMessage"
     data = {
         "chat_id": chat_id,
         "text": text,
         "parse_mode": "Markdown"
     }
-    response = requests.post(url, data=data).json()
-    return response.get("result", {})
+    return get_client().call('sendMessage', data, chat_id=chat_id)
+
+
+def set_webhook(url):
+    return get_client().call('setWebhook', {'url': url})
+
+
+def delete_webhook():
+    # getUpdates is refused while a webhook is set
+    return get_client().call('deleteWebhook', {})
+
+
+def get_updates(offset, timeout, limit, allowed_updates):
+    data = {
+        "timeout": timeout,
+        "limit": limit,
+        "allowed_updates": json.dumps(list(allowed_updates)),
+    }
+    if offset is not None:
+        data["offset"] = offset
+    client = get_client()
+    connect_timeout, read_timeout = client.timeout
+    # the server holds the request for up to `timeout` seconds before answering
+    return client.call('getUpdates', data, timeout=(connect_timeout, timeout + read_timeout))
+
+
+async def asend_message(chat_id, thread_id, text):
+    data = {
+        "chat_id": chat_id,
+        "message_thread_id": thread_id,
+        "text": text,
+        "parse_mode": "Markdown"
+    }
+    return await get_async_client().call('sendMessage', data, chat_id=chat_id)
+
+
+async def aedit_message(chat_id, message_id, new_text):
+    data = {
+        "chat_id": chat_id,
+        "message_id": message_id,
+        "text": new_text,
+        "parse_mode": "Markdown"
+    }
+    try:
+        await get_async_client().call('editMessageText', data, chat_id=chat_id)
+    except TelegramError as e:
+        if 'message is not modified' not in (e.description or ''):
+            raise
+
+
+async def abot_answer(chat_id, text):
+    data = {
+        "chat_id": chat_id,
+        "text": text,
+        "parse_mode": "Markdown"
+    }
+    return await get_async_client().call('sendMessage', data, chat_id=chat_id)
@@ -0,0 +1,161 @@
+import hashlib
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from api.bot import send_message, edit_message
+from api.client import DeliveryError
+from api.messages import get_message_id
+from api.pipelines import FINAL_PIPELINE_STATUSES, FINAL_RANK, PIPELINE_STATUS_RANK
+from api.rendering import build_card
+from api.utils import incr_stat
+
+CARD_KEY = 'gitlab_bot:mr_card'
+
+CARD_SCHEDULED = 1
+CARD_UPDATED = 2
+
+# One message per merge request for its whole life. Each target chat has a card: the latest merge
+# request hook rendered as usual (title, state, draft, reviewers...), plus what merge request hooks
+# don't carry: who approved it and the status of its last pipeline. Every hook applies its delta to
+# the card, and the worker renders the card and edits the message only when the text changed
+# (sent_hash), so a burst of hooks costs one edit and hooks that change nothing cost none.
+
+# KEYS: card hash, approvers set, "flush scheduled" flag
+# ARGV: rendered merge request message ('' for none), its updated_at, approval change ('add',
+#       'remove' or ''), approver, pipeline status ('' for none), card ttl (s), flag ttl (ms),
+#       pipeline id, its status rank and is final (0/1) as in api.pipelines
+# An out of order merge request hook (older updated_at) doesn't replace the text. A pipeline hook
+# follows api.pipelines' rule: a newer pipeline (higher id) always replaces the status, the same
+# pipeline never moves back from a final status or to a lower rank, an older one is ignored.
+# Returns 0 when the card has no merge request message yet (a pipeline before the first hook), 1
+# when the card was updated and a flush is already pending, 2 when the caller has to schedule the flush.
+UPDATE_CARD_SCRIPT = """
+if ARGV[1] ~= '' then
+    local updated_at = redis.call('HGET', KEYS[1], 'updated_at')
+    if not updated_at or updated_at <= ARGV[2] then
+        redis.call('HSET', KEYS[1], 'text', ARGV[1], 'updated_at', ARGV[2])
+    end
+end
+if ARGV[3] == 'add' then
+    redis.call('SADD', KEYS[2], ARGV[4])
+elseif ARGV[3] == 'remove' then
+    redis.call('SREM', KEYS[2], ARGV[4])
+end
+if ARGV[5] ~= '' then
+    local current = redis.call('HMGET', KEYS[1], 'pipeline_id', 'pipeline_rank', 'pipeline_final')
+    local id = tonumber(ARGV[8])
+    local rank = tonumber(ARGV[9])
+    local final = tonumber(ARGV[10])
+    local stale = false
+    if current[1] then
+        local current_id = tonumber(current[1])
+        local current_final = tonumber(current[3])
+        if id < current_id then
+            stale = true
+        elseif id == current_id and final == 0 then
+            stale = current_final == 1 or rank < tonumber(current[2])
+        end
+    end
+    if not stale then
+        redis.call('HSET', KEYS[1], 'pipeline', ARGV[5], 'pipeline_id', id, 'pipeline_rank', rank,
+                   'pipeline_final', final)
+    end
+end
+-- before the early return: a pipeline status kept for a merge request whose hook never came must expire too
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+redis.call('EXPIRE', KEYS[2], ARGV[6])
+if redis.call('HEXISTS', KEYS[1], 'text') == 0 then
+    return 0
+end
+if redis.call('SET', KEYS[3], 1, 'NX', 'PX', ARGV[7]) then
+    return 2
+end
+return 1
+"""
+
+# merge request hook actions that change the approvals
+APPROVAL_ACTIONS = {
+    'approved': 'add',
+    'approval': 'add',
+    'unapproved': 'remove',
+    'unapproval': 'remove',
+}
+
+_update_script = None
+
+
+def card_key(project_id, event_key):
+    return f"{CARD_KEY}:{project_id}:{event_key}"
+
+
+def approvers_key(project_id, event_key):
+    return f"{CARD_KEY}:{project_id}:{event_key}:approvers"
+
+
+def flag_key(project_id, event_key):
+    return f"{CARD_KEY}:{project_id}:{event_key}:scheduled"
+
+
+def card_event_key(merge_request_id, source_branch):
+    # same key as the merge request hook's event_key, so pipelines find the card
+    return f"{merge_request_id}:merge:{source_branch}"
+
+
+def update_card(project_id, event_key, text='', updated_at='', approval='', approver='', pipeline='',
+                pipeline_id=None):
+    global _update_script
+    if _update_script is None:
+        _update_script = get_redis_connection('default').register_script(UPDATE_CARD_SCRIPT)
+
+    final = pipeline in FINAL_PIPELINE_STATUSES
+    rank = FINAL_RANK if final else PIPELINE_STATUS_RANK.get(pipeline, 0)
+    result = _update_script(
+        keys=[card_key(project_id, event_key), approvers_key(project_id, event_key), flag_key(project_id, event_key)],
+        args=[text, updated_at or '', approval, approver or '', pipeline or '', settings.MR_CARD_TTL,
+              settings.PIPELINE_FLUSH_FLAG_TTL * 1000, pipeline_id or 0, rank, int(final)],
+    )
+    return int(result)
+
+
+def load_card(conn, project_id, event_key):
+    # the card's state and its rendered message, (None, None) once it expired
+    state = {key.decode(): value.decode() for key, value in conn.hgetall(card_key(project_id, event_key)).items()}
+    if 'text' not in state:
+        return None, None
+    approvers = [name.decode() for name in conn.smembers(approvers_key(project_id, event_key))]
+    return state, build_card(state['text'], approvers, state.get('pipeline'))
+
+
+def flush_card(job):
+    # sends the card on the first flush and edits it afterwards, whatever hook scheduled it
+    conn = get_redis_connection('default')
+    project_id = job.get('project_id')
+    event_key = job['event_key']
+
+    conn.delete(flag_key(project_id, event_key))
+    state, text = load_card(conn, project_id, event_key)
+    if not state:
+        return
+
+    digest = hashlib.sha1(text.encode()).hexdigest()
+    if state.get('sent_hash') == digest:
+        incr_stat('mr_card_flush_skipped')
+        return
+
+    # cards started before this store kept their message id in api.messages
+    msg_id = state.get('message_id') or get_message_id(project_id, event_key)
+    if msg_id:
+        edit_message(job['chat_id'], int(msg_id), text)
+        sent = {'message_id': msg_id, 'sent_hash': digest}
+    else:
+        msg = send_message(job['chat_id'], job['thread_id'], text)
+        if 'message_id' not in msg:
+            raise DeliveryError(f"sendMessage returned no message for chat {job['chat_id']}")
+        sent = {'message_id': msg['message_id'], 'sent_hash': digest}
+
+    pipe = conn.pipeline()
+    pipe.hset(card_key(project_id, event_key), mapping=sent)
+    pipe.expire(card_key(project_id, event_key), settings.MR_CARD_TTL)
+    pipe.execute()
+    incr_stat('mr_card_flush_sent')
@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import weakref
+
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django_redis import get_redis_connection
+from requests.adapters import HTTPAdapter
+
+from api.metrics import count, observe
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_KEY = 'gitlab_bot:ratelimit'
+
+# Reserves one token in every bucket passed in KEYS and returns how long the caller has to wait
+# before using it. Buckets may go negative: that is the queue of callers already waiting.
+# ARGV holds (rate per second, capacity) pairs, one pair per key.
+TOKEN_BUCKET_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local capacity = tonumber(ARGV[i * 2])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + (now - ts) * rate) - 1
+    if tokens < 0 then
+        wait = math.max(wait, -tokens / rate)
+    end
+    redis.call('HSET', key, 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', key, math.ceil(capacity / rate) + 60)
+end
+return tostring(wait)
+"""
+
+
+class TelegramError(Exception):
+    def __init__(self, method, error_code, description, parameters=None):
+        super().__init__(f"{method}: [{error_code}] {description}")
+        self.method = method
+        self.error_code = error_code
+        self.description = description
+        self.parameters = parameters or {}
+
+
+class DeliveryError(Exception):
+    # the Bot API answered, but not with what the delivery needs (e.g. no message_id)
+    pass
+
+
+class TelegramClient:
+    def __init__(self, token, base_url, connect_timeout, read_timeout, pool_size, max_retries):
+        self.url = f"{base_url.rstrip('/')}/bot{token}"
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+
+        self.session = self.create_session(pool_size)
+        self._bucket_script = None
+
+    def create_session(self, pool_size):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def reserve(self, chat_id):
+        # one reservation in the bot-wide bucket and one in the chat's bucket, shared by every process;
+        # returns the seconds to wait before the call may go out
+        if self._bucket_script is None:
+            self._bucket_script = get_redis_connection('default').register_script(TOKEN_BUCKET_SCRIPT)
+
+        keys = [f"{RATE_LIMIT_KEY}:global", f"{RATE_LIMIT_KEY}:chat:{chat_id}"]
+        args = [
+            settings.TELEGRAM_GLOBAL_RATE, settings.TELEGRAM_GLOBAL_BURST,
+            settings.TELEGRAM_CHAT_RATE_PER_MINUTE / 60, settings.TELEGRAM_CHAT_BURST,
+        ]
+        return float(self._bucket_script(keys=keys, args=args))
+
+    def parse_response(self, method, status_code, text, payload):
+        if payload is None:
+            raise TelegramError(method, status_code, text[:200])
+        if payload.get('ok'):
+            return payload.get('result', {})
+        raise TelegramError(
+            method, payload.get('error_code'), payload.get('description'), payload.get('parameters', {})
+        )
+
+    def throttle(self, chat_id):
+        wait = self.reserve(chat_id)
+        if wait > 0:
+            observe('telegram_throttle_seconds', wait)
+            time.sleep(wait)
+
+    def call(self, method, data, chat_id=None, timeout=None):
+        for attempt in range(self.max_retries + 1):
+            if chat_id is not None:
+                self.throttle(chat_id)
+
+            started = time.perf_counter()
+            response = self.session.post(f"{self.url}/{method}", data=data, timeout=timeout or self.timeout)
+            observe('telegram_api_seconds', time.perf_counter() - started, method=method)
+            count('telegram_api_responses_total', method=method, code=response.status_code)
+            try:
+                payload = response.json()
+            except ValueError:
+                payload = None
+
+            try:
+                return self.parse_response(method, response.status_code, response.text, payload)
+            except TelegramError as e:
+                if e.error_code != 429 or attempt == self.max_retries:
+                    raise
+                retry_after = e.parameters.get('retry_after', 1)
+                logger.warning("Telegram rate limit on %s (chat %s), retrying after %ss", method, chat_id, retry_after)
+                time.sleep(retry_after)
+
+
+class AsyncTelegramClient(TelegramClient):
+    # same limits and retries as TelegramClient, but on httpx so the async views never block a thread
+    def create_session(self, pool_size):
+        connect_timeout, read_timeout = self.timeout
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+
+    async def call(self, method, data, chat_id=None, timeout=None):
+        data = {key: value for key, value in data.items() if value is not None}
+
+        for attempt in range(self.max_retries + 1):
+            if chat_id is not None:
+                wait = await sync_to_async(self.reserve)(chat_id)
+                if wait > 0:
+                    observe('telegram_throttle_seconds', wait)
+                    await asyncio.sleep(wait)
+
+            started = time.perf_counter()
+            response = await self.session.post(
+                f"{self.url}/{method}", data=data, timeout=timeout or httpx.USE_CLIENT_DEFAULT
+            )
+            observe('telegram_api_seconds', time.perf_counter() - started, method=method)
+            count('telegram_api_responses_total', method=method, code=response.status_code)
+            try:
+                payload = response.json()
+            except ValueError:
+                payload = None
+
+            try:
+                return self.parse_response(method, response.status_code, response.text, payload)
+            except TelegramError as e:
+                if e.error_code != 429 or attempt == self.max_retries:
+                    raise
+                retry_after = e.parameters.get('retry_after', 1)
+                logger.warning("Telegram rate limit on %s (chat %s), retrying after %ss", method, chat_id, retry_after)
+                await asyncio.sleep(retry_after)
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def client_kwargs():
+    return dict(
+        token=settings.TELEGRAM_BOT_TOKEN,
+        base_url=settings.TELEGRAM_API_URL,
+        connect_timeout=settings.TELEGRAM_CONNECT_TIMEOUT,
+        read_timeout=settings.TELEGRAM_READ_TIMEOUT,
+        pool_size=settings.TELEGRAM_POOL_SIZE,
+        max_retries=settings.TELEGRAM_MAX_RETRIES,
+    )
+
+
+def get_client():
+    global _client, _client_pid
+
+    # pooled sockets must not be shared with forked worker processes
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                _client = TelegramClient(**client_kwargs())
+                _client_pid = os.getpid()
+    return _client
+
+
+def get_async_client():
+    # httpx connections belong to the event loop that opened them
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncTelegramClient(**client_kwargs())
+    return client
@@ -0,0 +1,273 @@
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from api.bot import bot_answer
+from api.metrics import count
+from api.rendering import escape_markdown
+from api.stats import get_stats
+from api.utils import parse_group_info
+from apps.models import GitlabProject, GitlabUser, TelegramAdmin, TelegramGroup
+
+# Bot commands sent to the Telegram webhook or fetched by poll_updates (api/polling.py).
+#
+# Most updates in a busy group are ordinary chatter. match_command() looks only at the update
+# itself, so anything that isn't one of our commands is dropped without touching the database or
+# Redis. Commands are looked up in COMMANDS by (chat kind, command); the admin ids and the groups'
+# is_active flags they need come from BotState, loaded once per process and reloaded only when a
+# TelegramAdmin or TelegramGroup is saved or deleted (apps.signals bumps STATE_VERSION_KEY).
+
+STATE_VERSION_KEY = 'gitlab_bot:bot_state_version'
+WAITING_ID_TIMEOUT = 300
+STATS_DEFAULT_DAYS = 7
+STATS_TOP_USERS = 5
+MESSAGE_LIMIT = 4096  # Bot API limit on a message's text
+
+# any other text in a private chat, routed like a command: the reply to /start with a GitLab ID
+GITLAB_ID = '<gitlab id>'
+
+# (chat kind, command) -> (handler, admins only)
+COMMANDS = {}
+
+
+def command(chat_kind, name, admins_only=False):
+    def register(handler):
+        COMMANDS[chat_kind, name] = (handler, admins_only)
+        return handler
+    return register
+
+
+class BotState:
+    # Admin telegram ids and chat_id -> is_active of every registered group, per process. Checking
+    # the version costs one Redis GET per command; the tables are reloaded only when it changed.
+    def __init__(self):
+        self.version = None
+        self.admins = frozenset()
+        self.groups = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        version = get_redis_connection('default').get(STATE_VERSION_KEY)
+        with self._lock:
+            if self._loaded and version == self.version:
+                return self
+        admins = frozenset(TelegramAdmin.objects.values_list('telegram_id', flat=True))
+        groups = dict(TelegramGroup.objects.values_list('chat_id', 'is_active'))
+        with self._lock:
+            self.version, self.admins, self.groups, self._loaded = version, admins, groups, True
+        count('cache_lookups_total', cache='bot_state', result='miss')
+        return self
+
+    def clear(self):
+        with self._lock:
+            self._loaded = False
+
+
+bot_state = BotState()
+
+
+def invalidate_bot_state():
+    bot_state.clear()
+    get_redis_connection('default').incr(STATE_VERSION_KEY)
+
+
+def chat_kind(message):
+    chat_type = message.get('chat', {}).get('type', '')
+    if chat_type == 'private':
+        return 'private'
+    if chat_type in ('group', 'supergroup'):
+        return 'group'
+    return None
+
+
+def match_command(message):
+    # (handler, admins only, command) for an update we handle, None for everything else. No I/O.
+    kind = chat_kind(message)
+    text = message.get('text', '').strip()
+    if kind is None or not text:
+        return None
+
+    if text.startswith('/'):
+        name, _, bot = text.split(maxsplit=1)[0].partition('@')
+        # "/start@other_bot" is for another bot in the group
+        if bot and settings.BOT_USERNAME and bot.lower() != settings.BOT_USERNAME.lstrip('@').lower():
+            return None
+    elif kind == 'private':
+        name = GITLAB_ID
+    else:
+        return None
+
+    entry = COMMANDS.get((kind, name))
+    if entry is None:
+        return None
+    handler, admins_only = entry
+    return handler, admins_only, name
+
+
+def dispatch(message, match):
+    handler, admins_only, name = match
+    telegram_id = message.get('from', {}).get('id')
+    if admins_only and telegram_id not in bot_state.refresh().admins:
+        count('bot_commands_total', command=name, result='unauthorized')
+        return 'unauthorized'
+
+    result = handler(message, telegram_id)
+    count('bot_commands_total', command=name, result=result)
+    return result
+
+
+def handle_update(update):
+    # a whole Update object, as returned by getUpdates (api.polling)
+    message = update.get('message') or update.get('edited_message')
+    match = match_command(message) if message else None
+    if match is None:
+        count('telegram_updates_total', result='ignored')
+        return 'ignored'
+
+    count('telegram_updates_total', result='command')
+    return dispatch(message, match)
+
+
+def waiting_key(telegram_id):
+    return f'waiting_id_{telegram_id}'
+
+
+@command('private', '/start')
+def ask_gitlab_id(message, telegram_id):
+    cache.set(waiting_key(telegram_id), True, timeout=WAITING_ID_TIMEOUT)
+    bot_answer(telegram_id, "🔑 Iltimos, GitLab ID'ingizni yuboring.")
+    return 'asking for gitlab_id'
+
+
+@command('private', GITLAB_ID)
+def register_user(message, telegram_id):
+    if not cache.get(waiting_key(telegram_id)):
+        return 'ignored'
+
+    gitlab_id = message['text'].strip()
+    if not gitlab_id.isdigit():
+        # still waiting: the next message may be the right one
+        bot_answer(telegram_id, "❗️GitLab ID faqat raqamlardan iborat bo'lishi kerak. Iltimos, raqamli ID yuboring.")
+        return 'Gitlab ID must contain only digits!'
+    # one query for both checks: is this account, or this GitLab ID, already registered
+    rows = dict(GitlabUser.objects.filter(
+        Q(telegram_id=telegram_id) | Q(gitlab_id=gitlab_id)
+    ).values_list('gitlab_id', 'telegram_id')[:2])
+    cache.delete(waiting_key(telegram_id))
+
+    if str(telegram_id) in rows.values():
+        bot_answer(telegram_id, "ℹ️ Siz allaqachon ro'yxatdan o'tgansiz.")
+        return 'already registered'
+    if rows.get(int(gitlab_id)):
+        bot_answer(telegram_id, "❗️Bu GitLab ID allaqachon ishlatilgan.")
+        return 'gitlab_id taken'
+
+    if rows:
+        # a member imported by sync_members claims their row; save() so the mention cache is invalidated
+        user = GitlabUser.objects.get(gitlab_id=gitlab_id)
+        user.telegram_id = telegram_id
+        user.save(update_fields=['telegram_id'])
+    else:
+        GitlabUser.objects.create(gitlab_id=gitlab_id, telegram_id=telegram_id)
+    bot_answer(telegram_id, "✅ Ro'yxatdan muvaffaqiyatli o'tdingiz!")
+    return 'registered'
+
+
+@command('group', '/register', admins_only=True)
+def register_group(message, telegram_id):
+    group_info = parse_group_info(message)
+    TelegramGroup.objects.update_or_create(chat_id=group_info['chat_id'], defaults=group_info)
+    bot_answer(group_info['chat_id'], "✅ Guruh muvaffaqiyatli ro'yxatdan o'tkazildi.")
+    return 'registered'
+
+
+def set_group_active(chat_id, is_active):
+    # save() rather than update() so the routing cache and the bot state are invalidated
+    group = TelegramGroup.objects.get(chat_id=chat_id)
+    group.is_active = is_active
+    group.save(update_fields=['is_active'])
+
+
+@command('group', '/start', admins_only=True)
+def start_group(message, telegram_id):
+    chat_id = message['chat']['id']
+    is_active = bot_state.refresh().groups.get(chat_id)
+    if is_active is None:
+        bot_answer(chat_id, "❗️Guruh ro'yxatdan o'tkazilmagan. Avval /register yuboring.")
+        return 'not registered'
+    if is_active:
+        bot_answer(chat_id, "🤖 Bot allaqachon ishga tushgan.")
+    else:
+        set_group_active(chat_id, True)
+        bot_answer(chat_id, "🤖 Bot ishga tushdi.")
+    return 'started'
+
+
+@command('group', '/stop', admins_only=True)
+def stop_group(message, telegram_id):
+    chat_id = message['chat']['id']
+    is_active = bot_state.refresh().groups.get(chat_id)
+    if is_active is None:
+        bot_answer(chat_id, "❗️Guruh ro'yxatdan o'tkazilmagan. Avval /register yuboring.")
+        return 'not registered'
+    if is_active:
+        set_group_active(chat_id, False)
+        bot_answer(chat_id, "🛑 Bot to‘xtatildi.")
+    else:
+        bot_answer(chat_id, "🛑 Bot allaqachon to'xtatilgan.")
+    return 'stopped'
+
+
+def format_project_stats(name, stats):
+    pipelines, pushes = stats['pipelines'], stats['pushes']
+    lines = [f"📦 *{escape_markdown(name)}*"]
+    if pipelines['total']:
+        rate = pipelines['success_rate']
+        lines.append(f"🔄 Pipeline: {pipelines['total']} ta"
+                     + (f", muvaffaqiyatli {rate * 100:.0f}%" if rate is not None else ""))
+        duration = pipelines['duration']
+        if duration['count']:
+            lines.append(f"⏳ Davomiylik: o'rtacha `{duration['avg']}s`, p50 `{duration['p50']}s`, "
+                         f"p95 `{duration['p95']}s`")
+    if pushes['total']:
+        top = list(pushes['by_user'].items())[:STATS_TOP_USERS]
+        lines.append(f"⬆️ Push: {pushes['total']} ta ("
+                     + ", ".join(f"{escape_markdown(user)}: {pushes_count}" for user, pushes_count in top) + ")")
+    if stats['merge_requests']['total']:
+        lines.append(f"🔀 Merge request: {stats['merge_requests']['total']} ta")
+    return "\n".join(lines)
+
+
+@command('group', '/stats')
+def show_stats(message, telegram_id):
+    # "/stats [days]": the group's projects, direct or through a route, over the last days
+    chat_id = message['chat']['id']
+    args = message['text'].split()[1:]
+    days = int(args[0]) if args and args[0].isdigit() else STATS_DEFAULT_DAYS
+    days = min(max(days, 1), settings.STATS_MAX_DAYS)
+
+    projects = list(GitlabProject.objects.filter(
+        Q(telegram_group__chat_id=chat_id) | Q(routes__telegram_group__chat_id=chat_id)
+    ).values_list('name', flat=True).distinct())
+    if not projects:
+        bot_answer(chat_id, "❗️Bu guruhga hech qanday loyiha ulanmagan.")
+        return 'no projects'
+
+    stats = get_stats(timezone.now() - timedelta(days=days), projects=projects)['projects']
+    if not stats:
+        bot_answer(chat_id, f"📊 Oxirgi {days} kunda hech qanday event bo'lmagan.")
+        return 'stats'
+    text = f"📊 *Oxirgi {days} kun statistikasi*"
+    for name, project_stats in stats.items():
+        section = format_project_stats(name, project_stats)
+        if len(text) + len(section) + 2 > MESSAGE_LIMIT:
+            break
+        text += "\n\n" + section
+    bot_answer(chat_id, text)
+    return 'stats'
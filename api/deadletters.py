@@ -0,0 +1,67 @@
+import json
+import logging
+
+from django_redis import get_redis_connection
+
+from api.cards import load_card
+from api.client import TelegramError
+from api.digests import load_push_digest
+from api.pipelines import pipeline_text
+from api.utils import incr_stat
+from apps.models import DeadLetter
+
+# Deliveries that failed for good: retries ran out (api.queue.schedule_retry), the Bot API refused
+# the message outright, or inline delivery failed during the request. Each one is stored with the
+# text it would have sent, its target and the error, and can be sent again later with
+# `manage.py replay_dead_letters` (or the admin action).
+
+logger = logging.getLogger(__name__)
+
+# answers a retry won't change: bad Markdown or a message that can't be edited (400),
+# bot removed from the chat (403)
+PERMANENT_ERROR_CODES = (400, 403)
+
+
+def is_permanent(error):
+    return isinstance(error, TelegramError) and error.error_code in PERMANENT_ERROR_CODES
+
+
+def rendered_text(job):
+    # pipeline and digest jobs carry no text, the message is rendered from their Redis state
+    if job.get('kind') == 'pipeline':
+        return pipeline_text(job.get('project_id'), job['event_key'])
+    if job.get('kind') == 'push_digest':
+        return load_push_digest(get_redis_connection('default'), job['event_key'])[1]
+    if job.get('kind') == 'mr_card':
+        return load_card(get_redis_connection('default'), job.get('project_id'), job['event_key'])[1]
+    return job.get('text')
+
+
+def capture_dead_letter(job, error):
+    try:
+        text = rendered_text(job)
+    except Exception:
+        # Redis may be what failed the delivery; the job itself is still worth keeping
+        logger.exception("Could not render the text of job %s", job.get('id'))
+        text = None
+
+    try:
+        letter = DeadLetter.objects.create(
+            project_id=job.get('project_id'),
+            chat_id=job['chat_id'],
+            message_thread_id=job.get('thread_id'),
+            kind=job.get('kind', 'message'),
+            event_key=job.get('event_key') or '',
+            text=text or '',
+            job=job,
+            error_class=type(error).__name__,
+            error_code=getattr(error, 'error_code', None),
+            error=str(error),
+            attempts=job.get('attempts', 0),
+        )
+    except Exception:
+        logger.exception("Could not store dead letter of job: %s", json.dumps(job))
+        return None
+
+    incr_stat('dead_letters')
+    return letter
@@ -0,0 +1,112 @@
+import hashlib
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from api.bot import send_message, edit_message
+from api.client import DeliveryError
+from api.rendering import format_commit, build_digest
+from api.utils import incr_stat
+
+DIGEST_KEY = 'gitlab_bot:push_digest'
+
+DIGEST_SCHEDULED = 1
+DIGEST_UPDATED = 2
+
+# KEYS: state hash, commit lines list, "flush scheduled" flag
+# ARGV: rendered push message, number of commits in the push, window ttl (s), flag ttl (ms),
+#       max commit lines kept, commit lines...
+# The window slides: every push extends both keys by the window. Returns 1 when a flush is already
+# pending, 2 when the caller has to schedule one.
+UPDATE_DIGEST_SCRIPT = """
+redis.call('HINCRBY', KEYS[1], 'pushes', 1)
+redis.call('HINCRBY', KEYS[1], 'commits', ARGV[2])
+redis.call('HSET', KEYS[1], 'text', ARGV[1])
+for i = 6, #ARGV do
+    redis.call('RPUSH', KEYS[2], ARGV[i])
+end
+redis.call('LTRIM', KEYS[2], -tonumber(ARGV[5]), -1)
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+if redis.call('SET', KEYS[3], 1, 'NX', 'PX', ARGV[4]) then
+    return 2
+end
+return 1
+"""
+
+_update_script = None
+
+
+def digest_event_key(project_id, branch):
+    return f"{project_id}:push:{branch}"
+
+
+def state_key(event_key):
+    return f"{DIGEST_KEY}:{event_key}"
+
+
+def commits_key(event_key):
+    return f"{DIGEST_KEY}:{event_key}:commits"
+
+
+def flag_key(event_key):
+    return f"{DIGEST_KEY}:{event_key}:scheduled"
+
+
+def update_push_digest(event_key, event, text, window):
+    global _update_script
+    if _update_script is None:
+        _update_script = get_redis_connection('default').register_script(UPDATE_DIGEST_SCRIPT)
+
+    interval = settings.PUSH_DIGEST_EDIT_INTERVAL
+    commits = event['commits'][-settings.PUSH_DIGEST_MAX_COMMITS:]
+    result = _update_script(
+        keys=[state_key(event_key), commits_key(event_key), flag_key(event_key)],
+        # the state outlives a pending flush, so the last push of a window is never lost
+        args=[text, event['total_commits'], window + interval, interval * 1000, settings.PUSH_DIGEST_MAX_COMMITS,
+              *[format_commit(commit) for commit in commits]],
+    )
+    incr_stat('push_digest_pushes')
+    return int(result)
+
+
+def load_push_digest(conn, event_key):
+    # the window's state and its rendered message, (None, None) once the window expired
+    state = {key.decode(): value.decode() for key, value in conn.hgetall(state_key(event_key)).items()}
+    if not state:
+        return None, None
+    lines = [line.decode() for line in conn.lrange(commits_key(event_key), 0, -1)]
+    return state, build_digest(state['text'], int(state['pushes']), int(state['commits']), lines)
+
+
+def flush_push_digest(job):
+    # sends the window's message on the first flush and edits it afterwards
+    conn = get_redis_connection('default')
+    event_key = job['event_key']
+
+    conn.delete(flag_key(event_key))
+    state, text = load_push_digest(conn, event_key)
+    if not state:
+        return
+
+    digest = hashlib.sha1(text.encode()).hexdigest()
+    if state.get('sent_hash') == digest:
+        return
+
+    if state.get('message_id'):
+        edit_message(job['chat_id'], int(state['message_id']), text)
+        sent = {'sent_hash': digest}
+    else:
+        msg = send_message(job['chat_id'], job['thread_id'], text)
+        if 'message_id' not in msg:
+            raise DeliveryError(f"sendMessage returned no message for chat {job['chat_id']}")
+        sent = {'message_id': msg['message_id'], 'sent_hash': digest}
+
+    pipe = conn.pipeline()
+    pipe.hset(state_key(event_key), mapping=sent)
+    pipe.ttl(state_key(event_key))
+    created, ttl = pipe.execute()
+    if ttl == -1:
+        # the window closed while sending: don't leave a key without expiry behind
+        conn.expire(state_key(event_key), settings.PUSH_DIGEST_EDIT_INTERVAL)
+    incr_stat('push_digest_flushes')
@@ -0,0 +1,67 @@
+import re
+from collections import namedtuple
+from fnmatch import translate
+from functools import lru_cache
+
+# Where an event goes: the project's own group plus every GitlabRoute whose filters match it.
+#
+# A project's rules are compiled once into an index: bucketed by event type and status (exact
+# lookups, "" is the wildcard bucket), then by branch, where exact branches are a dict lookup and
+# only glob patterns are tested. Evaluating an event touches the rules that can match it, not every
+# rule of the project, and results are memoized per (event type, branch, status).
+
+Target = namedtuple('Target', ['chat_id', 'thread_id', 'is_active'])
+
+GLOB_CHARS = re.compile(r'[*?\[]')
+
+
+class RuleIndex:
+    def __init__(self, rules):
+        # (gitlab_event, status) -> (exact branch -> targets, [(compiled glob, targets)], any-branch targets)
+        self.buckets = {}
+        for rule in rules:
+            exact, globs, any_branch = self.buckets.setdefault((rule.gitlab_event, rule.status), ({}, [], []))
+            target = Target(rule.chat_id, rule.thread_id, rule.is_active)
+            if not rule.branch:
+                any_branch.append(target)
+            elif GLOB_CHARS.search(rule.branch):
+                globs.append((re.compile(translate(rule.branch)).match, target))
+            else:
+                exact.setdefault(rule.branch, []).append(target)
+
+        self.match = lru_cache(maxsize=256)(self._match)
+
+    def _match(self, gitlab_event, branch, status):
+        targets = []
+        for key in dict.fromkeys(((gitlab_event, status), (gitlab_event, ''), ('', status), ('', ''))):
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                continue
+            exact, globs, any_branch = bucket
+            targets.extend(any_branch)
+            targets.extend(exact.get(branch, ()))
+            targets.extend(target for match, target in globs if match(branch))
+        return tuple(targets)
+
+
+@lru_cache(maxsize=1024)
+def compile_rules(rules):
+    return RuleIndex(rules)
+
+
+def get_targets(project, event):
+    # the project's default group first, then the routes; one message per (chat, topic)
+    targets = []
+    if project.chat_id:
+        targets.append(Target(project.chat_id, project.thread_id, project.is_active))
+    if project.rules:
+        targets.extend(compile_rules(project.rules).match(event['gitlab_event'], event['branch'] or '',
+                                                          event['status'] or ''))
+
+    seen = set()
+    unique = []
+    for target in targets:
+        if (target.chat_id, target.thread_id) not in seen:
+            seen.add((target.chat_id, target.thread_id))
+            unique.append(target)
+    return unique
@@ -0,0 +1,49 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from api.utils import incr_stat
+
+SEEN_KEY = 'gitlab_bot:seen'
+
+# headers identifying a delivery; GitLab sends the same X-Gitlab-Event-UUID when it retries a hook
+DELIVERY_HEADERS = ('X-Gitlab-Event-UUID', 'Idempotency-Key')
+
+
+def get_delivery_id(headers):
+    for header in DELIVERY_HEADERS:
+        value = headers.get(header)
+        if value:
+            return value
+    return None
+
+
+def seen_key(delivery_id):
+    return f"{SEEN_KEY}:{delivery_id}"
+
+
+def claim_delivery(delivery_id):
+    # True for the first delivery with this id, False for a retry that is (or was) already handled
+    if not delivery_id:
+        return True
+    claimed = get_redis_connection('default').set(seen_key(delivery_id), 1, nx=True, ex=settings.WEBHOOK_DEDUP_TTL)
+    if not claimed:
+        incr_stat('webhook_deduplicated')
+    return bool(claimed)
+
+
+def release_delivery(delivery_id):
+    # processing failed: let GitLab's retry through
+    if delivery_id:
+        get_redis_connection('default').delete(seen_key(delivery_id))
+
+
+async def aclaim_delivery(delivery_id):
+    if not delivery_id:
+        return True
+    return await sync_to_async(claim_delivery)(delivery_id)
+
+
+async def arelease_delivery(delivery_id):
+    if delivery_id:
+        await sync_to_async(release_delivery)(delivery_id)
@@ -0,0 +1,74 @@
+import logging
+from contextlib import asynccontextmanager, contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import LockError
+
+from api.client import DeliveryError
+from api.metrics import timer
+
+LOCK_KEY = 'gitlab_bot:lock'
+
+# One delivery per Telegram message at a time, across processes and nodes. Hook state is already
+# updated atomically (the Lua scripts in api.pipelines, api.cards, api.digests), but a delivery
+# reads the message id, sends or edits, then stores the id: two gunicorn workers (inline delivery)
+# or two nodes consuming the same queue shard could both miss the id and both send. Under the
+# lock, the second delivery finds the id (and the hash of the text already sent) and edits or
+# skips instead. Deliveries of different messages never wait for each other.
+
+logger = logging.getLogger(__name__)
+
+
+def get_lock(project_id, event_key):
+    return get_redis_connection('default').lock(
+        f"{LOCK_KEY}:{project_id or 0}:{event_key}",
+        # expires on its own if the process holding it dies mid-delivery
+        timeout=settings.DELIVERY_LOCK_TIMEOUT,
+        blocking_timeout=settings.DELIVERY_LOCK_TIMEOUT,
+        sleep=0.02,
+        # the async variant acquires and releases from different threads
+        thread_local=False,
+    )
+
+
+def release(lock, event_key):
+    try:
+        lock.release()
+    except LockError:
+        logger.warning("Lock of %s expired before its delivery finished", event_key)
+
+
+@contextmanager
+def event_lock(project_id, event_key):
+    if not event_key or not settings.DELIVERY_LOCKS:
+        yield
+        return
+
+    lock = get_lock(project_id, event_key)
+    with timer('lock'):
+        acquired = lock.acquire()
+    if not acquired:
+        raise DeliveryError(f"Timed out waiting for the delivery lock of {event_key}")
+    try:
+        yield
+    finally:
+        release(lock, event_key)
+
+
+@asynccontextmanager
+async def aevent_lock(project_id, event_key):
+    if not event_key or not settings.DELIVERY_LOCKS:
+        yield
+        return
+
+    lock = get_lock(project_id, event_key)
+    with timer('lock'):
+        acquired = await sync_to_async(lock.acquire)()
+    if not acquired:
+        raise DeliveryError(f"Timed out waiting for the delivery lock of {event_key}")
+    try:
+        yield
+    finally:
+        await sync_to_async(release)(lock, event_key)
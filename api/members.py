@@ -0,0 +1,177 @@
+import csv
+import io
+import json
+from collections import namedtuple
+
+from django.db import transaction
+
+from api.mentions import invalidate_mentions
+from apps.models import GitlabProject, GitlabUser
+
+# Bulk sync of GitLab project members into GitlabUser and its projects M2M
+# (manage.py sync_members, or the "Sync members" action on projects in the admin).
+#
+# Input is GitLab's members API output (GET /projects/:id/members/all, a JSON array), a JSON object
+# of project name -> members, or a CSV with id/gitlab_id, username and optional project and
+# telegram_id columns. Everything is reconciled in chunks: one query reads a chunk of existing
+# users, one bulk_update and one bulk_create write it, so thousands of members take a few dozen
+# queries. Members keep the telegram_id they registered with unless the input carries one.
+
+Member = namedtuple('Member', ['gitlab_id', 'username', 'telegram_id'])
+
+BATCH_SIZE = 500
+
+
+class MembersFormatError(ValueError):
+    pass
+
+
+def chunks(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def parse_member(row):
+    gitlab_id = row.get('gitlab_id') or row.get('id')
+    if not gitlab_id:
+        raise MembersFormatError(f"Member without an id: {row}")
+    # blocked members come back from the API too; leave them out
+    if (row.get('state') or 'active') != 'active':
+        return None
+    telegram_id = row.get('telegram_id')
+    return Member(int(gitlab_id), row.get('username') or None, str(telegram_id) if telegram_id else None)
+
+
+def parse_members(content, filename='', project=None):
+    # -> {project name: [Member]}. `project` names the project of a plain member list or of CSV
+    # rows without a project column.
+    if isinstance(content, bytes):
+        content = content.decode('utf-8-sig')
+
+    if filename.endswith('.csv') or not content.lstrip().startswith(('[', '{')):
+        rows = [(row.get('project') or project, row) for row in csv.DictReader(io.StringIO(content))]
+    else:
+        data = json.loads(content)
+        if isinstance(data, dict):
+            rows = [(name, row) for name, members in data.items() for row in members]
+        else:
+            rows = [(project, row) for row in data]
+
+    members = {}
+    for name, row in rows:
+        if not name:
+            raise MembersFormatError("Members without a project: pass the project name or add a project column.")
+        member = parse_member(row)
+        members.setdefault(name, [])
+        if member:
+            members[name].append(member)
+    return members
+
+
+def free_usernames(wanted, batch_size):
+    # GitLab usernames can be renamed and taken by someone else; clear them on rows whose
+    # gitlab_id no longer owns them before anything is written, so the unique index never trips
+    stale = []
+    for chunk in chunks(wanted, batch_size):
+        rows = GitlabUser.objects.filter(gitlab_username__in=chunk).values_list('id', 'gitlab_id', 'gitlab_username')
+        stale.extend(pk for pk, gitlab_id, username in rows if wanted[username] != gitlab_id)
+    for chunk in chunks(stale, batch_size):
+        GitlabUser.objects.filter(pk__in=chunk).update(gitlab_username=None)
+    return len(stale)
+
+
+def save_users(members, batch_size):
+    # -> (gitlab_id -> pk, created, updated)
+    created, updated = [], []
+    for chunk in chunks(members.values(), batch_size):
+        existing = {user.gitlab_id: user for user in GitlabUser.objects.filter(
+            gitlab_id__in=[member.gitlab_id for member in chunk]
+        ).only('id', 'gitlab_id', 'gitlab_username', 'telegram_id')}
+
+        new, changed = [], []
+        for member in chunk:
+            user = existing.get(member.gitlab_id)
+            if user is None:
+                new.append(GitlabUser(gitlab_id=member.gitlab_id, gitlab_username=member.username,
+                                      telegram_id=member.telegram_id))
+                continue
+            username = member.username or user.gitlab_username
+            telegram_id = member.telegram_id or user.telegram_id
+            if (username, telegram_id) != (user.gitlab_username, user.telegram_id):
+                user.gitlab_username, user.telegram_id = username, telegram_id
+                changed.append(user)
+
+        # a user registering through the bot at the same time wins; the sync catches up next run
+        GitlabUser.objects.bulk_create(new, batch_size=batch_size, ignore_conflicts=True)
+        GitlabUser.objects.bulk_update(changed, ['gitlab_username', 'telegram_id'], batch_size=batch_size)
+        created.extend(user.gitlab_id for user in new)
+        updated.extend(user.gitlab_id for user in changed)
+
+    ids = {}
+    for chunk in chunks(members, batch_size):
+        ids.update(GitlabUser.objects.filter(gitlab_id__in=chunk).values_list('gitlab_id', 'id'))
+    return ids, created, updated
+
+
+def link_projects(project_members, project_ids, user_ids, prune, batch_size):
+    Link = GitlabUser.projects.through
+    wanted = {(project_ids[name], user_ids[member.gitlab_id])
+              for name, members in project_members.items() if name in project_ids
+              for member in members if member.gitlab_id in user_ids}
+    current = set(Link.objects.filter(gitlabproject_id__in=project_ids.values()).values_list(
+        'gitlabproject_id', 'gitlabuser_id'
+    ))
+
+    added = [Link(gitlabproject_id=project_id, gitlabuser_id=user_id) for project_id, user_id in wanted - current]
+    Link.objects.bulk_create(added, batch_size=batch_size, ignore_conflicts=True)
+
+    removed = 0
+    if prune:
+        stale = {}
+        for project_id, user_id in current - wanted:
+            stale.setdefault(project_id, []).append(user_id)
+        for project_id, users in stale.items():
+            for chunk in chunks(users, batch_size):
+                removed += Link.objects.filter(gitlabproject_id=project_id, gitlabuser_id__in=chunk).delete()[0]
+    return len(added), removed
+
+
+def sync_members(project_members, prune=False, dry_run=False, batch_size=BATCH_SIZE):
+    # project_members as returned by parse_members. With prune, members missing from the input
+    # are unlinked from its projects (their GitlabUser rows stay). Returns what changed.
+    members = {}
+    for group in project_members.values():
+        for member in group:
+            members[member.gitlab_id] = member
+
+    project_ids = dict(GitlabProject.objects.filter(name__in=project_members).values_list('name', 'id'))
+    usernames = {member.username: member.gitlab_id for member in members.values() if member.username}
+
+    with transaction.atomic():
+        renamed = free_usernames(usernames, batch_size)
+        user_ids, created, updated = save_users(members, batch_size)
+        linked, unlinked = link_projects(project_members, project_ids, user_ids, prune, batch_size)
+        if dry_run:
+            transaction.set_rollback(True)
+
+    if not dry_run:
+        # bulk writes send no signals
+        for chunk in chunks(created + updated, batch_size):
+            invalidate_mentions(*chunk)
+
+    return {
+        'members': len(members),
+        'created': len(created),
+        'updated': len(updated),
+        'usernames_freed': renamed,
+        'linked': linked,
+        'unlinked': unlinked,
+        'unknown_projects': sorted(set(project_members) - set(project_ids)),
+    }
+
+
+def format_result(result):
+    return (f"{result['members']} members: {result['created']} created, {result['updated']} updated, "
+            f"{result['usernames_freed']} usernames taken over, {result['linked']} project links added, "
+            f"{result['unlinked']} removed")
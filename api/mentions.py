@@ -0,0 +1,104 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from api.metrics import count
+from api.utils import incr_stats
+from apps.models import GitlabUser
+
+MENTION_KEY = 'gitlab_bot:mention'
+
+# Resolves every GitLab user of a hook (author, assignees, reviewers) to a telegram id with one
+# MGET and, for cache misses, one query. Unregistered users are cached too (as ''), so they don't
+# cost a query on every hook either.
+
+
+def mention_key(gitlab_id):
+    return f"{MENTION_KEY}:{gitlab_id}"
+
+
+def get_event_users(event):
+    users = [{'id': event.get('user_id'), 'username': event.get('user_name')}]
+    users.extend(event.get('assignees', []))
+    users.extend(event.get('reviewers', []))
+    return [user for user in users if user.get('id')]
+
+
+def split_cached(users, cached):
+    telegram_ids = {}
+    missing = {}
+    for user in users:
+        key = mention_key(user['id'])
+        if key in cached:
+            if cached[key]:
+                telegram_ids[user['id']] = cached[key]
+        else:
+            missing.setdefault(user['id'], user)
+    return telegram_ids, list(missing.values())
+
+
+def missing_users_query(missing):
+    ids = {user['id'] for user in missing}
+    usernames = {user['username'] for user in missing if user.get('username')}
+    return GitlabUser.objects.filter(Q(gitlab_id__in=ids) | Q(gitlab_username__in=usernames)).values_list(
+        'gitlab_id', 'gitlab_username', 'telegram_id'
+    )
+
+
+def match_missing(missing, rows):
+    by_id = {gitlab_id: telegram_id for gitlab_id, username, telegram_id in rows}
+    by_username = {username: telegram_id for gitlab_id, username, telegram_id in rows if username}
+
+    resolved = {}
+    for user in missing:
+        resolved[user['id']] = by_id.get(user['id']) or by_username.get(user.get('username')) or ''
+    return resolved
+
+
+def record(hits, misses):
+    incr_stats(mention_cache_hits=hits, mention_cache_misses=misses)
+    count('cache_lookups_total', hits, cache='mentions', result='hit')
+    count('cache_lookups_total', misses, cache='mentions', result='miss')
+
+
+def resolve_mentions(event):
+    users = get_event_users(event)
+    if not users:
+        return {}
+
+    cached = cache.get_many({mention_key(user['id']) for user in users})
+    telegram_ids, missing = split_cached(users, cached)
+    record(len({user['id'] for user in users}) - len(missing), len(missing))
+
+    if missing:
+        resolved = match_missing(missing, missing_users_query(missing))
+        cache.set_many({mention_key(gitlab_id): value for gitlab_id, value in resolved.items()},
+                       timeout=settings.MENTION_CACHE_TTL)
+        telegram_ids.update({gitlab_id: value for gitlab_id, value in resolved.items() if value})
+
+    return telegram_ids
+
+
+async def aresolve_mentions(event):
+    users = get_event_users(event)
+    if not users:
+        return {}
+
+    cached = await cache.aget_many({mention_key(user['id']) for user in users})
+    telegram_ids, missing = split_cached(users, cached)
+    await sync_to_async(record)(len({user['id'] for user in users}) - len(missing), len(missing))
+
+    if missing:
+        rows = [row async for row in missing_users_query(missing)]
+        resolved = match_missing(missing, rows)
+        await cache.aset_many({mention_key(gitlab_id): value for gitlab_id, value in resolved.items()},
+                              timeout=settings.MENTION_CACHE_TTL)
+        telegram_ids.update({gitlab_id: value for gitlab_id, value in resolved.items() if value})
+
+    return telegram_ids
+
+
+def invalidate_mentions(*gitlab_ids):
+    if gitlab_ids:
+        cache.delete_many([mention_key(gitlab_id) for gitlab_id in gitlab_ids])
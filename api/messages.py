@@ -0,0 +1,135 @@
+import random
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+
+MESSAGES_KEY = 'gitlab_bot:messages'
+
+# Which Telegram message belongs to which merge request or pipeline, so later hooks edit it instead
+# of posting a new one. One Redis hash per project (field: event key, value: "<message id>:<expires
+# at>") instead of one top-level key per message: keys of different projects can't collide, the
+# mappings don't mix with the rest of the cache, and small hashes are stored compactly by Redis.
+#
+# Hash fields can't expire on their own, so the expiry is kept in the value: reads treat expired
+# entries as missing and an entry read after half its TTL is extended, so a merge request that stays
+# open for days keeps its message. Expired entries are pruned now and then on write, and the whole
+# hash expires MESSAGE_ID_TTL after the project's last write.
+
+# share of writes that also prune the project's expired entries
+PRUNE_PROBABILITY = 0.02
+
+PRUNE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local entries = redis.call('HGETALL', KEYS[1])
+local removed = 0
+for i = 1, #entries, 2 do
+    local expires_at = tonumber(string.match(entries[i + 1], ':(%d+)$'))
+    if expires_at and expires_at < now then
+        redis.call('HDEL', KEYS[1], entries[i])
+        removed = removed + 1
+    end
+end
+return removed
+"""
+
+_prune_script = None
+
+
+def messages_key(project_id):
+    # jobs queued before project ids were added share namespace 0
+    return f"{MESSAGES_KEY}:{project_id or 0}"
+
+
+def encode(message_id, now):
+    return f"{message_id}:{int(now) + settings.MESSAGE_ID_TTL}"
+
+
+def decode(value):
+    message_id, expires_at = value.decode().rsplit(':', 1)
+    return int(message_id), int(expires_at)
+
+
+def get_message_id(project_id, event_key):
+    conn = get_redis_connection('default')
+    key = messages_key(project_id)
+    # the old top-level key is read in the same round-trip, until the last of them expires
+    pipe = conn.pipeline(transaction=False)
+    pipe.hget(key, event_key)
+    pipe.get(cache.make_key(event_key))
+    value, legacy = pipe.execute()
+
+    now = time.time()
+    if value is None:
+        if legacy is None:
+            return None
+        message_id = int(cache.client.decode(legacy))
+        save_message_id(project_id, event_key, message_id)
+        cache.delete(event_key)
+        return message_id
+
+    message_id, expires_at = decode(value)
+    if expires_at < now:
+        return None
+    if expires_at - now < settings.MESSAGE_ID_TTL / 2:
+        save_message_id(project_id, event_key, message_id)
+    return message_id
+
+
+def save_message_id(project_id, event_key, message_id):
+    conn = get_redis_connection('default')
+    key = messages_key(project_id)
+    pipe = conn.pipeline(transaction=False)
+    pipe.hset(key, event_key, encode(message_id, time.time()))
+    pipe.expire(key, settings.MESSAGE_ID_TTL)
+    pipe.execute()
+    if random.random() < PRUNE_PROBABILITY:
+        prune_message_ids(project_id)
+
+
+def delete_message_id(project_id, event_key):
+    get_redis_connection('default').hdel(messages_key(project_id), event_key)
+
+
+def prune_message_ids(project_id):
+    global _prune_script
+    if _prune_script is None:
+        _prune_script = get_redis_connection('default').register_script(PRUNE_SCRIPT)
+    return int(_prune_script(keys=[messages_key(project_id)], args=[int(time.time())]))
+
+
+async def aget_message_id(project_id, event_key):
+    return await sync_to_async(get_message_id)(project_id, event_key)
+
+
+async def asave_message_id(project_id, event_key, message_id):
+    await sync_to_async(save_message_id)(project_id, event_key, message_id)
+
+
+async def adelete_message_id(project_id, event_key):
+    await sync_to_async(delete_message_id)(project_id, event_key)
+
+
+def message_store_stats():
+    # project id -> entries, expired entries and bytes used by its hash, in one pipeline
+    conn = get_redis_connection('default')
+    keys = list(conn.scan_iter(match=f"{MESSAGES_KEY}:*", count=500))
+    pipe = conn.pipeline(transaction=False)
+    for key in keys:
+        pipe.hvals(key)
+        pipe.memory_usage(key)
+    results = pipe.execute()
+
+    now = time.time()
+    stats = {}
+    for index, key in enumerate(keys):
+        values, size = results[index * 2], results[index * 2 + 1]
+        project_id = int(key.decode().rsplit(':', 1)[1])
+        stats[project_id] = {
+            'entries': len(values),
+            'expired': sum(1 for value in values if decode(value)[1] < now),
+            'bytes': size or 0,
+        }
+    return stats
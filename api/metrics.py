@@ -0,0 +1,189 @@
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connection
+from django_redis import get_redis_connection
+
+from api.utils import get_stats
+
+# Request-scoped metrics, exported in the Prometheus text format by MetricsAPIView.
+#
+# A collector is opened per request (MetricsMiddleware) or per delivery job (run_worker). Code on
+# the hot path only adds numbers to it: stage timings, ORM queries, cache lookups, Bot API calls.
+# When the collector closes, its numbers are labeled with what the view learned on the way (event
+# type, project) and written to one Redis hash in a single round-trip, so every process (gunicorn
+# workers, delivery workers) feeds the same series. With METRICS_ENABLED off no collector is
+# opened and every helper below returns immediately.
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY = 'gitlab_bot:metrics'
+PREFIX = 'gitlab_bot_'
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# name -> (type, help)
+METRICS = {
+    'http_requests_total': ('counter', "Requests by view and status code."),
+    'http_request_seconds': ('histogram', "Request duration by view."),
+    'stage_seconds': ('summary', "Time spent per stage of a request or delivery job."),
+    'db_queries_total': ('counter', "ORM queries run by requests and delivery jobs."),
+    'cache_lookups_total': ('counter', "Routing and mention cache lookups by result."),
+    'telegram_api_responses_total': ('counter', "Bot API responses by method and status code."),
+    'telegram_api_seconds': ('summary', "Bot API round-trip time by method."),
+    'telegram_throttle_seconds': ('summary', "Time spent waiting for the rate limiter."),
+    'errors_total': ('counter', "Exceptions caught by the webhook views and delivery workers."),
+    'webhook_rejected_total': ('counter', "GitLab webhook requests turned away by WebhookGuardMiddleware."),
+    'telegram_updates_total': ('counter', "Telegram updates by whether they carried one of the bot's commands."),
+    'bot_commands_total': ('counter', "Bot commands handled, by command and result."),
+}
+
+_collector = ContextVar('metrics_collector', default=None)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def series(name, labels):
+    if not labels:
+        return PREFIX + name
+    rendered = ','.join(f'{key}="{escape_label(value)}"' for key, value in sorted(labels.items()))
+    return f"{PREFIX}{name}{{{rendered}}}"
+
+
+class Collector:
+    def __init__(self, **labels):
+        self.labels = labels
+        self.values = defaultdict(float)
+        self.queries = 0
+
+    def add(self, name, amount=1, **labels):
+        self.values[name, tuple(sorted(labels.items()))] += amount
+
+    def observe(self, name, seconds, **labels):
+        self.add(f"{name}_sum", seconds, **labels)
+        self.add(f"{name}_count", 1, **labels)
+
+    def count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def fields(self):
+        # the labels set while collecting (event type, project) apply to every value
+        fields = defaultdict(float)
+        for (name, labels), amount in self.values.items():
+            fields[series(name, {**self.labels, **dict(labels)})] += amount
+        if self.queries:
+            fields[series('db_queries_total', self.labels)] += self.queries
+        return fields
+
+    def flush(self):
+        fields = self.fields()
+        if not fields:
+            return
+        pipe = get_redis_connection('default').pipeline(transaction=False)
+        for field, amount in fields.items():
+            pipe.hincrbyfloat(METRICS_KEY, field, amount)
+        pipe.execute()
+
+
+@contextmanager
+def collect(**labels):
+    if not settings.METRICS_ENABLED:
+        yield None
+        return
+
+    collector = Collector(**labels)
+    token = _collector.set(collector)
+    try:
+        with connection.execute_wrapper(collector.count_query):
+            yield collector
+    except Exception as e:
+        collector.add('errors_total', exception=type(e).__name__)
+        raise
+    finally:
+        _collector.reset(token)
+        try:
+            collector.flush()
+        except Exception:
+            # losing a request's metrics must not fail the request
+            logger.exception("Could not write metrics")
+
+
+def set_labels(**labels):
+    collector = _collector.get()
+    if collector is not None:
+        collector.labels.update(labels)
+
+
+def count(name, amount=1, **labels):
+    collector = _collector.get()
+    if collector is not None:
+        collector.add(name, amount, **labels)
+
+
+def observe(name, seconds, **labels):
+    collector = _collector.get()
+    if collector is not None:
+        collector.observe(name, seconds, **labels)
+
+
+@contextmanager
+def timer(stage):
+    collector = _collector.get()
+    if collector is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        collector.observe('stage_seconds', time.perf_counter() - started, stage=stage)
+
+
+def observe_request(collector, view, status_code, seconds):
+    collector.add('http_requests_total', view=view, code=status_code)
+    collector.add('http_request_seconds_sum', seconds, view=view)
+    collector.add('http_request_seconds_count', view=view)
+    for bucket in REQUEST_BUCKETS:
+        if seconds <= bucket:
+            collector.add('http_request_seconds_bucket', view=view, le=bucket)
+    collector.add('http_request_seconds_bucket', view=view, le='+Inf')
+
+
+def metric_name(field):
+    # "gitlab_bot_stage_seconds_sum{...}" -> "stage_seconds"
+    name = field.split('{', 1)[0][len(PREFIX):]
+    if name in METRICS:
+        return name
+    for suffix in ('_sum', '_count', '_bucket'):
+        if name.endswith(suffix) and name[:-len(suffix)] in METRICS:
+            return name[:-len(suffix)]
+    return name
+
+
+def render_metrics():
+    raw = get_redis_connection('default').hgetall(METRICS_KEY)
+    grouped = defaultdict(list)
+    for field, value in raw.items():
+        field = field.decode()
+        grouped[metric_name(field)].append((field, float(value)))
+
+    lines = []
+    for name in sorted(grouped):
+        metric_type, help_text = METRICS.get(name, ('untyped', ''))
+        lines.append(f"# HELP {PREFIX}{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}{name} {metric_type}")
+        lines.extend(f"{field} {value}" for field, value in sorted(grouped[name]))
+
+    # the counters kept by the queue, pipelines, digests and mention cache (api.utils.incr_stat)
+    for name, value in sorted(get_stats().items()):
+        lines.append(f"# TYPE {PREFIX}{name} untyped")
+        lines.append(f"{PREFIX}{name} {value}")
+
+    return '\n'.join(lines) + '\n'
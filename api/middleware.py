@@ -0,0 +1,154 @@
+import re
+import time
+from fnmatch import translate
+from functools import lru_cache
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.crypto import constant_time_compare
+from django_redis import get_redis_connection
+
+from api.metrics import collect, count, observe_request
+from api.payloads import extract_keys
+from api.routing import get_route
+from api.services import GITLAB_EVENTS
+
+RATE_KEY = 'gitlab_bot:webhook_rate'
+
+# url names of the GitLab webhook views
+GUARDED_VIEWS = ('gitlab-webhook', 'gitlab-webhook-async')
+
+
+class MetricsMiddleware:
+    # opens a metrics collector around every request (see api.metrics); a no-op unless METRICS_ENABLED
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        with collect() as collector:
+            started = time.perf_counter()
+            response = self.get_response(request)
+            observe_request(collector, view_name(request), response.status_code, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+
+        with collect() as collector:
+            started = time.perf_counter()
+            response = await self.get_response(request)
+            observe_request(collector, view_name(request), response.status_code, time.perf_counter() - started)
+        return response
+
+
+def view_name(request):
+    # the url name, so the label set stays small whatever paths are requested
+    match = getattr(request, 'resolver_match', None)
+    return match.url_name if match and match.url_name else 'other'
+
+
+class WebhookGuardMiddleware:
+    # Turns away requests to the GitLab webhook before the view (and DRF) touch them, cheapest check
+    # first: the X-Gitlab-Token secret (no I/O), the per-ip rate limit (one Redis round-trip), the
+    # project allow/deny lists (the body is scanned only up to its "project" key, which follows the
+    # small object_kind/ref/user keys and precedes the large commits/builds arrays), and unknown
+    # projects (the cached route). Event types the bot ignores are left to the view, which answers
+    # them from the header alone: a 403 would make GitLab count a failing hook. Under ASGI Django
+    # runs process_view in a thread, so the same checks serve gitlab-webhook-async.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.resolver_match.url_name not in GUARDED_VIEWS:
+            return None
+        if request.headers.get('X-Gitlab-Event') not in GITLAB_EVENTS:
+            return None
+
+        token = settings.GITLAB_WEBHOOK_SECRET_TOKEN
+        if token and not constant_time_compare(request.headers.get('X-Gitlab-Token', ''), token):
+            return reject('token', 'Invalid webhook token', 401)
+
+        if settings.WEBHOOK_RATE_LIMIT and over_rate_limit(client_ip(request)):
+            return reject('rate_limit', 'Too many requests', 429)
+
+        if settings.WEBHOOK_ALLOWED_PROJECTS or settings.WEBHOOK_DENIED_PROJECTS \
+                or not settings.WEBHOOK_AUTO_CREATE_PROJECTS:
+            # a body the view can't parse either is left to the view and its 400
+            name = project_name(request.body)
+            if name is None:
+                return None
+            if not project_allowed(name):
+                return reject('project_denied', 'Project is not allowed', 403)
+            if not settings.WEBHOOK_AUTO_CREATE_PROJECTS and get_route(name, create=False) is None:
+                return reject('unknown_project', 'Unknown project', 403)
+        return None
+
+
+def reject(reason, message, status):
+    count('webhook_rejected_total', reason=reason)
+    return JsonResponse({'error': message}, status=status)
+
+
+def client_ip(request):
+    header = settings.WEBHOOK_CLIENT_IP_HEADER
+    if header and request.headers.get(header):
+        # the last hop is the one added by our own proxy, earlier ones are whatever the client sent
+        return request.headers[header].split(',')[-1].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def over_rate_limit(ip):
+    # fixed one-minute window per ip
+    key = f"{RATE_KEY}:{ip}:{int(time.time() // 60)}"
+    pipe = get_redis_connection('default').pipeline(transaction=False)
+    pipe.incr(key)
+    pipe.expire(key, 60)
+    requests, _ = pipe.execute()
+    return requests > settings.WEBHOOK_RATE_LIMIT
+
+
+def project_name(body):
+    try:
+        project = extract_keys(body.decode('utf-8'), ('project',)).get('project')
+    except ValueError:
+        return None
+    name = project.get('name') if isinstance(project, dict) else None
+    return name if isinstance(name, str) else None
+
+
+@lru_cache(maxsize=8)
+def compile_patterns(patterns):
+    return re.compile('|'.join(translate(pattern) for pattern in patterns)).match if patterns else None
+
+
+def project_allowed(name):
+    denied = compile_patterns(tuple(settings.WEBHOOK_DENIED_PROJECTS))
+    if denied and denied(name):
+        return False
+    allowed = compile_patterns(tuple(settings.WEBHOOK_ALLOWED_PROJECTS))
+    return allowed is None or bool(allowed(name))
@@ -0,0 +1,67 @@
+import json
+import re
+
+# Selective extraction of GitLab hook bodies. The view only reads a handful of top-level keys, while
+# push hooks carry every commit with its file lists and pipeline hooks the whole `builds` array.
+# Instead of building the full document (request.data), the top-level object is scanned key by key:
+# wanted values are decoded, and scanning stops as soon as all of them are found, so what comes after
+# the last wanted key is never decoded: a pipeline's `builds` array is skipped entirely.
+# Push hooks gain the least: the digest needs `commits`, and `total_commits_count` is the last key,
+# so the whole body is scanned and every commit (with its file lists) decoded. GitLab caps that
+# array at 20 commits, so only the cost of building request.data is saved there.
+
+# top-level keys parse_gitlab_event reads, per hook; a key missing from a payload makes the scan
+# run to the end, so only keys GitLab always sends are listed
+HOOK_KEYS = {
+    'push': frozenset(('project', 'ref', 'user_username', 'user_id', 'user_name', 'commits',
+                       'total_commits_count')),
+    'merge': frozenset(('project', 'user', 'object_attributes', 'assignees', 'reviewers')),
+    # the ref of a pipeline is in object_attributes; merge_request is null for branch pipelines
+    'pipeline': frozenset(('project', 'user', 'object_attributes', 'merge_request')),
+}
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+decoder = json.JSONDecoder()
+
+
+def extract_keys(document, keys):
+    # decodes only `keys` of the top-level object in `document`; raises ValueError on invalid JSON
+    wanted = set(keys)
+    result = {}
+
+    index = WHITESPACE.match(document, 0).end()
+    if document[index:index + 1] != '{':
+        raise ValueError("Hook payload is not a JSON object")
+    index = WHITESPACE.match(document, index + 1).end()
+    if document[index:index + 1] == '}':
+        return result
+
+    while wanted:
+        key, index = decoder.raw_decode(document, index)
+        index = WHITESPACE.match(document, index).end()
+        if not isinstance(key, str) or document[index:index + 1] != ':':
+            raise ValueError(f"Expected a key at position {index}")
+        index = WHITESPACE.match(document, index + 1).end()
+
+        # values of other keys still have to be decoded to find where they end, then are dropped
+        value, index = decoder.raw_decode(document, index)
+        if key in wanted:
+            result[key] = value
+            wanted.discard(key)
+
+        index = WHITESPACE.match(document, index).end()
+        separator = document[index:index + 1]
+        if separator == '}':
+            break
+        if separator != ',':
+            raise ValueError(f"Expected ',' or '}}' at position {index}")
+        index = WHITESPACE.match(document, index + 1).end()
+
+    return result
+
+
+def load_hook(gitlab_event, body):
+    if isinstance(body, bytes):
+        body = body.decode('utf-8')
+    return extract_keys(body, HOOK_KEYS[gitlab_event])
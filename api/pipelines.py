@@ -0,0 +1,117 @@
+import hashlib
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from api.bot import send_message, edit_message
+from api.client import DeliveryError
+from api.messages import get_message_id, save_message_id
+from api.utils import incr_stat
+
+PIPELINE_KEY = 'gitlab_bot:pipeline'
+
+FINAL_PIPELINE_STATUSES = ['success', 'failed', 'canceled', 'skipped']
+
+# order of the non-final statuses; a hook never moves a pipeline back to a lower rank
+PIPELINE_STATUS_RANK = {
+    'created': 0,
+    'waiting_for_resource': 0,
+    'preparing': 0,
+    'scheduled': 0,
+    'pending': 1,
+    'running': 2,
+    'manual': 2,
+}
+FINAL_RANK = 3
+
+PIPELINE_STALE = 0
+PIPELINE_SCHEDULED = 1
+PIPELINE_UPDATED = 2
+
+# KEYS: state hash, "flush scheduled" flag
+# ARGV: status, rank, is final (0/1), rendered text, state ttl (s), flag ttl (ms)
+# Returns 0 when the hook is stale and was dropped, 1 when the state was updated and a flush is
+# already pending, 2 when the caller has to schedule the flush.
+UPDATE_STATE_SCRIPT = """
+local current = redis.call('HMGET', KEYS[1], 'rank', 'final')
+local rank = tonumber(ARGV[2])
+local final = tonumber(ARGV[3])
+if current[1] then
+    local current_rank = tonumber(current[1])
+    local current_final = tonumber(current[2])
+    if current_final == 1 and final == 0 then
+        return 0
+    end
+    if current_final == 0 and final == 0 and rank < current_rank then
+        return 0
+    end
+end
+redis.call('HSET', KEYS[1], 'status', ARGV[1], 'rank', rank, 'final', final, 'text', ARGV[4])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+if redis.call('SET', KEYS[2], 1, 'NX', 'PX', ARGV[6]) then
+    return 2
+end
+return 1
+"""
+
+_update_script = None
+
+
+# scoped by project like the message ids (api.messages): pipeline ids of different projects, or of
+# different GitLab instances, may collide; jobs queued before project ids were added share namespace 0
+def state_key(project_id, event_key):
+    return f"{PIPELINE_KEY}:{project_id or 0}:{event_key}"
+
+
+def flag_key(project_id, event_key):
+    return f"{PIPELINE_KEY}:{project_id or 0}:{event_key}:scheduled"
+
+
+def update_pipeline_state(project_id, event_key, status, text):
+    global _update_script
+    if _update_script is None:
+        _update_script = get_redis_connection('default').register_script(UPDATE_STATE_SCRIPT)
+
+    final = status in FINAL_PIPELINE_STATUSES
+    rank = FINAL_RANK if final else PIPELINE_STATUS_RANK.get(status, 0)
+    result = _update_script(
+        keys=[state_key(project_id, event_key), flag_key(project_id, event_key)],
+        args=[status, rank, int(final), text, settings.PIPELINE_STATE_TTL, settings.PIPELINE_FLUSH_FLAG_TTL * 1000],
+    )
+    return int(result)
+
+
+def pipeline_text(project_id, event_key):
+    # the latest accepted rendering of a pipeline, None once its state expired
+    text = get_redis_connection('default').hget(state_key(project_id, event_key), 'text')
+    return text.decode() if text is not None else None
+
+
+def flush_pipeline(job):
+    # sends or edits the pipeline message with the latest accepted state, whatever hook scheduled it
+    conn = get_redis_connection('default')
+    project_id = job.get('project_id')
+    event_key = job['event_key']
+
+    conn.delete(flag_key(project_id, event_key))
+    state = {key.decode(): value.decode() for key, value in conn.hgetall(state_key(project_id, event_key)).items()}
+    if not state:
+        return
+
+    text = state['text']
+    digest = hashlib.sha1(text.encode()).hexdigest()
+    if state.get('sent_hash') == digest:
+        incr_stat('pipeline_flush_skipped')
+        return
+
+    msg_id = get_message_id(project_id, event_key)
+    if msg_id:
+        edit_message(job['chat_id'], int(msg_id), text)
+    else:
+        msg = send_message(job['chat_id'], job['thread_id'], text)
+        if 'message_id' not in msg:
+            raise DeliveryError(f"sendMessage returned no message for chat {job['chat_id']}")
+        save_message_id(project_id, event_key, msg['message_id'])
+
+    conn.hset(state_key(project_id, event_key), 'sent_hash', digest)
+    incr_stat('pipeline_flush_sent')
@@ -0,0 +1,107 @@
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django_redis import get_redis_connection
+
+from api.bot import get_updates
+from api.client import TelegramError
+from api.commands import handle_update
+from api.metrics import collect, timer
+
+# Long-polling alternative to the Telegram webhook, for deployments Telegram can't reach
+# (python manage.py poll_updates).
+#
+# Each getUpdates call waits up to TELEGRAM_POLL_TIMEOUT seconds for a batch. The batch is grouped
+# by chat and the chats are handled concurrently, each chat's updates in order, by the same handlers
+# as TelegramWebhookAPIView (api.commands.handle_update). The next offset is stored in Redis once the
+# batch is done, so a restarted poller carries on where the last one stopped; an update is handled
+# again only if the poller dies in the middle of its batch.
+
+logger = logging.getLogger(__name__)
+
+OFFSET_KEY = 'gitlab_bot:updates_offset'
+ALLOWED_UPDATES = ('message', 'edited_message')
+ERROR_BACKOFF = (1, 2, 5, 10, 30)  # seconds between failed getUpdates calls
+# a wrong token (401, 404) or a webhook still set (409): retrying won't help
+FATAL_ERROR_CODES = (401, 404, 409)
+
+
+def update_chat(update):
+    message = update.get('message') or update.get('edited_message') or {}
+    return message.get('chat', {}).get('id')
+
+
+def by_chat(updates):
+    # chat id -> its updates, in the order Telegram sent them
+    chats = OrderedDict()
+    for update in updates:
+        chats.setdefault(update_chat(update), []).append(update)
+    return list(chats.values())
+
+
+class Poller:
+    def __init__(self, concurrency=None, timeout=None, limit=None):
+        self.concurrency = concurrency or settings.TELEGRAM_POLL_CONCURRENCY
+        self.timeout = settings.TELEGRAM_POLL_TIMEOUT if timeout is None else timeout
+        self.limit = limit or settings.TELEGRAM_POLL_LIMIT
+        self.stopping = threading.Event()
+        self.handled = 0
+        self.conn = get_redis_connection('default')
+
+    def load_offset(self):
+        offset = self.conn.get(OFFSET_KEY)
+        return int(offset) if offset is not None else None
+
+    def save_offset(self, offset):
+        self.conn.set(OFFSET_KEY, offset)
+
+    def handle_chat(self, updates):
+        for update in updates:
+            try:
+                with collect(source='poll'), timer('command'):
+                    handle_update(update)
+            except Exception:
+                # same as the webhook: a failed command is logged, not retried
+                logger.exception("Could not handle update %s", update.get('update_id'))
+            finally:
+                close_old_connections()
+        return len(updates)
+
+    def handle_batch(self, executor, updates):
+        chats = by_chat(updates)
+        if len(chats) == 1:
+            self.handled += self.handle_chat(chats[0])
+        else:
+            self.handled += sum(executor.map(self.handle_chat, chats))
+
+    def run(self):
+        offset = self.load_offset()
+        failures = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='poll') as executor:
+            while not self.stopping.is_set():
+                try:
+                    updates = get_updates(offset, self.timeout, self.limit, ALLOWED_UPDATES)
+                except Exception as e:
+                    if isinstance(e, TelegramError) and e.error_code in FATAL_ERROR_CODES:
+                        raise
+                    delay = ERROR_BACKOFF[min(failures, len(ERROR_BACKOFF) - 1)]
+                    failures += 1
+                    logger.warning("getUpdates failed (%s), retrying in %ss", e, delay)
+                    self.stopping.wait(delay)
+                    continue
+
+                failures = 0
+                if not updates:
+                    continue
+                self.handle_batch(executor, updates)
+                offset = updates[-1]['update_id'] + 1
+                self.save_offset(offset)
+
+    def stop(self):
+        # the call in flight returns within TELEGRAM_POLL_TIMEOUT; its batch is finished first
+        self.stopping.set()
+
@@ -0,0 +1,383 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import signal
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from zlib import crc32
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from api.bot import send_message, edit_message, asend_message, aedit_message
+from api.cards import flush_card
+from api.client import DeliveryError, TelegramError
+from api.deadletters import capture_dead_letter, is_permanent
+from api.locks import event_lock, aevent_lock
+from api.digests import flush_push_digest
+from api.messages import get_message_id, save_message_id, delete_message_id, aget_message_id, \
+    asave_message_id, adelete_message_id
+from api.metrics import collect, timer
+from api.pipelines import flush_pipeline
+from api.routing import migrate_chat
+from api.utils import incr_stat, set_stat
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = 'gitlab_bot:queue'
+PROCESSING_KEY = 'gitlab_bot:queue:processing'
+DELAYED_KEY = 'gitlab_bot:queue:delayed'
+SENT_KEY = 'gitlab_bot:sent'
+
+# how long an idle worker blocks on its shard before looking at delayed jobs again
+POLL_TIMEOUT = 0.25
+# a job whose dead letter couldn't be stored (database down) is tried again after this long (seconds)
+DEAD_LETTER_RETRY_DELAY = 60
+
+_fanout_pool = None
+_fanout_pool_pid = None
+_fanout_lock = threading.Lock()
+
+
+def get_shard(job):
+    # jobs for the same message (or the same chat) always land on one shard,
+    # so a single worker keeps their order
+    routing_key = job.get('event_key') or str(job['chat_id'])
+    return crc32(routing_key.encode()) % settings.TELEGRAM_DELIVERY_WORKERS
+
+
+def queue_key(shard):
+    return f"{QUEUE_KEY}:{shard}"
+
+
+def processing_key(shard):
+    return f"{PROCESSING_KEY}:{shard}"
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode()).hexdigest() if text is not None else None
+
+
+def make_job(chat_id, thread_id, text, event_key, final, kind='message', project_id=None):
+    return {
+        'id': uuid.uuid4().hex,
+        'kind': kind,
+        'project_id': project_id,
+        'chat_id': chat_id,
+        'thread_id': thread_id,
+        'text': text,
+        'text_hash': text_hash(text),
+        'event_key': event_key,
+        'final': final,
+        'attempts': 0,
+        'enqueued_at': time.time(),
+    }
+
+
+# with event_key the message already sent for that key is edited instead of sending a new one,
+# final=True forgets the key once the message is delivered.
+# kind='pipeline' jobs carry no text, the worker renders the latest pipeline state (api.pipelines);
+# delay (seconds) holds the job back, inline delivery ignores it.
+# An inline delivery that fails is kept as a dead letter (api.deadletters) instead of failing the hook.
+def enqueue_message(chat_id, thread_id, text, event_key=None, final=False, kind='message', delay=0,
+                    project_id=None):
+    job = make_job(chat_id, thread_id, text, event_key, final, kind, project_id)
+
+    if settings.TELEGRAM_DELIVERY_MODE == 'inline':
+        try:
+            deliver(job)
+        except Exception as e:
+            logger.exception("Inline delivery to chat %s failed", chat_id)
+            capture_dead_letter(job, e)
+        return job
+
+    queue_job(get_redis_connection('default'), job, delay)
+    return job
+
+
+def queue_job(conn, job, delay=0):
+    job['shard'] = get_shard(job)
+    if delay:
+        job['enqueued_at'] += delay
+        conn.zadd(DELAYED_KEY, {json.dumps(job): job['enqueued_at']})
+    else:
+        conn.lpush(queue_key(job['shard']), json.dumps(job))
+
+
+def get_fanout_pool():
+    global _fanout_pool, _fanout_pool_pid
+
+    # threads don't survive a fork, a worker process builds its own pool
+    if _fanout_pool is None or _fanout_pool_pid != os.getpid():
+        with _fanout_lock:
+            if _fanout_pool is None or _fanout_pool_pid != os.getpid():
+                _fanout_pool = ThreadPoolExecutor(settings.TELEGRAM_FANOUT_WORKERS, thread_name_prefix='fanout')
+                _fanout_pool_pid = os.getpid()
+    return _fanout_pool
+
+
+# the jobs of one hook (one per target chat, see api.fanout): queued in a single round-trip, or,
+# inline, delivered concurrently on a bounded pool
+def enqueue_messages(jobs):
+    if settings.TELEGRAM_DELIVERY_MODE == 'inline':
+        if len(jobs) == 1:
+            return [enqueue_message(**jobs[0])]
+        pool = get_fanout_pool()
+        # copy_context: Bot API metrics go to the request's collector
+        futures = [pool.submit(contextvars.copy_context().run, enqueue_message, **job) for job in jobs]
+        return [future.result() for future in futures]
+
+    pipe = get_redis_connection('default').pipeline(transaction=False)
+    queued = []
+    for job in jobs:
+        delay = job.get('delay', 0)
+        queued_job = make_job(job['chat_id'], job['thread_id'], job['text'], job.get('event_key'),
+                              job.get('final', False), job.get('kind', 'message'), job.get('project_id'))
+        queue_job(pipe, queued_job, delay)
+        queued.append(queued_job)
+    pipe.execute()
+    return queued
+
+
+def deliver(job):
+    try:
+        deliver_job(job)
+    except TelegramError as e:
+        new_chat_id = e.parameters.get('migrate_to_chat_id')
+        if not new_chat_id:
+            raise
+        logger.warning("Chat %s migrated to %s", job['chat_id'], new_chat_id)
+        migrate_chat(job['chat_id'], new_chat_id)
+        job['chat_id'] = new_chat_id
+        deliver_job(job)
+
+
+def deliver_job(job):
+    with event_lock(job.get('project_id'), job.get('event_key')):
+        if job.get('kind') == 'pipeline':
+            flush_pipeline(job)
+        elif job.get('kind') == 'mr_card':
+            flush_card(job)
+        elif job.get('kind') == 'push_digest':
+            flush_push_digest(job)
+        else:
+            deliver_message(job)
+
+
+# What was last delivered for an event key: the hash of its text and when its job was queued. Jobs
+# of one event key are delivered in order, except a retry: it may come after a newer edit and would
+# roll the message back, so a retry older than the last delivery (or with the same text) is skipped.
+def sent_key(project_id, event_key):
+    return f"{SENT_KEY}:{project_id or 0}:{event_key}"
+
+
+def is_superseded(job):
+    sent_hash, sent_at = get_redis_connection('default').hmget(
+        sent_key(job.get('project_id'), job['event_key']), 'sent_hash', 'sent_at')
+    if sent_hash is None:
+        return False
+    job_hash = job.get('text_hash') or text_hash(job['text'])
+    return sent_hash.decode() == job_hash or float(sent_at) > job['enqueued_at']
+
+
+def save_sent(job):
+    key = sent_key(job.get('project_id'), job['event_key'])
+    pipe = get_redis_connection('default').pipeline(transaction=False)
+    pipe.hset(key, mapping={'sent_hash': job.get('text_hash') or text_hash(job['text']),
+                            'sent_at': job['enqueued_at']})
+    pipe.expire(key, settings.MESSAGE_ID_TTL)
+    pipe.execute()
+
+
+def deliver_message(job):
+    chat_id = job['chat_id']
+    event_key = job.get('event_key')
+    project_id = job.get('project_id')
+
+    if event_key and job.get('attempts') and is_superseded(job):
+        incr_stat('queue_superseded')
+        return
+
+    msg_id = get_message_id(project_id, event_key) if event_key else None
+    if msg_id:
+        edit_message(chat_id, int(msg_id), job['text'])
+    else:
+        msg = send_message(chat_id, job['thread_id'], job['text'])
+        if 'message_id' not in msg:
+            raise DeliveryError(f"sendMessage returned no message for chat {chat_id}")
+        if event_key:
+            save_message_id(project_id, event_key, msg['message_id'])
+
+    if event_key:
+        save_sent(job)
+    if job.get('final') and event_key:
+        delete_message_id(project_id, event_key)
+
+
+async def adeliver(job):
+    try:
+        await adeliver_job(job)
+    except TelegramError as e:
+        new_chat_id = e.parameters.get('migrate_to_chat_id')
+        if not new_chat_id:
+            raise
+        logger.warning("Chat %s migrated to %s", job['chat_id'], new_chat_id)
+        await sync_to_async(migrate_chat)(job['chat_id'], new_chat_id)
+        job['chat_id'] = new_chat_id
+        await adeliver_job(job)
+
+
+async def adeliver_job(job):
+    async with aevent_lock(job.get('project_id'), job.get('event_key')):
+        if job.get('kind') == 'pipeline':
+            await sync_to_async(flush_pipeline)(job)
+        elif job.get('kind') == 'mr_card':
+            await sync_to_async(flush_card)(job)
+        elif job.get('kind') == 'push_digest':
+            await sync_to_async(flush_push_digest)(job)
+        else:
+            await adeliver_message(job)
+
+
+async def adeliver_message(job):
+    chat_id = job['chat_id']
+    event_key = job.get('event_key')
+    project_id = job.get('project_id')
+
+    msg_id = await aget_message_id(project_id, event_key) if event_key else None
+    if msg_id:
+        await aedit_message(chat_id, int(msg_id), job['text'])
+    else:
+        msg = await asend_message(chat_id, job['thread_id'], job['text'])
+        if 'message_id' not in msg:
+            raise DeliveryError(f"sendMessage returned no message for chat {chat_id}")
+        if event_key:
+            await asave_message_id(project_id, event_key, msg['message_id'])
+
+    if event_key:
+        await sync_to_async(save_sent)(job)
+    if job.get('final') and event_key:
+        await adelete_message_id(project_id, event_key)
+
+
+async def aenqueue_message(chat_id, thread_id, text, event_key=None, final=False, kind='message', delay=0,
+                           project_id=None):
+    if settings.TELEGRAM_DELIVERY_MODE == 'inline':
+        job = make_job(chat_id, thread_id, text, event_key, final, kind, project_id)
+        try:
+            await adeliver(job)
+        except Exception as e:
+            logger.exception("Inline delivery to chat %s failed", chat_id)
+            await sync_to_async(capture_dead_letter)(job, e)
+        return job
+    return await sync_to_async(enqueue_message)(chat_id, thread_id, text, event_key, final, kind, delay,
+                                                project_id)
+
+
+async def aenqueue_messages(jobs):
+    if settings.TELEGRAM_DELIVERY_MODE != 'inline':
+        return await sync_to_async(enqueue_messages)(jobs)
+
+    semaphore = asyncio.Semaphore(settings.TELEGRAM_FANOUT_WORKERS)
+
+    async def one(job):
+        async with semaphore:
+            return await aenqueue_message(**job)
+
+    return await asyncio.gather(*(one(job) for job in jobs))
+
+
+def schedule_retry(conn, job, error):
+    job['attempts'] += 1
+    if is_permanent(error) or job['attempts'] > settings.TELEGRAM_DELIVERY_MAX_RETRIES:
+        incr_stat('queue_failed')
+        logger.error("Giving up on job %s after %s attempts: %s", job['id'], job['attempts'], error)
+        if capture_dead_letter(job, error) is None:
+            # the dead letter couldn't be stored either: keep the job queued rather than lose it
+            conn.zadd(DELAYED_KEY, {json.dumps(job): time.time() + DEAD_LETTER_RETRY_DELAY})
+        return
+
+    delay = min(2 ** job['attempts'], 60)
+    conn.zadd(DELAYED_KEY, {json.dumps(job): time.time() + delay})
+    incr_stat('queue_retried')
+    logger.warning("Job %s failed (%s), retrying in %ss", job['id'], error, delay)
+
+
+def promote_delayed(conn, limit=100):
+    for raw in conn.zrangebyscore(DELAYED_KEY, '-inf', time.time(), start=0, num=limit):
+        # zrem decides which worker owns the job when several promote at once
+        if conn.zrem(DELAYED_KEY, raw):
+            job = json.loads(raw)
+            conn.rpush(queue_key(job['shard']), raw)
+
+
+def recover_processing(conn):
+    # jobs left by a killed worker go back to the head of their shard
+    for shard in range(settings.TELEGRAM_DELIVERY_WORKERS):
+        while conn.lmove(processing_key(shard), queue_key(shard), 'LEFT', 'RIGHT'):
+            pass
+
+
+def queue_depth(conn=None):
+    conn = conn or get_redis_connection('default')
+    pipe = conn.pipeline()
+    for shard in range(settings.TELEGRAM_DELIVERY_WORKERS):
+        pipe.llen(queue_key(shard))
+    pipe.zcard(DELAYED_KEY)
+    *shards, delayed = pipe.execute()
+    return {'queued': sum(shards), 'delayed': delayed, 'shards': shards}
+
+
+def run_worker(shard):
+    conn = get_redis_connection('default')
+    running = True
+
+    def stop(signum, frame):
+        nonlocal running
+        running = False
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while running:
+        work_once(conn, shard)
+
+
+def work_once(conn, shard):
+    # delivers the next job of the shard, False if none came within POLL_TIMEOUT
+    promote_delayed(conn)
+    raw = conn.blmove(queue_key(shard), processing_key(shard), POLL_TIMEOUT, 'RIGHT', 'LEFT')
+    if raw is None:
+        return False
+
+    job = json.loads(raw)
+    try:
+        with collect(kind=job.get('kind', 'message')), timer('deliver'):
+            deliver(job)
+    except Exception as e:
+        schedule_retry(conn, job, e)
+    else:
+        lag = time.time() - job['enqueued_at']
+        incr_stat('queue_delivered')
+        incr_stat('queue_lag_seconds_total', lag)
+        set_stat('queue_last_lag_seconds', round(lag, 3))
+    finally:
+        conn.lrem(processing_key(shard), 1, raw)
+    return True
+
+
+def replay_dead_letter(letter):
+    # sends the stored text again as a plain message. Pipelines keep their event key, so the
+    # replay edits the pipeline's message if one was sent since; digests and merge request cards
+    # keep their message id in their own state, so they are sent anew.
+    event_key = letter.event_key if letter.kind in ('message', 'pipeline') else None
+    job = make_job(letter.chat_id, letter.message_thread_id, letter.text, event_key or None,
+                   letter.job.get('final', False), project_id=letter.project_id)
+    deliver(job)
+    return job
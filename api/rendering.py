@@ -0,0 +1,138 @@
+from itertools import product
+from operator import attrgetter
+
+# Message templates, built once at import for every combination of the project's show_* flags, so
+# rendering a message is a single %-format with no per-flag branches or concatenation. Nothing is
+# memoized: real hooks hardly ever repeat the same values (retries are dropped before rendering, see
+# api.idempotency).
+
+STATUS_EMOJI_MAP = {
+    'pushed': '✅',
+    'opened': '✨',
+    'pending': '⏳',
+    'running': '🏃',
+    'success': '🟢',
+    'failed': '🔴',
+    'canceled': '⚪',
+    'skipped': '⏭️',
+    'finished': '🏁',
+    'manual': '✋',
+    'approved': '👍',
+    'unapproved': '👎',
+    'approval': '✅',
+    'unapproval': '❌',
+    'merge': '🤝',
+    'pipeline started': '⏱️',
+    'open': '🔓',
+    'close': '🔒',
+    'reopen': '🔄',
+    'update': '📝',
+    'closed': '🔒',
+}
+
+# order of the flags in a template key
+FLAGS = ('show_project', 'show_status', 'show_branch', 'show_user', 'show_duration')
+
+HEADER = "🚀 *Event Update:* `%(event_type)s`\n"
+
+# (flag, lines shown when the flag is set), in message order
+SECTIONS = {
+    'push': (
+        ('show_project', "📣 *Project:* `%(project)s`\n"),
+        ('show_status', "📌 *Status:* `%(status)s`\n"),
+        ('show_branch', "🌿 *Branch:* `%(branch)s`\n"),
+        ('show_user', "👤 *User:* %(mention)s\n"),
+        ('show_duration', "⏳ *Duration:* `%(duration)ss`\n"),
+    ),
+    'merge': (
+        ('show_project', "📣 *Project:* `%(project)s`\n📑 *Is Draft:* `%(draft)s`\n"),
+        ('show_status', "📌 *Status:* `%(status)s`\n"),
+        ('show_branch', "🌿 *Source:* `%(branch)s`\n🎯 *Target:* `%(target_branch)s`\n"),
+        ('show_user', "👤 *User:* %(mention)s\n%(assignees)s%(reviewers)s"),
+        (None, "🔗 *Link:* [tap to view](%(merge_url)s)\n"),
+        ('show_duration', "⏳ *Duration:* `%(duration)ss`\n"),
+    ),
+}
+SECTIONS['pipeline'] = SECTIONS['push']
+
+
+def build_templates():
+    # (gitlab event, flag values in FLAGS order) -> %-format template
+    templates = {}
+    for gitlab_event, sections in SECTIONS.items():
+        for values in product((False, True), repeat=len(FLAGS)):
+            flags = dict(zip(FLAGS, values))
+            body = ''.join(lines for flag, lines in sections if flag is None or flags[flag])
+            templates[gitlab_event, values] = HEADER + body
+    return templates
+
+
+TEMPLATES = build_templates()
+
+
+project_flags = attrgetter(*FLAGS)
+
+
+def format_status(status):
+    return f"{status} {STATUS_EMOJI_MAP.get(status, '')}"
+
+
+BULLET_SEPARATOR = "\n  • "
+
+
+def format_list(title, mentions):
+    if not mentions:
+        return ''
+    return f"{title}  • {BULLET_SEPARATOR.join(mentions)}\n"
+
+
+def build_message(event, project, mention, assignee_mentions=(), reviewer_mentions=()):
+    template = TEMPLATES[event['gitlab_event'], project_flags(project)]
+    fields = {
+        'event_type': event['event_type'],
+        'project': project.name,
+        'status': format_status(event['status']),
+        'branch': event['branch'],
+        'mention': mention,
+        'duration': event['duration'],
+    }
+    if event['gitlab_event'] == 'merge':
+        fields.update({
+            'draft': event['draft'],
+            'target_branch': event['target_branch'],
+            'merge_url': event['merge_url'],
+            'assignees': format_list("👥 *Assignees*\n", assignee_mentions),
+            'reviewers': format_list("👁 *Reviewers:*\n", reviewer_mentions),
+        })
+    return template % fields
+
+
+def escape_markdown(text):
+    # legacy Markdown (parse_mode="Markdown") only escapes these four
+    for char in ('_', '*', '`', '['):
+        text = text.replace(char, '\\' + char)
+    return text
+
+
+def format_commit(commit):
+    return f"  • `{commit['id']}` {escape_markdown(commit['title'])} ({escape_markdown(commit['author'])})\n"
+
+
+# a merge request card: the latest merge request message, then what merge request hooks don't carry
+def build_card(text, approvers, pipeline_status):
+    card = text
+    if approvers:
+        card += f"👍 *Approved by:* {', '.join(escape_markdown(name) for name in sorted(approvers))}\n"
+    if pipeline_status:
+        card += f"🔧 *Pipeline:* `{format_status(pipeline_status)}`\n"
+    return card
+
+
+# a push digest: the latest push rendered as usual, followed by the commits of the whole window
+def build_digest(text, pushes, total_commits, commit_lines):
+    digest = text + f"🔁 *Pushes:* `{pushes}`\n"
+    if total_commits:
+        digest += f"📝 *Commits ({total_commits}):*\n" + ''.join(commit_lines)
+        if total_commits > len(commit_lines):
+            digest += f"  … +{total_commits - len(commit_lines)}\n"
+    return digest
@@ -0,0 +1,245 @@
+import gzip
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import timezone as dt_timezone
+
+from django.db import close_old_connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api.mentions import resolve_mentions
+from api.queue import enqueue_messages
+from api.rendering import build_message
+from api.routing import get_route
+from api.services import GITLAB_EVENTS, build_mentions, parse_gitlab_event, plan_delivery
+from api.sink import build_event, write_events
+
+# Replays archived GitLab hooks through the webhook's pipeline (manage.py replay_events).
+#
+# Input is JSON lines, read lazily (plain or .gz), one of:
+#   - a capture:        {"event": "Pipeline Hook", "received_at": "2024-05-01T10:00:00Z", "body": {...}}
+#   - a raw hook body:  {"object_kind": "pipeline", ...}, the event type taken from object_kind
+#   - a GitLab event:   a record of the Events API ("recent events": GET /projects/:id/events), turned
+#                       into a minimal push or merge request hook
+#
+# Events are spread over worker threads by project, so each project's events are replayed in file
+# order while different projects run in parallel. Modes:
+#   dry-run  - only the GitLabEvent rows are written (in bulk, with the original time)
+#   sandbox  - rendered and delivered to one sandbox chat, under message keys of its own
+#   deliver  - delivered to the project's chats like a live hook
+
+logger = logging.getLogger(__name__)
+
+OBJECT_KINDS = {'push': 'Push Hook', 'merge_request': 'Merge Request Hook', 'pipeline': 'Pipeline Hook'}
+
+# Events API action_name -> (merge request hook action, state)
+MERGE_REQUEST_ACTIONS = {
+    'opened': ('open', 'opened'),
+    'reopened': ('reopen', 'opened'),
+    'accepted': ('merge', 'merged'),
+    'closed': ('close', 'closed'),
+    'approved': ('approved', 'opened'),
+}
+
+SANDBOX_KEY_SUFFIX = '@sandbox'
+QUEUE_SIZE = 1000  # events waiting per worker; the reader blocks beyond that
+
+
+def read_lines(paths):
+    for path in paths:
+        if path == '-':
+            yield from sys.stdin
+            continue
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            yield from f
+
+
+def parse_time(value):
+    # ISO 8601, or GitLab's hook format "2024-05-01 10:00:00 UTC"
+    if not value:
+        return None
+    moment = parse_datetime(str(value).replace(' UTC', '+00:00'))
+    if moment is not None and timezone.is_naive(moment):
+        moment = timezone.make_aware(moment, dt_timezone.utc)
+    return moment
+
+
+def hook_time(payload):
+    attributes = payload.get('object_attributes') or {}
+    commits = payload.get('commits') or []
+    return parse_time(attributes.get('finished_at') or attributes.get('updated_at') or attributes.get('created_at')
+                      or (commits[-1].get('timestamp') if commits else None))
+
+
+def event_api_hook(record, project):
+    # an Events API record has no project name and much less than a hook; enough for the event log
+    author = record.get('author') or {}
+    user = {'id': record.get('author_id'), 'name': author.get('name', ''),
+            'username': record.get('author_username') or author.get('username')}
+    push_data = record.get('push_data')
+
+    if push_data and push_data.get('ref_type') == 'branch' and push_data.get('action') != 'removed':
+        return 'Push Hook', {
+            'object_kind': 'push',
+            'ref': f"refs/heads/{push_data.get('ref')}",
+            'user_id': user['id'],
+            'user_name': user['name'],
+            'user_username': user['username'],
+            'project': {'name': project},
+            'commits': [{'id': push_data.get('commit_to') or '', 'title': push_data.get('commit_title') or '',
+                         'author': {'name': user['name']}}],
+            'total_commits_count': push_data.get('commit_count', 1),
+        }
+
+    if record.get('target_type') == 'MergeRequest' and record.get('action_name') in MERGE_REQUEST_ACTIONS:
+        action, state = MERGE_REQUEST_ACTIONS[record['action_name']]
+        return 'Merge Request Hook', {
+            'object_kind': 'merge_request',
+            'user': user,
+            'project': {'name': project},
+            'object_attributes': {'id': record.get('target_id'), 'iid': record.get('target_iid'),
+                                  'title': record.get('target_title'), 'action': action, 'state': state,
+                                  'updated_at': record.get('created_at')},
+        }
+    return None, None
+
+
+def to_hook(record, project=None):
+    # -> (X-Gitlab-Event, payload, time of the hook), event type None for records to skip;
+    # ValueError for a record that isn't one
+    if 'body' in record and 'event' in record:
+        body = record['body']
+        payload = json.loads(body) if isinstance(body, str) else body
+        if not isinstance(payload, dict):
+            raise ValueError("the hook body is not a JSON object")
+        return record['event'], payload, parse_time(record.get('received_at')) or hook_time(payload)
+    if 'object_kind' in record:
+        return OBJECT_KINDS.get(record['object_kind']), record, hook_time(record)
+    if 'action_name' in record:
+        event_type, payload = event_api_hook(record, project)
+        return event_type, payload, parse_time(record.get('created_at'))
+    return None, None, None
+
+
+class Replayer:
+    def __init__(self, mode='deliver', sandbox_chat=None, sandbox_thread=None, workers=4, project=None,
+                 create_projects=False, batch_size=500):
+        self.mode = mode
+        self.sandbox_chat = sandbox_chat
+        self.sandbox_thread = sandbox_thread
+        self.workers = workers
+        self.project = project
+        self.create_projects = create_projects
+        self.batch_size = batch_size
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            self.stats.update(counts)
+
+    def route(self, name, routes):
+        if name not in routes:
+            route = get_route(name, create=self.create_projects)
+            if route is not None and self.mode == 'sandbox':
+                route = route._replace(chat_id=self.sandbox_chat, thread_id=self.sandbox_thread, is_active=True,
+                                       rules=())
+            routes[name] = route
+        return routes[name]
+
+    def deliver(self, event, project):
+        mention, assignee_mentions, reviewer_mentions = build_mentions(event, resolve_mentions(event))
+        message = build_message(event, project, mention, assignee_mentions, reviewer_mentions)
+        suffix = SANDBOX_KEY_SUFFIX if self.mode == 'sandbox' else ''
+        result, jobs = plan_delivery(event, project, message, key_suffix=suffix)
+        enqueue_messages(jobs)
+        return len(jobs)
+
+    def flush(self, rows):
+        try:
+            self.add(recorded=write_events(rows))
+        except Exception:
+            # a dead worker would leave the reader blocked on its queue: count the rows and go on
+            logger.exception("Could not write %s replayed events", len(rows))
+            self.add(not_recorded=len(rows))
+        rows.clear()
+
+    def work(self, items):
+        routes = {}
+        rows = []
+        try:
+            while True:
+                item = items.get()
+                if item is None:
+                    break
+                event_type, payload, created_at = item
+                try:
+                    event = parse_gitlab_event(event_type, payload)
+                    project = self.route(event['project_name'], routes) if event['project_name'] else None
+                    if project is None:
+                        self.add(unknown_project=1)
+                        continue
+
+                    row = build_event(event, project)
+                    row.created_at = created_at or row.created_at
+                    rows.append(row)
+                    if self.mode != 'dry-run':
+                        self.add(messages=self.deliver(event, project))
+                    if len(rows) >= self.batch_size:
+                        self.flush(rows)
+                    self.add(replayed=1)
+                except Exception:
+                    logger.exception("Could not replay a %s of %s", event_type,
+                                     (payload.get('project') or {}).get('name'))
+                    self.add(failed=1)
+            self.flush(rows)
+        finally:
+            close_old_connections()
+
+    def run(self, lines, progress=None, interval=5):
+        # lines: an iterable of JSON lines; progress(stats, seconds) is called every `interval` seconds
+        queues = [queue.Queue(maxsize=QUEUE_SIZE) for _ in range(self.workers)]
+        threads = [threading.Thread(target=self.work, args=(items,), name=f"replay-{index}", daemon=True)
+                   for index, items in enumerate(queues)]
+        for thread in threads:
+            thread.start()
+
+        started = last_report = time.monotonic()
+        try:
+            for line in lines:
+                if not line.strip():
+                    continue
+                self.add(read=1)
+                try:
+                    record = json.loads(line)
+                    if not isinstance(record, dict):
+                        raise ValueError("not a JSON object")
+                    event_type, payload, created_at = to_hook(record, self.project)
+                except ValueError:
+                    self.add(invalid=1)
+                    continue
+                if event_type not in GITLAB_EVENTS:
+                    self.add(skipped=1)
+                    continue
+
+                name = (payload.get('project') or {}).get('name') or ''
+                # one project always goes to the same worker: its events stay in order
+                queues[zlib.crc32(name.encode()) % self.workers].put((event_type, payload, created_at))
+
+                if progress and time.monotonic() - last_report >= interval:
+                    last_report = time.monotonic()
+                    progress(self.stats, last_report - started)
+        finally:
+            for items in queues:
+                items.put(None)
+            for thread in threads:
+                thread.join()
+
+        return self.stats, time.monotonic() - started
@@ -0,0 +1,203 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from api.metrics import count
+from apps.models import GitlabProject, GitlabRoute, TelegramGroup
+
+ROUTE_KEY = 'gitlab_bot:route'
+
+# everything a hook needs to know about its project: where to send and what to show.
+# Field names follow GitlabProject so a route can be passed wherever a project was used.
+ProjectRoute = namedtuple('ProjectRoute', [
+    'id',
+    'name',
+    'chat_id',
+    'thread_id',
+    'is_active',
+    'show_user',
+    'show_project',
+    'show_branch',
+    'show_status',
+    'show_duration',
+    'push_digest_window',
+    'rules',
+], defaults=(0, ()))  # routes cached before these fields existed
+
+# a GitlabRoute, flattened: filters first, then where to send (see api.fanout)
+RouteRule = namedtuple('RouteRule', ['gitlab_event', 'branch', 'status', 'chat_id', 'thread_id', 'is_active'])
+
+
+class LocalRouteCache:
+    # Per-process LRU in front of Redis. Signals clear entries in the process that saved the model;
+    # other processes pick the change up after ROUTING_LOCAL_TTL seconds at most.
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return None
+            route, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[name]
+                return None
+            self._entries.move_to_end(name)
+            return route
+
+    def set(self, name, route):
+        with self._lock:
+            self._entries[name] = (route, time.monotonic() + settings.ROUTING_LOCAL_TTL)
+            self._entries.move_to_end(name)
+            while len(self._entries) > settings.ROUTING_LOCAL_SIZE:
+                self._entries.popitem(last=False)
+
+    def delete(self, name):
+        with self._lock:
+            self._entries.pop(name, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+local_routes = LocalRouteCache()
+
+
+def route_key(project_name):
+    return f"{ROUTE_KEY}:{project_name}"
+
+
+def build_rule(route):
+    group = route.telegram_group
+    return RouteRule(
+        gitlab_event=route.gitlab_event,
+        branch=route.branch,
+        status=route.status,
+        chat_id=group.chat_id,
+        thread_id=route.message_thread_id if route.message_thread_id is not None else group.message_thread_id,
+        is_active=group.is_active,
+    )
+
+
+def rules_query(project):
+    return project.routes.filter(is_active=True).select_related('telegram_group').order_by('id')
+
+
+def build_route(project, rules=()):
+    group = project.telegram_group
+    return ProjectRoute(
+        id=project.id,
+        name=project.name,
+        chat_id=group.chat_id if group else None,
+        thread_id=group.message_thread_id if group else None,
+        is_active=group.is_active if group else False,
+        show_user=project.show_user,
+        show_project=project.show_project,
+        show_branch=project.show_branch,
+        show_status=project.show_status,
+        show_duration=project.show_duration,
+        push_digest_window=project.push_digest_window,
+        rules=tuple(rules),
+    )
+
+
+# create=False returns None for a project that doesn't exist; that answer is cached as well
+# (False), until a project of that name is saved
+def get_route(project_name, create=True):
+    route = local_routes.get(project_name)
+    if route:
+        count('cache_lookups_total', cache='routes', result='local')
+        return route
+
+    cached = cache.get(route_key(project_name))
+    count('cache_lookups_total', cache='routes', result='miss' if cached is None else 'redis')
+    if cached is False and not create:
+        return None
+    if cached:
+        route = ProjectRoute(**cached)
+    elif create:
+        project, created = GitlabProject.objects.select_related('telegram_group').get_or_create(name=project_name)
+        rules = [] if created else [build_rule(rule) for rule in rules_query(project)]
+        route = build_route(project, rules)
+        cache.set(route_key(project_name), route._asdict(), timeout=settings.ROUTING_CACHE_TTL)
+    else:
+        project = GitlabProject.objects.select_related('telegram_group').filter(name=project_name).first()
+        if project is None:
+            cache.set(route_key(project_name), False, timeout=settings.ROUTING_CACHE_TTL)
+            return None
+        route = build_route(project, [build_rule(rule) for rule in rules_query(project)])
+        cache.set(route_key(project_name), route._asdict(), timeout=settings.ROUTING_CACHE_TTL)
+
+    local_routes.set(project_name, route)
+    return route
+
+
+async def aget_route(project_name, create=True):
+    route = local_routes.get(project_name)
+    if route:
+        count('cache_lookups_total', cache='routes', result='local')
+        return route
+
+    cached = await cache.aget(route_key(project_name))
+    count('cache_lookups_total', cache='routes', result='miss' if cached is None else 'redis')
+    if cached is False and not create:
+        return None
+    if cached:
+        route = ProjectRoute(**cached)
+    elif create:
+        project, created = await GitlabProject.objects.select_related('telegram_group').aget_or_create(
+            name=project_name
+        )
+        rules = [] if created else [build_rule(rule) async for rule in rules_query(project)]
+        route = build_route(project, rules)
+        await cache.aset(route_key(project_name), route._asdict(), timeout=settings.ROUTING_CACHE_TTL)
+    else:
+        project = await GitlabProject.objects.select_related('telegram_group').filter(name=project_name).afirst()
+        if project is None:
+            await cache.aset(route_key(project_name), False, timeout=settings.ROUTING_CACHE_TTL)
+            return None
+        route = build_route(project, [build_rule(rule) async for rule in rules_query(project)])
+        await cache.aset(route_key(project_name), route._asdict(), timeout=settings.ROUTING_CACHE_TTL)
+
+    local_routes.set(project_name, route)
+    return route
+
+
+def invalidate_routes(*project_names):
+    if not project_names:
+        return
+    for name in project_names:
+        local_routes.delete(name)
+    cache.delete_many([route_key(name) for name in project_names])
+
+
+def migrate_chat(old_chat_id, new_chat_id):
+    # a group upgraded to a supergroup gets a new chat id; Telegram only tells us by refusing to
+    # post to the old one. Saving the group invalidates the routes that point at it (apps.signals).
+    with transaction.atomic():
+        group = TelegramGroup.objects.select_for_update().filter(chat_id=old_chat_id).first()
+        if group is None:
+            return
+        new_group = TelegramGroup.objects.select_for_update().filter(chat_id=new_chat_id).first()
+        if new_group is None:
+            group.chat_id = new_chat_id
+            group.chat_type = 'supergroup'
+            group.save(update_fields=['chat_id', 'chat_type'])
+            return
+
+        # the new chat was registered too (/register in the supergroup): move everything that points
+        # at the old group over to it, then drop the old one
+        GitlabProject.objects.filter(telegram_group=group).update(telegram_group=new_group)
+        GitlabRoute.objects.filter(telegram_group=group).update(telegram_group=new_group)
+        new_group.is_active = new_group.is_active or group.is_active
+        new_group.chat_type = 'supergroup'
+        # after the moves, so the routes of the projects now pointing at it are invalidated as well
+        new_group.save(update_fields=['is_active', 'chat_type'])
+        group.delete()
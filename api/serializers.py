@@ -1,6 +1,6 @@
 from rest_framework import serializers
 
-from apps.models import GitLabEvent, GitlabProject, TelegramAdmin
+from apps.models import GitLabEvent, TelegramAdmin
 
 
 class GitLabEventSerializer(serializers.ModelSerializer):
@@ -16,14 +16,6 @@ class GitLabEventSerializer(serializers.ModelSerializer):
             'created_at'
         ]
 
-    def validate(self, data):
-        project = GitlabProject.objects.filter(name=data.get('project').name).first()
-        if not project:
-            raise serializers.ValidationError("Project not found.")
-
-        data['project'] = project
-        return data
-
 
 class TelegramWebhookSerializer(serializers.Serializer):
     # message = serializers.DictField(
@@ -0,0 +1,196 @@
+from django.conf import settings
+
+from api.cards import update_card, card_event_key, APPROVAL_ACTIONS, CARD_UPDATED
+from api.digests import update_push_digest, digest_event_key, DIGEST_SCHEDULED
+from api.fanout import get_targets
+from api.pipelines import update_pipeline_state, PIPELINE_STALE, PIPELINE_SCHEDULED
+
+# shared by the sync (DRF) and async GitLab webhook views: everything here is free of ORM calls,
+# the views resolve the project route (api.routing) and the mentions themselves, and render the
+# message with api.rendering
+
+GITLAB_EVENTS = {
+    'Push Hook': 'push',
+    'Merge Request Hook': 'merge',
+    'Pipeline Hook': 'pipeline',
+}
+
+
+def parse_gitlab_event(event_type, payload):
+    gitlab_event = GITLAB_EVENTS[event_type]
+    event = {
+        'event_type': event_type,
+        'gitlab_event': gitlab_event,
+        'project_name': payload.get('project', {}).get('name'),
+        'duration': payload.get('object_attributes', {}).get('duration', 0),
+        'event_id': None,
+    }
+
+    if gitlab_event == 'push':
+        event.update({
+            'branch': payload.get('ref', '').split('/')[-1],
+            'user_name': payload.get('user_username'),
+            'user_id': payload.get('user_id'),
+            'status': 'pushed',
+            'full_name': payload.get('user_name', ''),
+            'commits': [{
+                'id': commit.get('id', '')[:8],
+                'title': commit.get('title') or commit.get('message', '').split('\n')[0],
+                'author': commit.get('author', {}).get('name', ''),
+            } for commit in payload.get('commits', [])],
+            'total_commits': payload.get('total_commits_count', len(payload.get('commits', []))),
+        })
+
+    elif gitlab_event == 'merge':
+        object_attributes = payload.get('object_attributes', {})
+        user = payload.get('user', {})
+        event.update({
+            'branch': object_attributes.get('source_branch'),
+            'status': object_attributes.get('state'),
+            'user_name': user.get('username'),
+            'user_id': user.get('id'),
+            'full_name': user.get('name'),
+            'merge_url': object_attributes.get('url'),
+            'target_branch': object_attributes.get('target_branch'),
+            'draft': object_attributes.get('draft'),
+            'assignees': [{
+                'id': assignee.get('id'),
+                'name': assignee.get('name'),
+                'username': assignee.get('username')
+            } for assignee in payload.get('assignees', [])],
+            'reviewers': [{
+                'id': reviewer.get('id'),
+                'name': reviewer.get('name'),
+                'username': reviewer.get('username')
+            } for reviewer in payload.get('reviewers', [])],
+            'event_id': object_attributes.get('id'),
+            'action': object_attributes.get('action'),
+            'updated_at': object_attributes.get('updated_at') or '',
+        })
+
+    elif gitlab_event == 'pipeline':
+        attr = payload.get('object_attributes', {})
+        ref = attr.get('ref') or payload.get('ref')
+        user = payload.get('user', {})
+        merge_request = payload.get('merge_request') or {}
+        event.update({
+            'branch': ref.split('/')[-1] if ref else '',
+            'status': attr.get('status'),
+            'user_name': user.get('username'),
+            'user_id': user.get('id'),
+            'full_name': user.get('name'),
+            'event_id': attr.get('id'),
+            # set for merge request pipelines, whose status goes on the merge request's card
+            'merge_request_id': merge_request.get('id'),
+            'merge_request_branch': merge_request.get('source_branch'),
+        })
+
+    if gitlab_event in ['merge', 'pipeline']:
+        event['event_key'] = f"{event['event_id']}:{gitlab_event}:{event['branch']}"
+
+    return event
+
+
+def format_mention(full_name, telegram_id):
+    return f"[{full_name}](tg://user?id={telegram_id})" if telegram_id else full_name
+
+
+# telegram_ids: gitlab id -> telegram id, as returned by api.mentions.resolve_mentions
+def build_mentions(event, telegram_ids):
+    author_id = telegram_ids.get(event.get('user_id'))
+    mention = f"[`{event['full_name']}`](tg://user?id={author_id})" if author_id else event['full_name']
+    assignee_mentions = [
+        format_mention(a.get('name'), telegram_ids.get(a.get('id'))) for a in event.get('assignees', [])
+    ]
+    reviewer_mentions = [
+        format_mention(r.get('name'), telegram_ids.get(r.get('id'))) for r in event.get('reviewers', [])
+    ]
+    return mention, assignee_mentions, reviewer_mentions
+
+
+def target_suffix(project, target):
+    # from the target itself, never its position: the project's own group keeps the plain keys (so
+    # message ids stored before fan-out still match), every routed chat/topic has keys of its own,
+    # whichever targets are stopped or however the routes are ordered
+    if (target.chat_id, target.thread_id) == (project.chat_id, project.thread_id):
+        return ''
+    return f"@{target.chat_id}:{target.thread_id}"
+
+
+# returns the response status and the jobs (enqueue_message kwargs) to deliver for an event,
+# one set per target chat/topic (api.fanout)
+# key_suffix keeps the message ids and pipeline/card state of a replay to a sandbox chat
+# (api.replay) apart from the live ones
+def plan_delivery(event, project, message, key_suffix=''):
+    targets = get_targets(project, event)
+    if not targets:
+        return 'no telegram group', []
+    targets = [target for target in targets if target.is_active]
+    if not targets:
+        return 'telegram group is stopped', []
+
+    results = []
+    jobs = []
+    for target in targets:
+        suffix = key_suffix + target_suffix(project, target)
+        result, target_jobs = plan_target(event, project, message, target.chat_id, target.thread_id, suffix)
+        results.append(result)
+        for job in target_jobs:
+            job['project_id'] = project.id
+        jobs.extend(target_jobs)
+    return ', '.join(dict.fromkeys(results)), jobs
+
+
+def plan_target(event, project, message, chat_id, thread_id, suffix):
+    status_text = event['status']
+    event_key = f"{event['event_key']}{suffix}" if event.get('event_key') else None
+
+    if event['gitlab_event'] == 'merge':
+        # the merge request's card (api.cards) is edited for its whole life, merged and closed included
+        result = update_card(project.id, event_key, text=message, updated_at=event['updated_at'],
+                             approval=APPROVAL_ACTIONS.get(event['action'], ''), approver=event['full_name'])
+        return card_result(chat_id, thread_id, event_key, result)
+
+    if event['gitlab_event'] == 'pipeline':
+        card_jobs = []
+        if event.get('merge_request_id'):
+            card_event = card_event_key(event['merge_request_id'], event['merge_request_branch']) + suffix
+            result = update_card(project.id, card_event, pipeline=status_text, pipeline_id=event['event_id'])
+            card_jobs = card_result(chat_id, thread_id, card_event, result)[1]
+
+        # bursts of pipeline hooks collapse into one send/edit after PIPELINE_DEBOUNCE_MS
+        result = update_pipeline_state(project.id, event_key, status_text, message)
+        if result == PIPELINE_STALE:
+            return f'stale {status_text} ignored', card_jobs
+        if result == PIPELINE_SCHEDULED and settings.TELEGRAM_DELIVERY_MODE != 'inline':
+            return f'{status_text} coalesced', card_jobs
+        return f'{status_text} queued', card_jobs + [dict(
+            chat_id=chat_id, thread_id=thread_id, text=None, event_key=event_key, kind='pipeline',
+            delay=settings.PIPELINE_DEBOUNCE_MS / 1000,
+        )]
+
+    if project.push_digest_window:
+        # pushes to a branch within the window share one message, edited at most every
+        # PUSH_DIGEST_EDIT_INTERVAL seconds
+        event_key = digest_event_key(project.id, event['branch']) + suffix
+        result = update_push_digest(event_key, event, message, project.push_digest_window)
+        if result == DIGEST_SCHEDULED and settings.TELEGRAM_DELIVERY_MODE != 'inline':
+            return 'push added to digest', []
+        return 'digest queued', [dict(
+            chat_id=chat_id, thread_id=thread_id, text=None, event_key=event_key, kind='push_digest',
+            delay=settings.PUSH_DIGEST_EDIT_INTERVAL,
+        )]
+
+    return 'ok', [dict(chat_id=chat_id, thread_id=thread_id, text=message)]
+
+
+def card_result(chat_id, thread_id, event_key, result):
+    # like pipelines: hooks within MR_CARD_DEBOUNCE_MS share one flush
+    if not result:
+        return 'no merge request card', []
+    if result != CARD_UPDATED and settings.TELEGRAM_DELIVERY_MODE != 'inline':
+        return 'card coalesced', []
+    return 'card queued', [dict(
+        chat_id=chat_id, thread_id=thread_id, text=None, event_key=event_key, kind='mr_card',
+        delay=settings.MR_CARD_DEBOUNCE_MS / 1000,
+    )]
@@ -0,0 +1,174 @@
+import atexit
+import json
+import logging
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, DatabaseError, close_old_connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django_redis import get_redis_connection
+
+from api.stats import add_events
+from apps.models import GitLabEvent
+
+logger = logging.getLogger(__name__)
+
+EVENTS_BUFFER_KEY = 'gitlab_bot:events'
+
+# Where webhook events are written (EVENT_SINK_MODE):
+#   sync   - one INSERT per hook, in the request
+#   memory - buffered per process, flushed with bulk_create every EVENT_SINK_BATCH_SIZE events or
+#            EVENT_SINK_FLUSH_INTERVAL seconds, and on exit
+#   redis  - pushed to a Redis list shared by all processes and flushed the same way by whichever
+#            process sees the threshold first (or by `manage.py flush_events`)
+
+
+def truncate(value, field_name):
+    max_length = GitLabEvent._meta.get_field(field_name).max_length
+    return value[:max_length] if isinstance(value, str) else (value or '')
+
+
+def build_event(event, project):
+    duration = event['duration']
+    return GitLabEvent(
+        gitlab_event=event['gitlab_event'],
+        project_id=project.id,
+        status=truncate(event['status'], 'status'),
+        branch=truncate(event['branch'], 'branch'),
+        user_name=truncate(event['user_name'], 'user_name'),
+        duration=int(duration) if duration is not None else None,
+        created_at=timezone.now(),
+    )
+
+
+def to_json(instance):
+    return json.dumps({
+        'gitlab_event': instance.gitlab_event,
+        'project_id': instance.project_id,
+        'status': instance.status,
+        'branch': instance.branch,
+        'user_name': instance.user_name,
+        'duration': instance.duration,
+        'created_at': instance.created_at.isoformat(),
+    })
+
+
+def from_json(raw):
+    data = json.loads(raw)
+    data['created_at'] = parse_datetime(data['created_at'])
+    return GitLabEvent(**data)
+
+
+def write_events(instances):
+    if not instances:
+        return 0
+    try:
+        GitLabEvent.objects.bulk_create(instances, batch_size=settings.EVENT_SINK_BATCH_SIZE)
+    except IntegrityError:
+        # e.g. a project deleted while its events were buffered: keep the rest of the batch;
+        # save() counts each row into the statistics through post_save
+        written = 0
+        for instance in instances:
+            try:
+                instance.save()
+                written += 1
+            except IntegrityError as e:
+                logger.error("Dropping event %s: %s", to_json(instance), e)
+        return written
+    # bulk_create sends no post_save
+    add_events(instances)
+    return len(instances)
+
+
+class EventBuffer:
+    def __init__(self):
+        self._events = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._flusher = None
+
+    def add(self, instance):
+        self.ensure_flusher()
+        if settings.EVENT_SINK_MODE == 'redis':
+            size = get_redis_connection('default').lpush(EVENTS_BUFFER_KEY, to_json(instance))
+        else:
+            with self._lock:
+                self._events.append(instance)
+                size = len(self._events)
+
+        # the request never waits for the INSERT, the flusher thread does it
+        if size >= settings.EVENT_SINK_BATCH_SIZE:
+            self._wake.set()
+
+    def flush(self):
+        if settings.EVENT_SINK_MODE == 'redis':
+            return flush_redis_buffer()
+
+        with self._lock:
+            events, self._events = self._events, []
+        try:
+            return write_events(events)
+        except DatabaseError:
+            # database unavailable: put the events back for the next flush
+            with self._lock:
+                self._events[:0] = events
+            raise
+
+    def ensure_flusher(self):
+        if self._flusher is None or not self._flusher.is_alive():
+            with self._lock:
+                if self._flusher is None or not self._flusher.is_alive():
+                    self._flusher = threading.Thread(target=self.run_flusher, name='event-sink', daemon=True)
+                    self._flusher.start()
+
+    def run_flusher(self):
+        while True:
+            self._wake.wait(settings.EVENT_SINK_FLUSH_INTERVAL)
+            self._wake.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Event sink flush failed")
+
+
+def flush_redis_buffer():
+    conn = get_redis_connection('default')
+    written = 0
+    while True:
+        # LPUSH + RPOP keeps the events in arrival order; RPOP with a count pops the batch atomically
+        raw = conn.rpop(EVENTS_BUFFER_KEY, settings.EVENT_SINK_BATCH_SIZE)
+        if not raw:
+            return written
+        try:
+            written += write_events([from_json(item) for item in raw])
+        except DatabaseError:
+            # database unavailable: put the batch back at the tail, oldest last, for the next flush
+            conn.rpush(EVENTS_BUFFER_KEY, *reversed(raw))
+            raise
+
+
+event_buffer = EventBuffer()
+atexit.register(lambda: event_buffer.flush() if settings.EVENT_SINK_MODE != 'sync' else None)
+
+
+def record_event(event, project):
+    instance = build_event(event, project)
+    if settings.EVENT_SINK_MODE == 'sync':
+        instance.save()
+    else:
+        event_buffer.add(instance)
+    return instance
+
+
+async def arecord_event(event, project):
+    instance = build_event(event, project)
+    if settings.EVENT_SINK_MODE == 'sync':
+        await instance.asave()
+    elif settings.EVENT_SINK_MODE == 'redis':
+        await sync_to_async(event_buffer.add)(instance)
+    else:
+        event_buffer.add(instance)
+    return instance
@@ -0,0 +1,226 @@
+import logging
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from api.metrics import timer
+from apps.models import DailyEventStats, GitLabEvent, HourlyEventStats
+
+# Event statistics from rollup tables (HourlyEventStats, DailyEventStats).
+#
+# Every batch of GitLabEvent rows written (api.sink.write_events, or a single save through the
+# post_save signal) is counted into one row per (project, bucket, event type, status, user) of both
+# tables, with an INSERT ... ON CONFLICT DO UPDATE that adds to the counters. Reading the stats of a
+# window then sums a few hundred rollup rows instead of scanning gitlab_events. Pipeline durations
+# are kept as a histogram, so percentiles are estimates within a bucket.
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (30, 60, 120, 300, 600, 1200, 1800, 3600)  # seconds, upper bounds
+HISTOGRAM_FIELDS = [f'duration_le_{bound}' for bound in DURATION_BUCKETS] + ['duration_over']
+COUNTER_FIELDS = ['events', 'duration_count', 'duration_sum'] + HISTOGRAM_FIELDS
+KEY_FIELDS = ['project_id', 'bucket', 'gitlab_event', 'status', 'user_name']
+
+# pipelines that ran to an end; skipped ones never started
+FINISHED_STATUSES = ('success', 'failed', 'canceled')
+# windows up to this long are read from the hourly table, longer ones from the daily one
+HOURLY_WINDOW = timedelta(days=2)
+REBUILD_CHUNK_SIZE = 5000
+
+
+def hour_bucket(moment):
+    return timezone.localtime(moment).replace(minute=0, second=0, microsecond=0)
+
+
+def day_bucket(moment):
+    return timezone.localtime(moment).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def duration_field(seconds):
+    for bound in DURATION_BUCKETS:
+        if seconds <= bound:
+            return f'duration_le_{bound}'
+    return 'duration_over'
+
+
+def aggregate(instances, bucket_of):
+    rows = defaultdict(Counter)
+    for instance in instances:
+        key = (instance.project_id, bucket_of(instance.created_at), instance.gitlab_event, instance.status,
+               instance.user_name)
+        counters = rows[key]
+        counters['events'] += 1
+        if instance.gitlab_event == 'pipeline' and instance.duration:
+            counters['duration_count'] += 1
+            counters['duration_sum'] += instance.duration
+            counters[duration_field(instance.duration)] += 1
+    return rows
+
+
+def upsert(model, rows):
+    if not rows:
+        return
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    columns = KEY_FIELDS + COUNTER_FIELDS
+    sql = (
+        f"INSERT INTO {table} ({', '.join(quote(column) for column in columns)}) "
+        f"VALUES ({', '.join(['%s'] * len(columns))}) "
+        f"ON CONFLICT ({', '.join(quote(column) for column in KEY_FIELDS)}) DO UPDATE SET "
+        + ', '.join(f"{quote(field)} = {table}.{quote(field)} + excluded.{quote(field)}"
+                    for field in COUNTER_FIELDS)
+    )
+    # sorted, so concurrent writers lock the rows in the same order
+    params = [
+        [project_id, connection.ops.adapt_datetimefield_value(bucket), gitlab_event, status, user_name]
+        + [counters[field] for field in COUNTER_FIELDS]
+        for (project_id, bucket, gitlab_event, status, user_name), counters in sorted(rows.items())
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+def count_events(instances):
+    upsert(HourlyEventStats, aggregate(instances, hour_bucket))
+    upsert(DailyEventStats, aggregate(instances, day_bucket))
+
+
+def add_events(instances):
+    # never fails the write of the events themselves; rebuild_event_stats repairs a gap
+    instances = [instance for instance in instances if instance.project_id]
+    if not instances:
+        return
+    try:
+        # a savepoint: a failed upsert must not break the transaction the events were written in
+        with timer('stats'), transaction.atomic():
+            count_events(instances)
+    except Exception:
+        logger.exception("Could not add %s events to the statistics", len(instances))
+
+
+def rebuild_stats(since, chunk_size=REBUILD_CHUNK_SIZE):
+    # recount from gitlab_events, from the start of since's day: the daily table over the whole
+    # span, the hourly one only as far back as prune_events keeps it (STATS_HOURLY_RETENTION_DAYS).
+    # In one transaction, so readers see the old counts until it commits. Returns the events counted.
+    start = day_bucket(since)
+    hourly_start = max(start, day_bucket(timezone.now() - timedelta(days=settings.STATS_HOURLY_RETENTION_DAYS)))
+    events = GitLabEvent.objects.filter(created_at__gte=start).only(
+        'project_id', 'gitlab_event', 'status', 'user_name', 'duration', 'created_at'
+    )
+
+    def add(chunk):
+        upsert(DailyEventStats, aggregate(chunk, day_bucket))
+        upsert(HourlyEventStats, aggregate([event for event in chunk if event.created_at >= hourly_start],
+                                           hour_bucket))
+
+    counted = 0
+    chunk = []
+    with transaction.atomic():
+        DailyEventStats.objects.filter(bucket__gte=start).delete()
+        HourlyEventStats.objects.filter(bucket__gte=hourly_start).delete()
+        for event in events.iterator(chunk_size=chunk_size):
+            chunk.append(event)
+            if len(chunk) >= chunk_size:
+                add(chunk)
+                counted += len(chunk)
+                chunk = []
+        if chunk:
+            add(chunk)
+            counted += len(chunk)
+    return counted
+
+
+def percentile(histogram, total, share):
+    # linear within the bucket that holds the share; the last bucket has no upper bound
+    if not total:
+        return None
+    rank = share * total
+    seen = 0
+    lower = 0
+    for bound, field in zip(DURATION_BUCKETS + (None,), HISTOGRAM_FIELDS):
+        count = histogram[field]
+        if count and seen + count >= rank:
+            if bound is None:
+                return lower
+            return round(lower + (bound - lower) * (rank - seen) / count)
+        seen += count
+        lower = bound if bound is not None else lower
+    return lower
+
+
+def summarize(rows):
+    pipelines = Counter()
+    histogram = Counter()
+    duration_sum = duration_count = 0
+    pushes = Counter()
+    merge_requests = Counter()
+    for row in rows:
+        if row['gitlab_event'] == 'pipeline':
+            pipelines[row['status']] += row['events']
+            duration_sum += row['duration_sum']
+            duration_count += row['duration_count']
+            for field in HISTOGRAM_FIELDS:
+                histogram[field] += row[field]
+        elif row['gitlab_event'] == 'push':
+            pushes[row['user_name']] += row['events']
+        elif row['gitlab_event'] == 'merge':
+            merge_requests[row['status']] += row['events']
+
+    finished = sum(pipelines[status] for status in FINISHED_STATUSES)
+    return {
+        'pipelines': {
+            'total': sum(pipelines.values()),
+            'by_status': dict(pipelines),
+            'success_rate': round(pipelines['success'] / finished, 4) if finished else None,
+            'duration': {
+                'count': duration_count,
+                'avg': round(duration_sum / duration_count) if duration_count else None,
+                'p50': percentile(histogram, duration_count, 0.5),
+                'p90': percentile(histogram, duration_count, 0.9),
+                'p95': percentile(histogram, duration_count, 0.95),
+            },
+        },
+        'pushes': {
+            'total': sum(pushes.values()),
+            'by_user': dict(pushes.most_common()),
+        },
+        'merge_requests': {
+            'total': sum(merge_requests.values()),
+            'by_status': dict(merge_requests),
+        },
+    }
+
+
+def get_stats(since, until=None, projects=None):
+    # per project statistics of the events from `since` (rounded down to its bucket) to `until`
+    until = until or timezone.now()
+    hourly = until - since <= HOURLY_WINDOW
+    model = HourlyEventStats if hourly else DailyEventStats
+    start = hour_bucket(since) if hourly else day_bucket(since)
+
+    rows = model.objects.filter(bucket__gte=start, bucket__lt=until)
+    if projects:
+        rows = rows.filter(project__name__in=projects)
+    rows = rows.values('project__name', 'gitlab_event', 'status', 'user_name').annotate(
+        **{f'sum_{field}': Sum(field) for field in COUNTER_FIELDS}
+    ).order_by()
+
+    by_project = defaultdict(list)
+    for row in rows:
+        by_project[row['project__name']].append({
+            'gitlab_event': row['gitlab_event'],
+            'status': row['status'],
+            'user_name': row['user_name'],
+            **{field: row[f'sum_{field}'] for field in COUNTER_FIELDS},
+        })
+
+    return {
+        'since': start.isoformat(),
+        'until': until.isoformat(),
+        'granularity': 'hour' if hourly else 'day',
+        'projects': {name: summarize(project_rows) for name, project_rows in sorted(by_project.items())},
+    }
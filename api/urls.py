@@ -1,8 +1,14 @@
 from django.urls import path
-from api.views import GitlabWebhookAPIView, TelegramWebhookAPIView, SetWebhookAPIView
+from api.async_views import gitlab_webhook, telegram_webhook
+from api.views import GitlabWebhookAPIView, TelegramWebhookAPIView, SetWebhookAPIView, StatsAPIView
 
 urlpatterns = [
     path('gitlab/webhook/', GitlabWebhookAPIView.as_view(), name='gitlab-webhook'),
     path('telegram/webhook/', TelegramWebhookAPIView.as_view(), name='telegram-webhook'),
     path('webhook/', SetWebhookAPIView.as_view(), name='set-webhook'),
+    path('stats/', StatsAPIView.as_view(), name='stats'),
+
+    # native async endpoints, served by root/asgi.py
+    path('async/gitlab/webhook/', gitlab_webhook, name='gitlab-webhook-async'),
+    path('async/telegram/webhook/', telegram_webhook, name='telegram-webhook-async'),
 ]
@@ -1,18 +1,6 @@
-from django.core.cache import cache
+from django_redis import get_redis_connection
 
-from apps.models import GitlabUser
-
-
-def save_telegram_message_id(event_key, message_id, timeout=60 * 60 * 24):
-    cache.set(event_key, message_id, timeout=timeout)
-
-
-def get_telegram_message_id(event_key):
-    return cache.get(event_key)
-
-
-def delete_telegram_message_id(event_key):
-    cache.delete(event_key)
+STATS_KEY = 'gitlab_bot:stats'
 
 
 def parse_group_info(message):
@@ -35,9 +23,22 @@ def parse_group_info(message):
     return group_info
 
 
-def get_gitlab_mention(gitlab_id, full_name):
-    try:
-        user = GitlabUser.objects.get(gitlab_id=gitlab_id)
-        return f"[{full_name}](tg://user?id={user.telegram_id})"
-    except GitlabUser.DoesNotExist:
-        return full_name
+def incr_stat(name, amount=1):
+    get_redis_connection('default').hincrbyfloat(STATS_KEY, name, amount)
+
+
+def incr_stats(**amounts):
+    pipe = get_redis_connection('default').pipeline(transaction=False)
+    for name, amount in amounts.items():
+        if amount:
+            pipe.hincrbyfloat(STATS_KEY, name, amount)
+    pipe.execute()
+
+
+def set_stat(name, value):
+    get_redis_connection('default').hset(STATS_KEY, name, value)
+
+
+def get_stats():
+    raw = get_redis_connection('default').hgetall(STATS_KEY)
+    return {key.decode(): float(value) for key, value in raw.items()}
@@ -1,5 +1,23 @@
-from django.contrib import admin
-from apps.models import GitlabProject, GitlabUser, GitLabEvent, TelegramGroup, TelegramAdmin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.core.paginator import Paginator
+from django.db import connection
+from django.template.response import TemplateResponse
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from api.members import format_result, parse_members, sync_members
+from api.queue import replay_dead_letter
+from apps.models import DeadLetter, GitlabProject, GitlabRoute, GitlabUser, GitLabEvent, TelegramGroup, \
+    TelegramAdmin
+
+
+class GitlabRouteInline(admin.TabularInline):
+    model = GitlabRoute
+    extra = 0
+    fields = ('telegram_group', 'message_thread_id', 'gitlab_event', 'branch', 'status', 'is_active')
+    autocomplete_fields = ('telegram_group',)
 
 
 class GitlabUserInline(admin.TabularInline):
@@ -9,6 +27,14 @@ class GitlabUserInline(admin.TabularInline):
     verbose_name_plural = "Gitlab-Users"
 
 
+class SyncMembersForm(forms.Form):
+    members = forms.FileField(
+        help_text="Output of GitLab's members API (JSON), a JSON object of project name -> members, or a CSV "
+                  "with id, username and optional project and telegram_id columns."
+    )
+    prune = forms.BooleanField(required=False, help_text="Unlink users that are no longer members of these projects.")
+
+
 @admin.register(GitlabProject)
 class GitlabProjectAdmin(admin.ModelAdmin):
     list_display = (
@@ -20,19 +46,106 @@ class GitlabProjectAdmin(admin.ModelAdmin):
         'show_project',
         'show_duration',
         'show_status',
+        'push_digest_window',
     )
-    inlines = [GitlabUserInline]
+    inlines = [GitlabRouteInline, GitlabUserInline]
+    actions = ('sync_members',)
+
+    @admin.action(description="Sync members from a GitLab export")
+    def sync_members(self, request, queryset):
+        form = SyncMembersForm(request.POST, request.FILES) if 'apply' in request.POST else SyncMembersForm()
+        if not form.is_valid():
+            return TemplateResponse(request, 'admin/apps/gitlabproject/sync_members.html', {
+                **self.admin_site.each_context(request),
+                'title': "Sync members",
+                'opts': self.model._meta,
+                'form': form,
+                'projects': queryset,
+                'action_checkbox_name': ACTION_CHECKBOX_NAME,
+            })
+
+        names = set(queryset.values_list('name', flat=True))
+        upload = form.cleaned_data['members']
+        try:
+            # a plain member list belongs to the project selected; files keyed by project may hold more
+            project_members = parse_members(upload.read(), upload.name,
+                                            project=next(iter(names)) if len(names) == 1 else None)
+        except ValueError as e:
+            self.message_user(request, f"Could not read members: {e}", messages.ERROR)
+            return None
+
+        project_members = {name: members for name, members in project_members.items() if name in names}
+        result = sync_members(project_members, prune=form.cleaned_data['prune'])
+        self.message_user(request, format_result(result))
+        return None
+
+
+@admin.register(GitlabRoute)
+class GitlabRouteAdmin(admin.ModelAdmin):
+    list_display = ('project', 'telegram_group', 'message_thread_id', 'gitlab_event', 'branch', 'status', 'is_active')
+    list_filter = ('gitlab_event', 'is_active')
+    list_select_related = ('project', 'telegram_group')
+    autocomplete_fields = ('telegram_group',)
 
 
 @admin.register(GitlabUser)
 class GitlabUserAdmin(admin.ModelAdmin):
-    list_display = ('gitlab_username', 'telegram_id')
+    list_display = ('gitlab_username', 'gitlab_id', 'telegram_id')
+    search_fields = ('gitlab_username', 'gitlab_id', 'telegram_id')
     filter_horizontal = ('projects',)
 
 
+class EstimatedCountPaginator(Paginator):
+    # COUNT(*) over the whole table is a sequential scan; the planner's estimate is good enough to
+    # page through it. Filtered lists (date hierarchy, event type) still get an exact count.
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        if not query.where and connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+                               [self.object_list.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] > 0:
+                return row[0]
+        return super().count
+
+
 @admin.register(GitLabEvent)
 class GitLabEventAdmin(admin.ModelAdmin):
     list_display = ('gitlab_event', 'project', 'user_name', 'status', 'created_at')
+    list_select_related = ('project',)
+    list_filter = ('gitlab_event',)
+    date_hierarchy = 'created_at'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    raw_id_fields = ('project',)
+
+
+@admin.register(DeadLetter)
+class DeadLetterAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'project', 'chat_id', 'kind', 'error_class', 'error_code', 'attempts', 'replayed_at')
+    list_select_related = ('project',)
+    list_filter = ('error_class', 'error_code', 'kind', ('replayed_at', admin.EmptyFieldListFilter))
+    date_hierarchy = 'created_at'
+    raw_id_fields = ('project',)
+    readonly_fields = ('job', 'created_at')
+    actions = ('replay',)
+
+    @admin.action(description="Replay selected dead letters")
+    def replay(self, request, queryset):
+        # for a handful of letters; bulk recovery goes through `manage.py replay_dead_letters --rate`
+        replayed = 0
+        for letter in queryset.exclude(text='').order_by('created_at', 'id'):
+            try:
+                replay_dead_letter(letter)
+            except Exception as e:
+                self.message_user(request, f"Dead letter {letter.id} failed again: {e}", messages.ERROR)
+                break
+            letter.replayed_at = timezone.now()
+            letter.save(update_fields=['replayed_at'])
+            replayed += 1
+        self.message_user(request, f"Replayed {replayed} dead letters.")
 
 
 @admin.register(TelegramAdmin)
@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.sink import flush_redis_buffer, EVENTS_BUFFER_KEY
+
+
+class Command(BaseCommand):
+    help = "Write the GitLab events buffered in Redis (EVENT_SINK_MODE=redis) to the database."
+
+    def handle(self, *args, **options):
+        if settings.EVENT_SINK_MODE != 'redis':
+            self.stdout.write(f"EVENT_SINK_MODE is '{settings.EVENT_SINK_MODE}', nothing is buffered in {EVENTS_BUFFER_KEY}.")
+        written = flush_redis_buffer()
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} events."))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from api.messages import message_store_stats, prune_message_ids
+from apps.models import GitlabProject
+
+
+class Command(BaseCommand):
+    help = "Show the stored Telegram message ids (api/messages.py) per project: entries and memory used."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prune', action='store_true', help="Remove expired entries first.")
+
+    def handle(self, *args, **options):
+        if options['prune']:
+            removed = sum(prune_message_ids(project_id) for project_id in message_store_stats())
+            self.stdout.write(f"Pruned {removed} expired entries.")
+
+        stats = message_store_stats()
+        names = dict(GitlabProject.objects.filter(id__in=stats).values_list('id', 'name'))
+        total_entries = total_bytes = 0
+        for project_id, row in sorted(stats.items(), key=lambda item: -item[1]['bytes']):
+            name = names.get(project_id, f"#{project_id}")
+            self.stdout.write(f"{name}: {row['entries']} entries ({row['expired']} expired), "
+                              f"{row['bytes'] / 1024:.1f}KB")
+            total_entries += row['entries']
+            total_bytes += row['bytes']
+        self.stdout.write(f"total: {total_entries} entries in {len(stats)} projects, {total_bytes / 1024:.1f}KB")
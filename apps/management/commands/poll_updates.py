@@ -0,0 +1,44 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.bot import delete_webhook
+from api.client import TelegramError
+from api.polling import Poller
+
+
+class Command(BaseCommand):
+    help = "Fetch bot commands with getUpdates long polling instead of the Telegram webhook."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete-webhook', action='store_true',
+                            help="Remove the webhook first; Telegram refuses getUpdates while one is set.")
+        parser.add_argument('--concurrency', type=int, help="Chats handled at once (TELEGRAM_POLL_CONCURRENCY).")
+        parser.add_argument('--timeout', type=int, help="Long polling timeout in seconds (TELEGRAM_POLL_TIMEOUT).")
+
+    def handle(self, *args, **options):
+        if options['delete_webhook']:
+            delete_webhook()
+            self.stdout.write("Webhook deleted.")
+
+        poller = Poller(concurrency=options['concurrency'], timeout=options['timeout'])
+
+        def stop(signum, frame):
+            self.stdout.write("Stopping after the current batch...")
+            poller.stop()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Polling for updates (timeout {poller.timeout}s, {poller.concurrency} chats at once)."
+        ))
+        started = time.monotonic()
+        try:
+            poller.run()
+        except TelegramError as e:
+            if e.error_code == 409:
+                raise CommandError(f"{e}. Run with --delete-webhook to switch from the webhook to polling.")
+            raise CommandError(str(e))
+        self.stdout.write(f"Stopped. Handled {poller.handled} updates in {time.monotonic() - started:.0f}s.")
@@ -0,0 +1,66 @@
+import gzip
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.models import GitLabEvent, HourlyEventStats
+
+ARCHIVE_FIELDS = ('id', 'gitlab_event', 'project_id', 'project__name', 'status', 'branch', 'user_name',
+                  'duration', 'created_at')
+
+
+class Command(BaseCommand):
+    help = "Delete (and optionally archive) GitLab events older than the retention period, in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.EVENT_RETENTION_DAYS,
+                            help="Keep events from the last N days (default: EVENT_RETENTION_DAYS).")
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Rows deleted per transaction.")
+        parser.add_argument('--sleep', type=float, default=0.1, help="Pause between chunks, in seconds.")
+        parser.add_argument('--archive', help="Append the deleted rows to this gzipped JSON lines file.")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the events to delete.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        expired = GitLabEvent.objects.filter(created_at__lt=cutoff)
+
+        if options['dry_run']:
+            self.stdout.write(f"{expired.count()} events older than {cutoff:%Y-%m-%d %H:%M}.")
+            return
+
+        archive = gzip.open(options['archive'], 'at', encoding='utf-8') if options['archive'] else None
+        deleted = 0
+        try:
+            while True:
+                # short transactions on the oldest ids, so the table is never locked for long
+                ids = list(expired.order_by('id').values_list('id', flat=True)[:options['chunk_size']])
+                if not ids:
+                    break
+
+                if archive:
+                    for row in GitLabEvent.objects.filter(id__in=ids).order_by('id').values(*ARCHIVE_FIELDS):
+                        row['created_at'] = row['created_at'].isoformat()
+                        archive.write(json.dumps(row) + '\n')
+                    archive.flush()
+
+                count, _ = GitLabEvent.objects.filter(id__in=ids).delete()
+                deleted += count
+                self.stdout.write(f"Deleted {deleted} events...")
+
+                if options['sleep']:
+                    time.sleep(options['sleep'])
+        finally:
+            if archive:
+                archive.close()
+
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} events older than {cutoff:%Y-%m-%d %H:%M}."))
+
+        # daily statistics are kept; the hourly ones only serve windows of a couple of days
+        stats_cutoff = timezone.now() - timedelta(days=settings.STATS_HOURLY_RETENTION_DAYS)
+        deleted, _ = HourlyEventStats.objects.filter(bucket__lt=stats_cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} hourly statistics rows older than "
+                                             f"{stats_cutoff:%Y-%m-%d %H:%M}."))
@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.stats import REBUILD_CHUNK_SIZE, rebuild_stats
+
+
+class Command(BaseCommand):
+    help = "Recount the hourly and daily event statistics of the last days from the GitLab events table."
+
+    def add_arguments(self, parser):
+        # statistics outlive the events: going back further than prune_events keeps them loses counts.
+        parser.add_argument('--days', type=int, default=settings.EVENT_RETENTION_DAYS - 1,
+                            help="Rebuild the daily statistics of the last N days (default: EVENT_RETENTION_DAYS - 1), "
+                                 "the hourly ones of at most STATS_HOURLY_RETENTION_DAYS.")
+        parser.add_argument('--chunk-size', type=int, default=REBUILD_CHUNK_SIZE, help="Events read per query.")
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(days=options['days'])
+        counted = rebuild_stats(since, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Counted {counted} events since {since:%Y-%m-%d} into the statistics."))
@@ -0,0 +1,99 @@
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from api.queue import replay_dead_letter
+from apps.models import DeadLetter
+
+
+def parse_moment(value):
+    # "2024-05-01" or "2024-05-01T12:30"; naive values are in TIME_ZONE
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f"Invalid date: {value}")
+        moment = datetime.combine(day, datetime.min.time())
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class Command(BaseCommand):
+    help = "Send failed deliveries (dead letters) again, oldest first, at a limited rate."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', action='append', help="Only this project (repeatable).")
+        parser.add_argument('--since', help="Only dead letters created at or after this date/time.")
+        parser.add_argument('--until', help="Only dead letters created before this date/time.")
+        parser.add_argument('--error', action='append', dest='errors',
+                            help="Only this error class, e.g. TelegramError or ConnectionError (repeatable).")
+        parser.add_argument('--error-code', type=int, action='append', dest='error_codes',
+                            help="Only this Bot API error code, e.g. 502 (repeatable).")
+        parser.add_argument('--rate', type=float, default=1.0, help="Messages per second (default: 1).")
+        parser.add_argument('--limit', type=int, help="Replay at most this many dead letters.")
+        parser.add_argument('--max-failures', type=int, default=10,
+                            help="Stop after this many failures in a row (default: 10).")
+        parser.add_argument('--include-replayed', action='store_true', help="Also send letters replayed before.")
+        parser.add_argument('--dry-run', action='store_true', help="Only list what would be sent.")
+
+    def handle(self, *args, **options):
+        if options['rate'] <= 0:
+            raise CommandError("--rate must be positive")
+
+        letters = DeadLetter.objects.select_related('project').exclude(text='').order_by('created_at', 'id')
+        if not options['include_replayed']:
+            letters = letters.filter(replayed_at__isnull=True)
+        if options['project']:
+            letters = letters.filter(project__name__in=options['project'])
+        if options['since']:
+            letters = letters.filter(created_at__gte=parse_moment(options['since']))
+        if options['until']:
+            letters = letters.filter(created_at__lt=parse_moment(options['until']))
+        if options['errors']:
+            letters = letters.filter(error_class__in=options['errors'])
+        if options['error_codes']:
+            letters = letters.filter(error_code__in=options['error_codes'])
+        if options['limit']:
+            letters = letters[:options['limit']]
+
+        if options['dry_run']:
+            total = 0
+            for letter in letters.iterator():
+                total += 1
+                self.stdout.write(f"{letter.created_at:%Y-%m-%d %H:%M:%S} {letter.project or '-'} -> "
+                                  f"{letter.chat_id}: {letter.error_class} {letter.error[:80]}")
+            self.stdout.write(f"{total} dead letters would be replayed.")
+            return
+
+        interval = 1 / options['rate']
+        replayed = failed = failures_in_row = 0
+        for letter in letters.iterator():
+            started = time.monotonic()
+            try:
+                replay_dead_letter(letter)
+            except Exception as e:
+                failed += 1
+                failures_in_row += 1
+                letter.attempts += 1
+                letter.error_class = type(e).__name__
+                letter.error_code = getattr(e, 'error_code', None)
+                letter.error = str(e)
+                letter.save(update_fields=['attempts', 'error_class', 'error_code', 'error'])
+                self.stderr.write(f"Dead letter {letter.id} failed again: {e}")
+                if failures_in_row >= options['max_failures']:
+                    self.stderr.write(f"{failures_in_row} failures in a row, stopping.")
+                    break
+            else:
+                replayed += 1
+                failures_in_row = 0
+                letter.replayed_at = timezone.now()
+                letter.save(update_fields=['replayed_at'])
+
+            # the Bot API rate limiter still applies on top of this pace
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+        self.stdout.write(self.style.SUCCESS(f"Replayed {replayed} dead letters, {failed} failed."))
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.replay import Replayer, read_lines
+
+
+def format_stats(stats, seconds):
+    rate = stats['replayed'] / seconds if seconds else 0
+    return (f"{stats['replayed']} events replayed in {seconds:.1f}s ({rate:.0f} events/s), "
+            f"{stats['recorded']} recorded, {stats['messages']} messages, {stats['unknown_project']} of unknown "
+            f"projects, {stats['skipped']} skipped, {stats['invalid']} invalid, {stats['failed']} failed")
+
+
+class Command(BaseCommand):
+    help = "Replay archived GitLab hooks (JSON lines) through the webhook pipeline."
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="JSON lines files (.gz too), or - for stdin.")
+        mode = parser.add_mutually_exclusive_group(required=True)
+        mode.add_argument('--dry-run', action='store_true', help="Only write the events to the event log.")
+        mode.add_argument('--sandbox-chat', type=int, help="Send every message to this chat instead.")
+        mode.add_argument('--deliver', action='store_true', help="Send to the projects' own chats, like live hooks.")
+        parser.add_argument('--sandbox-thread', type=int, help="Topic of the sandbox chat.")
+        parser.add_argument('--workers', type=int, default=4,
+                            help="Projects replayed in parallel; each project's events stay in order (default: 4).")
+        parser.add_argument('--project', help="Project name for GitLab Events API records, which carry none.")
+        parser.add_argument('--create-projects', action='store_true', help="Create projects that don't exist yet.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Events written per INSERT.")
+        parser.add_argument('--progress', type=float, default=5, help="Seconds between progress lines.")
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError("--workers must be at least 1")
+
+        if options['dry_run']:
+            mode = 'dry-run'
+        elif options['sandbox_chat'] is not None:
+            mode = 'sandbox'
+        else:
+            mode = 'deliver'
+
+        replayer = Replayer(
+            mode=mode,
+            sandbox_chat=options['sandbox_chat'],
+            sandbox_thread=options['sandbox_thread'],
+            workers=options['workers'],
+            project=options['project'],
+            create_projects=options['create_projects'],
+            batch_size=options['batch_size'],
+        )
+
+        def progress(stats, seconds):
+            self.stdout.write(f"{stats['read']} read, {format_stats(stats, seconds)}")
+
+        try:
+            stats, seconds = replayer.run(read_lines(options['paths']), progress, options['progress'])
+        except OSError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(format_stats(stats, seconds)))
@@ -0,0 +1,77 @@
+import multiprocessing
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django_redis import get_redis_connection
+
+from api.queue import run_worker, recover_processing, queue_depth
+from api.utils import get_stats
+
+
+def worker_main(shard):
+    # forked children must not share the parent's database socket
+    connections.close_all()
+    run_worker(shard)
+
+
+class Command(BaseCommand):
+    help = "Start the pool of Telegram delivery workers (one process per queue shard)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stats', action='store_true', help="Print queue depth and lag metrics and exit.")
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.print_stats()
+            return
+
+        recover_processing(get_redis_connection('default'))
+
+        workers = []
+        for shard in range(settings.TELEGRAM_DELIVERY_WORKERS):
+            process = multiprocessing.Process(target=worker_main, args=(shard,), name=f"delivery-worker-{shard}")
+            process.start()
+            workers.append(process)
+        self.stdout.write(self.style.SUCCESS(f"Started {len(workers)} delivery workers."))
+
+        stopping = False
+
+        def stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        while not stopping:
+            for index, process in enumerate(workers):
+                if not process.is_alive():
+                    self.stderr.write(f"{process.name} exited with code {process.exitcode}, restarting.")
+                    process = multiprocessing.Process(target=worker_main, args=(index,), name=process.name)
+                    process.start()
+                    workers[index] = process
+            time.sleep(1)
+
+        for process in workers:
+            process.terminate()
+        for process in workers:
+            process.join()
+        self.stdout.write("Delivery workers stopped.")
+
+    def print_stats(self):
+        depth = queue_depth()
+        stats = get_stats()
+        delivered = stats.get('queue_delivered', 0)
+        avg_lag = stats.get('queue_lag_seconds_total', 0) / delivered if delivered else 0
+
+        self.stdout.write(f"queued:   {depth['queued']} (per shard: {depth['shards']})")
+        self.stdout.write(f"delayed:  {depth['delayed']}")
+        self.stdout.write(f"delivered: {int(delivered)}")
+        self.stdout.write(f"retried:  {int(stats.get('queue_retried', 0))}")
+        self.stdout.write(f"failed:   {int(stats.get('queue_failed', 0))}")
+        self.stdout.write(f"dead letters: {int(stats.get('dead_letters', 0))}")
+        self.stdout.write(f"duplicate hooks: {int(stats.get('webhook_deduplicated', 0))}")
+        self.stdout.write(f"avg lag:  {avg_lag:.3f}s, last lag: {stats.get('queue_last_lag_seconds', 0):.3f}s")
@@ -0,0 +1,37 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.members import BATCH_SIZE, format_result, parse_members, sync_members
+
+
+class Command(BaseCommand):
+    help = "Import GitLab project members (members API output, JSON or CSV) into Gitlab Users."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Members file, or - for stdin.")
+        parser.add_argument('--project',
+                            help="Project of a plain member list, or of CSV rows without a project column.")
+        parser.add_argument('--prune', action='store_true',
+                            help="Unlink users that are no longer members of the imported projects.")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help="Report the changes without saving them.")
+
+    def handle(self, *args, **options):
+        if options['path'] == '-':
+            content, filename = sys.stdin.read(), ''
+        else:
+            with open(options['path'], 'rb') as f:
+                content, filename = f.read(), options['path']
+
+        try:
+            project_members = parse_members(content, filename, project=options['project'])
+        except ValueError as e:
+            raise CommandError(f"Could not read members: {e}")
+
+        result = sync_members(project_members, prune=options['prune'], dry_run=options['dry_run'],
+                              batch_size=options['batch_size'])
+        for name in result['unknown_projects']:
+            self.stderr.write(f"Unknown project {name!r}: its members were imported but not linked.")
+        prefix = "Dry run, nothing saved. " if options['dry_run'] else ""
+        self.stdout.write(self.style.SUCCESS(prefix + format_result(result)))
@@ -1,4 +1,12 @@
+from django.contrib.postgres.indexes import BrinIndex
 from django.db import models
+from django.utils import timezone
+
+GITLAB_EVENT_CHOICES = (
+    ('push', 'Push'),
+    ('merge', 'Merge Request'),
+    ('pipeline', 'Pipeline'),
+)
 
 
 class GitlabProject(models.Model):
@@ -18,6 +26,9 @@ class GitlabProject(models.Model):
     show_status = models.BooleanField(default=True)
     show_duration = models.BooleanField(default=True)
 
+    # seconds; pushes to a branch within this window are collected into one message (0 = off)
+    push_digest_window = models.PositiveIntegerField(default=0)
+
     def __str__(self):
         return self.name
 
@@ -27,14 +38,39 @@ class GitlabProject(models.Model):
         verbose_name_plural = 'Projects'
 
 
+class GitlabRoute(models.Model):
+    # extra targets for a project's events, on top of GitlabProject.telegram_group.
+    # Empty filters match everything; branch is a glob ("release/*").
+    project = models.ForeignKey('apps.GitlabProject', on_delete=models.CASCADE, related_name='routes')
+    telegram_group = models.ForeignKey('apps.TelegramGroup', on_delete=models.CASCADE, related_name='routes')
+    # topic to post in, instead of the group's own message_thread_id
+    message_thread_id = models.BigIntegerField(blank=True, null=True)
+
+    gitlab_event = models.CharField(max_length=20, choices=GITLAB_EVENT_CHOICES, blank=True)
+    branch = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=50, blank=True)
+    is_active = models.BooleanField(default=True)
+
+    def __str__(self):
+        filters = ' '.join(f for f in (self.gitlab_event, self.branch, self.status) if f) or 'all events'
+        return f"{self.project} -> {self.telegram_group} ({filters})"
+
+    class Meta:
+        db_table = 'gitlab_routes'
+        verbose_name = 'Route'
+        verbose_name_plural = 'Routes'
+
+
 class GitlabUser(models.Model):
     gitlab_id = models.BigIntegerField(unique=True)
-    gitlab_username = models.CharField(max_length=255, unique=True)
-    telegram_id = models.CharField(max_length=50)
+    # set by sync_members; users registered through the bot don't have one until the next sync
+    gitlab_username = models.CharField(max_length=255, unique=True, null=True, blank=True)
+    # empty for synced members until they register with the bot
+    telegram_id = models.CharField(max_length=50, null=True, blank=True)
     projects = models.ManyToManyField('apps.GitlabProject', related_name='users')
 
     def __str__(self):
-        return self.gitlab_username
+        return self.gitlab_username or str(self.gitlab_id)
 
     class Meta:
         db_table = 'gitlab_users'
@@ -43,11 +79,7 @@ class GitlabUser(models.Model):
 
 
 class GitLabEvent(models.Model):
-    EVENT_CHOICES = (
-        ('push', 'Push'),
-        ('merge', 'Merge Request'),
-        ('pipeline', 'Pipeline'),
-    )
+    EVENT_CHOICES = GITLAB_EVENT_CHOICES
 
     gitlab_event = models.CharField(max_length=20, choices=EVENT_CHOICES)
     project = models.ForeignKey('apps.GitlabProject', on_delete=models.CASCADE, related_name='events')
@@ -55,7 +87,8 @@ class GitLabEvent(models.Model):
     branch = models.CharField(max_length=100)
     user_name = models.CharField(max_length=255)
     duration = models.IntegerField(null=True, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # set when the hook arrives, not when a buffered batch is flushed (see api.sink)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
 
     def __str__(self):
         return f"{self.gitlab_event} - {self.project.name} - {self.user_name}"
@@ -64,6 +97,100 @@ class GitLabEvent(models.Model):
         verbose_name = 'Event'
         verbose_name_plural = 'Events'
         db_table = 'gitlab_events'
+        indexes = [
+            models.Index(fields=['project', 'created_at'], name='gitlab_events_project_created'),
+            models.Index(fields=['gitlab_event', 'status'], name='gitlab_events_event_status'),
+            # rows are appended in time order, so a BRIN index covers date filters and retention
+            # at a fraction of a btree's size
+            BrinIndex(fields=['created_at'], name='gitlab_events_created_brin'),
+        ]
+
+
+class EventStats(models.Model):
+    # Events counted per project, bucket, event type, status and user (api.stats), added to as
+    # events are written, so statistics never scan gitlab_events. Rows outlive prune_events.
+    project = models.ForeignKey('apps.GitlabProject', on_delete=models.CASCADE, related_name='+')
+    bucket = models.DateTimeField()
+    gitlab_event = models.CharField(max_length=20, choices=GITLAB_EVENT_CHOICES)
+    status = models.CharField(max_length=50)
+    user_name = models.CharField(max_length=255)
+
+    events = models.PositiveIntegerField(default=0)
+    duration_count = models.PositiveIntegerField(default=0)
+    duration_sum = models.BigIntegerField(default=0)
+    # histogram of durations in seconds, for percentiles (api.stats.DURATION_BUCKETS)
+    duration_le_30 = models.PositiveIntegerField(default=0)
+    duration_le_60 = models.PositiveIntegerField(default=0)
+    duration_le_120 = models.PositiveIntegerField(default=0)
+    duration_le_300 = models.PositiveIntegerField(default=0)
+    duration_le_600 = models.PositiveIntegerField(default=0)
+    duration_le_1200 = models.PositiveIntegerField(default=0)
+    duration_le_1800 = models.PositiveIntegerField(default=0)
+    duration_le_3600 = models.PositiveIntegerField(default=0)
+    duration_over = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class HourlyEventStats(EventStats):
+    class Meta:
+        verbose_name = 'Hourly Event Stats'
+        verbose_name_plural = 'Hourly Event Stats'
+        db_table = 'gitlab_event_stats_hourly'
+        constraints = [
+            models.UniqueConstraint(fields=['project', 'bucket', 'gitlab_event', 'status', 'user_name'],
+                                    name='event_stats_hourly_key'),
+        ]
+
+
+class DailyEventStats(EventStats):
+    class Meta:
+        verbose_name = 'Daily Event Stats'
+        verbose_name_plural = 'Daily Event Stats'
+        db_table = 'gitlab_event_stats_daily'
+        constraints = [
+            models.UniqueConstraint(fields=['project', 'bucket', 'gitlab_event', 'status', 'user_name'],
+                                    name='event_stats_daily_key'),
+        ]
+
+
+class DeadLetter(models.Model):
+    # a delivery that failed for good (api.deadletters), kept with the text it would have sent;
+    # `manage.py replay_dead_letters` sends it again
+    project = models.ForeignKey(
+        'apps.GitlabProject',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='dead_letters'
+    )
+    chat_id = models.BigIntegerField()
+    message_thread_id = models.BigIntegerField(blank=True, null=True)
+    kind = models.CharField(max_length=20)
+    event_key = models.CharField(max_length=255, blank=True)
+    text = models.TextField(blank=True)
+    # the queue job as it was when it failed
+    job = models.JSONField()
+
+    error_class = models.CharField(max_length=100)
+    error_code = models.IntegerField(blank=True, null=True)
+    error = models.TextField()
+    attempts = models.PositiveIntegerField(default=0)
+
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    replayed_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.kind} -> {self.chat_id}: {self.error_class}"
+
+    class Meta:
+        verbose_name = 'Dead Letter'
+        verbose_name_plural = 'Dead Letters'
+        db_table = 'gitlab_dead_letters'
+        indexes = [
+            models.Index(fields=['replayed_at', 'created_at'], name='dead_letters_pending'),
+        ]
 
 
 class TelegramAdmin(models.Model):
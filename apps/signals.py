@@ -0,0 +1,55 @@
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
+from django.dispatch import receiver
+
+from api.commands import invalidate_bot_state
+from api.mentions import invalidate_mentions
+from api.routing import invalidate_routes
+from api.stats import add_events
+from apps.models import GitlabProject, GitlabRoute, GitlabUser, GitLabEvent, TelegramAdmin, TelegramGroup
+
+
+# a renamed project is still cached under its old name, which has to go as well
+@receiver(pre_save, sender=GitlabProject)
+def remember_project_name(sender, instance, update_fields=None, **kwargs):
+    instance._previous_name = None
+    if instance.pk and (update_fields is None or 'name' in update_fields):
+        instance._previous_name = GitlabProject.objects.filter(pk=instance.pk).values_list('name', flat=True).first()
+
+
+@receiver([post_save, post_delete], sender=GitlabProject)
+def invalidate_project_route(sender, instance, **kwargs):
+    previous_name = getattr(instance, '_previous_name', None)
+    invalidate_routes(*{instance.name, previous_name} - {None})
+
+
+@receiver([post_save, post_delete], sender=GitlabRoute)
+def invalidate_routed_project(sender, instance, **kwargs):
+    invalidate_routes(*GitlabProject.objects.filter(pk=instance.project_id).values_list('name', flat=True))
+
+
+# pre_delete: once the group is gone its projects are already detached (SET_NULL) and can't be found
+@receiver([post_save, pre_delete], sender=TelegramGroup)
+def invalidate_group_routes(sender, instance, **kwargs):
+    names = GitlabProject.objects.filter(
+        Q(telegram_group_id=instance.pk) | Q(routes__telegram_group_id=instance.pk)
+    ).values_list('name', flat=True).distinct()
+    invalidate_routes(*names)
+
+
+@receiver([post_save, post_delete], sender=GitlabUser)
+def invalidate_user_mention(sender, instance, **kwargs):
+    invalidate_mentions(instance.gitlab_id)
+
+
+@receiver([post_save, post_delete], sender=TelegramAdmin)
+@receiver([post_save, post_delete], sender=TelegramGroup)
+def invalidate_admins_and_groups(sender, instance, **kwargs):
+    invalidate_bot_state()
+
+
+# single saves (EVENT_SINK_MODE=sync); bulk writes are counted by api.sink.write_events
+@receiver(post_save, sender=GitLabEvent)
+def count_event(sender, instance, created, **kwargs):
+    if created:
+        add_events([instance])
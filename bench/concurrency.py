@@ -0,0 +1,231 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+import django
+
+from bench.fake_telegram import FakeTelegramServer
+from bench.isolation import setup_bench
+from bench.payloads import merge_request_hook, pipeline_hook
+
+# Concurrency stress test: several processes (standing in for gunicorn workers or nodes) post hooks
+# for the same pipelines and the same merge request at once, with inline delivery, against a fake
+# Bot API. Afterwards every pipeline and the merge request must have exactly one message (no
+# duplicate sends) whose last text shows the final state (no lost update): the pipeline's
+# "success", and every approver on the merge request card.
+#
+#   python -m bench.concurrency --processes 1,2,4,8
+#   python -m bench.concurrency --processes 4 --no-locks    # shows the duplicates the locks prevent
+#
+# Exits 1 when a check fails. Runs against a throwaway database and a Redis DB of its own
+# (bench.isolation), which the worker processes inherit.
+
+PROJECT_PREFIX = 'bench-concurrency'
+BASE_CHAT_ID = -1000000001000
+WEBHOOK_PATH = '/api/gitlab/webhook/'
+
+
+def pipeline_project(index):
+    return f"{PROJECT_PREFIX}-{index}"
+
+
+def pipeline_chat(index):
+    return BASE_CHAT_ID - index
+
+
+MR_PROJECT = f"{PROJECT_PREFIX}-mr"
+MR_CHAT = BASE_CHAT_ID + 1
+
+
+def configure(fake_url, locks):
+    os.environ.update(
+        TELEGRAM_API_URL=fake_url,
+        TELEGRAM_DELIVERY_MODE='inline',
+        DELIVERY_LOCKS='true' if locks else 'false',
+        TELEGRAM_GLOBAL_RATE='1000000',
+        TELEGRAM_GLOBAL_BURST='1000000',
+        TELEGRAM_CHAT_RATE_PER_MINUTE='60000000',
+        TELEGRAM_CHAT_BURST='1000000',
+    )
+
+
+def setup_projects(pipelines):
+    from api.routing import invalidate_routes
+    from apps.models import GitlabProject, TelegramGroup
+
+    targets = [(pipeline_project(index), pipeline_chat(index)) for index in range(pipelines)]
+    for name, chat_id in targets + [(MR_PROJECT, MR_CHAT)]:
+        group, _ = TelegramGroup.objects.update_or_create(
+            chat_id=chat_id, defaults={'chat_name': name, 'chat_type': 'supergroup', 'is_active': True},
+        )
+        GitlabProject.objects.update_or_create(name=name, defaults={'telegram_group': group})
+        invalidate_routes(name)
+
+
+def pipeline_deliveries(run_id, pipelines, seed):
+    # every process sends the whole life of every pipeline, in its own order
+    rng = random.Random(seed)
+    order = list(range(pipelines))
+    rng.shuffle(order)
+    deliveries = []
+    for index in order:
+        for status in ('pending', 'running', 'success'):
+            hook = pipeline_hook(builds=5, status=status)
+            hook['project'] = {**hook['project'], 'name': pipeline_project(index)}
+            hook['object_attributes']['id'] = run_id + index
+            deliveries.append(('Pipeline Hook', hook))
+    return deliveries
+
+
+def merge_request(run_id, action='open', user=None):
+    hook = merge_request_hook(reviewers=1, description_lines=2)
+    hook['project'] = {**hook['project'], 'name': MR_PROJECT}
+    hook['object_attributes'].update(id=run_id, action=action, updated_at='2024-05-01 10:00:00 UTC')
+    if user:
+        hook['user'] = {**hook['user'], 'name': user, 'username': user}
+    return hook
+
+
+def approver(process, index):
+    return f"approver{process}x{index}"
+
+
+def worker(process, args, fake_url, run_id, start, results):
+    # spawned by run(): the environment already points at the bench database and Redis DB
+    configure(fake_url, not args.no_locks)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'root.settings')
+    django.setup()
+    from django.test import Client
+
+    client = Client()
+    deliveries = pipeline_deliveries(run_id, args.pipelines, args.seed + process)
+    deliveries += [('Merge Request Hook', merge_request(run_id, 'approval', approver(process, index)))
+                   for index in range(args.approvals)]
+    random.Random(args.seed + process).shuffle(deliveries)
+    bodies = [(event_type, json.dumps(hook).encode()) for event_type, hook in deliveries]
+
+    start.wait()
+    errors = 0
+    for event_type, body in bodies:
+        response = client.post(WEBHOOK_PATH, body, content_type='application/json',
+                               headers={'X-Gitlab-Event': event_type})
+        if response.status_code != 200:
+            errors += 1
+    results.put((len(bodies), errors))
+
+
+def last_texts(messages):
+    # chat -> (number of sendMessage calls, text of the last send/edit)
+    chats = {}
+    for method, data in messages:
+        chat_id = int(data['chat_id'])
+        sends, _ = chats.get(chat_id, (0, None))
+        chats[chat_id] = (sends + (method == 'sendMessage'), data['text'])
+    return chats
+
+
+def check(args, processes, messages):
+    failures = []
+    chats = last_texts(messages)
+    for index in range(args.pipelines):
+        sends, text = chats.get(pipeline_chat(index), (0, None))
+        if sends != 1:
+            failures.append(f"pipeline {index}: {sends} messages sent")
+        elif 'success' not in text:
+            failures.append(f"pipeline {index}: last text is not the final status")
+
+    sends, text = chats.get(MR_CHAT, (0, ''))
+    if sends != 1:
+        failures.append(f"merge request: {sends} messages sent")
+    missing = [approver(process, index) for process in range(processes) for index in range(args.approvals)
+               if approver(process, index) not in (text or '')]
+    if missing:
+        failures.append(f"merge request: {len(missing)} approvers missing from the card")
+    return failures
+
+
+def run(args, fake, processes):
+    from django.db import connections
+    from django.test import Client
+
+    run_id = int(time.time() * 1000) % 10 ** 9
+    fake.messages.clear()
+    fake.calls.clear()
+    # the card exists before the approvals race
+    Client().post(WEBHOOK_PATH, json.dumps(merge_request(run_id)).encode(), content_type='application/json',
+                  headers={'X-Gitlab-Event': 'Merge Request Hook'})
+    connections.close_all()
+
+    context = multiprocessing.get_context('spawn')
+    start = context.Event()
+    results = context.Queue()
+    workers = [context.Process(target=worker, args=(index, args, fake.url, run_id, start, results))
+               for index in range(processes)]
+    for process in workers:
+        process.start()
+    # give every process time to import Django before the race starts
+    time.sleep(args.warmup)
+
+    started = time.perf_counter()
+    start.set()
+    totals = [results.get() for _ in workers]
+    elapsed = time.perf_counter() - started
+    for process in workers:
+        process.join()
+
+    hooks = sum(count for count, errors in totals)
+    return {
+        'processes': processes,
+        'hooks': hooks,
+        'errors': sum(errors for count, errors in totals),
+        'seconds': elapsed,
+        'hooks_per_second': hooks / elapsed,
+        'bot_calls': dict(fake.calls),
+        'failures': check(args, processes, fake.messages),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Race several processes on the same messages and check the result.")
+    parser.add_argument('--processes', default='4', help="comma separated process counts, e.g. 1,2,4,8")
+    parser.add_argument('--pipelines', type=int, default=20)
+    parser.add_argument('--approvals', type=int, default=5, help="approvals per process on the shared merge request")
+    parser.add_argument('--latency', type=float, default=0.02, help="fake Bot API latency in seconds")
+    parser.add_argument('--warmup', type=float, default=3.0, help="seconds for the processes to start")
+    parser.add_argument('--no-locks', action='store_true', help="run with DELIVERY_LOCKS off")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help="print results as json")
+    args = parser.parse_args()
+
+    fake = FakeTelegramServer(latency=args.latency).start()
+    configure(fake.url, not args.no_locks)
+    setup_bench()
+    setup_projects(args.pipelines)
+
+    results = []
+    try:
+        for processes in (int(count) for count in args.processes.split(',')):
+            results.append(run(args, fake, processes))
+    finally:
+        fake.stop()
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        for result in results:
+            print(f"{result['processes']} processes: {result['hooks']} hooks in {result['seconds']:.2f}s "
+                  f"({result['hooks_per_second']:.0f}/s), {result['errors']} errors, Bot API {result['bot_calls']}")
+            for failure in result['failures']:
+                print(f"  FAIL {failure}")
+
+    if any(result['failures'] or result['errors'] for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
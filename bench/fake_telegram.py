@@ -0,0 +1,145 @@
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+
+# Stand-in for api.telegram.org: answers every Bot API method with a successful result after
+# `latency` seconds and answers a share (`rate_limit_ratio`) of calls with 429 + retry_after.
+# getUpdates long-polls the updates queued with push_update(), like Telegram does.
+# Point the bot at it with TELEGRAM_API_URL=http://127.0.0.1:<port>.
+
+
+class FakeTelegramServer:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.05, rate_limit_ratio=0.0, retry_after=1):
+        self.latency = latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.messages = []
+        self.message_times = []  # time.monotonic() of each entry in messages
+        self.updates = []
+        self._update_id = 0
+        self._message_id = 0
+        self._lock = threading.Lock()
+        self._new_updates = threading.Condition(self._lock)
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # headers and body are written separately; with Nagle on, keep-alive clients wait ~40ms
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length).decode()
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    data = json.loads(body or '{}')
+                else:
+                    data = {key: values[-1] for key, values in parse_qs(body).items()}
+                method = self.path.rsplit('/', 1)[-1]
+                status, payload = server.handle(method, data)
+
+                response = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def push_update(self, message):
+        # queues {"update_id": ..., "message": message} for getUpdates; returns the update id
+        with self._lock:
+            self._update_id += 1
+            self.updates.append({'update_id': self._update_id, 'message': message})
+            self._new_updates.notify_all()
+            return self._update_id
+
+    def get_updates(self, data):
+        offset = int(data.get('offset') or 0)
+        limit = int(data.get('limit') or 100)
+        deadline = time.monotonic() + float(data.get('timeout') or 0)
+        with self._lock:
+            self.calls['getUpdates'] += 1
+            # an offset confirms every update before it
+            self.updates = [update for update in self.updates if update['update_id'] >= offset]
+            while not self.updates and time.monotonic() < deadline:
+                self._new_updates.wait(deadline - time.monotonic())
+            return 200, {'ok': True, 'result': self.updates[:limit]}
+
+    def handle(self, method, data):
+        if method == 'getUpdates':
+            return self.get_updates(data)
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self._lock:
+            self.calls[method] += 1
+            if self.rate_limit_ratio and random.random() < self.rate_limit_ratio:
+                self.calls['429'] += 1
+                return 429, {
+                    'ok': False,
+                    'error_code': 429,
+                    'description': f'Too Many Requests: retry after {self.retry_after}',
+                    'parameters': {'retry_after': self.retry_after},
+                }
+            self._message_id += 1
+            message_id = self._message_id
+            if method in ('sendMessage', 'editMessageText'):
+                self.messages.append((method, data))
+                self.message_times.append(time.monotonic())
+
+        if method == 'editMessageText':
+            return 200, {'ok': True, 'result': {'message_id': int(data.get('message_id', 0))}}
+        return 200, {'ok': True, 'result': {'message_id': message_id, 'chat': {'id': data.get('chat_id')}}}
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local fake Telegram Bot API.")
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds per call")
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0, help="share of calls answered with 429")
+    parser.add_argument('--retry-after', type=int, default=1)
+    args = parser.parse_args()
+
+    server = FakeTelegramServer(port=args.port, latency=args.latency, rate_limit_ratio=args.rate_limit_ratio,
+                                retry_after=args.retry_after)
+    print(f"Fake Telegram Bot API on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(dict(server.calls))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import atexit
+import os
+from urllib.parse import urlsplit
+
+import django
+from dotenv import load_dotenv
+
+# Benches never run against the database and Redis of a deployment (local.env):
+#   - the database is a throwaway test_<DB_NAME>, created (tables included) with Django's test
+#     machinery and dropped when the bench exits;
+#   - Redis is DB index BENCH_REDIS_DB (default 15) of the same server. It must be empty or
+#     hold only what an earlier bench left (BENCH_MARKER_KEY), so queued deliveries of anyone else
+#     are never popped; it is flushed before the run.
+# Both reach the processes a bench spawns through the environment (DB_NAME, REDIS_URL).
+#
+# WebhookGuardMiddleware is turned off the same way: the benches send no X-Gitlab-Token and all
+# their requests come from 127.0.0.1, so local.env's token, rate limit and project lists would
+# answer them with 401/429/403 instead of exercising the views.
+GUARD_OFF = {
+    'GITLAB_WEBHOOK_SECRET_TOKEN': '',
+    'WEBHOOK_RATE_LIMIT': '0',
+    'WEBHOOK_ALLOWED_PROJECTS': '',
+    'WEBHOOK_DENIED_PROJECTS': '',
+}
+
+BENCH_REDIS_DB = int(os.getenv('BENCH_REDIS_DB', 15))
+BENCH_MARKER_KEY = 'gitlab_bot:bench'
+
+
+def bench_redis_url():
+    # the settings read local.env only at django.setup(); REDIS_URL must be replaced before that
+    load_dotenv('local.env')
+    url = urlsplit(os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/0'))
+    if (url.path.strip('/') or '0') == str(BENCH_REDIS_DB):
+        raise SystemExit(f"REDIS_URL already uses DB {BENCH_REDIS_DB}; set BENCH_REDIS_DB to an unused index.")
+    return url._replace(path=f'/{BENCH_REDIS_DB}').geturl()
+
+
+def claim_redis():
+    from django_redis import get_redis_connection
+
+    conn = get_redis_connection('default')
+    if conn.dbsize() and not conn.exists(BENCH_MARKER_KEY):
+        raise SystemExit(
+            f"Redis DB {BENCH_REDIS_DB} holds keys that are not the bench's (queued deliveries?); "
+            f"set BENCH_REDIS_DB to an unused index."
+        )
+    conn.flushdb()
+    conn.set(BENCH_MARKER_KEY, 1)
+
+
+def create_database():
+    from django.db import connection
+
+    name = connection.settings_dict['NAME']
+    os.environ['DB_NAME'] = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    atexit.register(connection.creation.destroy_test_db, name, verbosity=0)
+
+
+def setup_bench():
+    # instead of django.setup(), in the process that starts the bench
+    os.environ['REDIS_URL'] = bench_redis_url()
+    # after bench_redis_url() loaded local.env, which never overrides what is already set
+    os.environ.update(GUARD_OFF)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'root.settings')
+    django.setup()
+    claim_redis()
+    create_database()
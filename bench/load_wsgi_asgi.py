@@ -0,0 +1,182 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from bench.fake_telegram import FakeTelegramServer
+from bench.isolation import setup_bench
+
+# Compares the GitLab webhook under WSGI (gunicorn, GitlabWebhookAPIView) and ASGI
+# (uvicorn, api.async_views.gitlab_webhook) with Telegram delivery done inline against a local
+# fake Bot API, so every request waits for one Bot API round-trip.
+#
+#   pip install gunicorn uvicorn
+#   python -m bench.load_wsgi_asgi --requests 2000 --concurrency 200 --latency 0.1
+#
+# Runs against a throwaway database and a Redis DB of its own (bench.isolation); the servers
+# inherit both through the environment.
+
+PROJECT_NAME = 'bench-load-project'
+BENCH_CHAT_ID = -1000000000001
+
+SERVERS = {
+    'wsgi': {
+        'binary': 'gunicorn',
+        'command': lambda port, workers, threads: [
+            'gunicorn', 'root.wsgi:application', '--bind', f'127.0.0.1:{port}',
+            '--workers', str(workers), '--threads', str(threads),
+        ],
+        'path': '/api/gitlab/webhook/',
+    },
+    'asgi': {
+        'binary': 'uvicorn',
+        'command': lambda port, workers, threads: [
+            'uvicorn', 'root.asgi:application', '--host', '127.0.0.1', '--port', str(port),
+            '--workers', str(workers), '--log-level', 'warning',
+        ],
+        'path': '/api/async/gitlab/webhook/',
+    },
+}
+
+
+def push_payload(index):
+    return {
+        'object_kind': 'push',
+        'ref': 'refs/heads/main',
+        'user_id': 1,
+        'user_name': 'Bench User',
+        'user_username': 'bench',
+        'project': {'name': PROJECT_NAME},
+        'commits': [{'id': f'{index:040x}', 'message': f'commit {index}'}],
+    }
+
+
+def setup_project():
+    setup_bench()
+    from apps.models import GitlabProject, TelegramGroup
+
+    group, _ = TelegramGroup.objects.update_or_create(
+        chat_id=BENCH_CHAT_ID,
+        defaults={'chat_name': 'bench', 'chat_type': 'supergroup', 'is_active': True},
+    )
+    GitlabProject.objects.update_or_create(name=PROJECT_NAME, defaults={'telegram_group': group})
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+async def drive(url, total, concurrency):
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        async def one(index):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post(url, json=push_payload(index), headers={'X-Gitlab-Event': 'Push Hook'})
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200 or 'error' in response.json():
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(index) for index in range(total)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'rps': total / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p95_ms': latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        'errors': errors,
+    }
+
+
+def run_mode(mode, fake_url, args):
+    server = SERVERS[mode]
+    if not shutil.which(server['binary']):
+        print(f"{mode}: {server['binary']} is not installed, skipping")
+        return None
+
+    port = free_port()
+    env = dict(
+        os.environ,
+        DJANGO_SETTINGS_MODULE='root.settings',
+        TELEGRAM_API_URL=fake_url,
+        TELEGRAM_DELIVERY_MODE='inline',
+        TELEGRAM_POOL_SIZE=str(args.concurrency),
+        TELEGRAM_GLOBAL_RATE='1000000',
+        TELEGRAM_GLOBAL_BURST='1000000',
+        TELEGRAM_CHAT_RATE_PER_MINUTE='60000000',
+        TELEGRAM_CHAT_BURST='1000000',
+    )
+    process = subprocess.Popen(server['command'](port, args.workers, args.threads), env=env)
+    try:
+        wait_for_port(port)
+        url = f"http://127.0.0.1:{port}{server['path']}"
+        asyncio.run(drive(url, min(50, args.requests), args.concurrency))  # warm-up
+        return asyncio.run(drive(url, args.requests, args.concurrency))
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Requests per second of the GitLab webhook under WSGI and ASGI.")
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=1, help="server worker processes")
+    parser.add_argument('--threads', type=int, default=8, help="threads per gunicorn worker")
+    parser.add_argument('--latency', type=float, default=0.1, help="fake Bot API latency in seconds")
+    parser.add_argument('--mode', choices=['wsgi', 'asgi', 'both'], default='both')
+    parser.add_argument('--json', action='store_true', help="print results as json")
+    args = parser.parse_args()
+
+    setup_project()
+    fake = FakeTelegramServer(latency=args.latency).start()
+
+    results = {}
+    try:
+        for mode in (['wsgi', 'asgi'] if args.mode == 'both' else [args.mode]):
+            results[mode] = run_mode(mode, fake.url, args)
+    finally:
+        fake.stop()
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        return
+
+    for mode, result in results.items():
+        if result:
+            print(f"{mode}: {result['rps']:.1f} req/s, p50 {result['p50_ms']:.1f}ms, "
+                  f"p95 {result['p95_ms']:.1f}ms, p99 {result['p99_ms']:.1f}ms, errors {result['errors']}")
+    print(f"fake Bot API calls: {dict(fake.calls)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import argparse
+import json
+import os
+import timeit
+import tracemalloc
+
+import django
+
+# Latency and peak memory of turning a hook body into the event dict: DRF's request.data (what
+# GitlabWebhookAPIView used to read) against api.payloads.load_hook, on large synthetic payloads.
+#
+#   python -m bench.payload_bench --number 50
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'root.settings')
+django.setup()
+
+from rest_framework.parsers import JSONParser  # noqa: E402
+from rest_framework.request import Request  # noqa: E402
+from rest_framework.test import APIRequestFactory  # noqa: E402
+
+from api.payloads import load_hook  # noqa: E402
+from api.services import GITLAB_EVENTS, parse_gitlab_event  # noqa: E402
+from bench.payloads import push_hook, merge_request_hook, pipeline_hook  # noqa: E402
+
+CASES = [
+    ('push, 20 commits x 50 files', 'Push Hook', lambda: push_hook(commits=20, files=50)),
+    ('push, 300 commits x 200 files', 'Push Hook', lambda: push_hook(commits=300, files=200)),
+    ('merge request', 'Merge Request Hook', lambda: merge_request_hook()),
+    ('pipeline, 300 builds', 'Pipeline Hook', lambda: pipeline_hook(builds=300)),
+    ('pipeline, 2000 builds', 'Pipeline Hook', lambda: pipeline_hook(builds=2000)),
+]
+
+factory = APIRequestFactory()
+
+
+def with_request_data(event_type, body):
+    request = Request(factory.post('/api/gitlab/webhook/', body, content_type='application/json'),
+                      parsers=[JSONParser()])
+    return parse_gitlab_event(event_type, request.data)
+
+
+def with_load_hook(event_type, body):
+    return parse_gitlab_event(event_type, load_hook(GITLAB_EVENTS[event_type], body))
+
+
+def peak_memory(func, *args):
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hook body parsing: request.data vs selective extraction.")
+    parser.add_argument('--number', type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'payload':<32}{'size':>10}{'request.data':>16}{'load_hook':>14}{'peak before':>14}{'peak after':>13}")
+    for name, event_type, make_payload in CASES:
+        body = json.dumps(make_payload()).encode()
+        assert with_request_data(event_type, body) == with_load_hook(event_type, body)
+
+        before = timeit.timeit(lambda: with_request_data(event_type, body), number=args.number) / args.number
+        after = timeit.timeit(lambda: with_load_hook(event_type, body), number=args.number) / args.number
+        print(
+            f"{name:<32}{len(body) / 1024:>8.0f}KB{before * 1000:>14.2f}ms{after * 1000:>12.2f}ms"
+            f"{peak_memory(with_request_data, event_type, body) / 1024:>12.0f}KB"
+            f"{peak_memory(with_load_hook, event_type, body) / 1024:>11.0f}KB"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+# Synthetic GitLab hook payloads shaped like the real ones (same keys, same nesting, same order as
+# GitLab sends them), sized by the number of commits, changed files and builds.
+
+PROJECT = {
+    'id': 15,
+    'name': 'backend',
+    'description': 'Main API service',
+    'web_url': 'https://gitlab.example.com/acme/backend',
+    'avatar_url': None,
+    'git_ssh_url': 'git@gitlab.example.com:acme/backend.git',
+    'git_http_url': 'https://gitlab.example.com/acme/backend.git',
+    'namespace': 'acme',
+    'visibility_level': 0,
+    'path_with_namespace': 'acme/backend',
+    'default_branch': 'main',
+    'ci_config_path': '',
+    'homepage': 'https://gitlab.example.com/acme/backend',
+    'url': 'git@gitlab.example.com:acme/backend.git',
+    'ssh_url': 'git@gitlab.example.com:acme/backend.git',
+    'http_url': 'https://gitlab.example.com/acme/backend.git',
+}
+
+USER = {
+    'id': 4,
+    'name': 'Jane Doe',
+    'username': 'jane',
+    'avatar_url': 'https://gitlab.example.com/uploads/-/system/user/avatar/4/avatar.png',
+    'email': 'jane@example.com',
+}
+
+START = datetime(2024, 5, 1, 9, 0, tzinfo=timezone.utc)
+
+
+def sha(*parts):
+    return hashlib.sha1(':'.join(map(str, parts)).encode()).hexdigest()
+
+
+def timestamp(seconds):
+    return (START + timedelta(seconds=seconds)).isoformat()
+
+
+def commit(index, files):
+    return {
+        'id': sha('commit', index),
+        'message': f"Refactor module {index}\n\nSplit the handlers and update the callers.\n",
+        'title': f"Refactor module {index}",
+        'timestamp': timestamp(index * 60),
+        'url': f"{PROJECT['web_url']}/-/commit/{sha('commit', index)}",
+        'author': {'name': USER['name'], 'email': USER['email']},
+        'added': [f"src/module_{index}/new_{n}.py" for n in range(files // 4)],
+        'modified': [f"src/module_{index}/file_{n}.py" for n in range(files // 2)],
+        'removed': [f"src/module_{index}/old_{n}.py" for n in range(files - files // 4 - files // 2)],
+    }
+
+
+def push_hook(commits=20, files=50):
+    return {
+        'object_kind': 'push',
+        'event_name': 'push',
+        'before': sha('before'),
+        'after': sha('commit', commits - 1),
+        'ref': 'refs/heads/main',
+        'ref_protected': True,
+        'checkout_sha': sha('commit', commits - 1),
+        'message': None,
+        'user_id': USER['id'],
+        'user_name': USER['name'],
+        'user_username': USER['username'],
+        'user_email': USER['email'],
+        'user_avatar': USER['avatar_url'],
+        'project_id': PROJECT['id'],
+        'project': PROJECT,
+        'commits': [commit(index, files) for index in range(commits)],
+        'total_commits_count': commits,
+        'push_options': {},
+        'repository': {
+            'name': PROJECT['name'],
+            'url': PROJECT['url'],
+            'description': PROJECT['description'],
+            'homepage': PROJECT['homepage'],
+            'git_http_url': PROJECT['git_http_url'],
+            'git_ssh_url': PROJECT['git_ssh_url'],
+            'visibility_level': 0,
+        },
+    }
+
+
+def merge_request_hook(reviewers=3, description_lines=40):
+    return {
+        'object_kind': 'merge_request',
+        'event_type': 'merge_request',
+        'user': USER,
+        'project': PROJECT,
+        'object_attributes': {
+            'id': 9001,
+            'iid': 42,
+            'title': 'Add delivery workers',
+            'description': '\n'.join(f"- change {n}: move the Telegram calls out of the request" for n in
+                                     range(description_lines)),
+            'state': 'opened',
+            'action': 'open',
+            'draft': False,
+            'source_branch': 'feature/delivery-workers',
+            'target_branch': 'main',
+            'url': f"{PROJECT['web_url']}/-/merge_requests/42",
+            'created_at': timestamp(0),
+            'updated_at': timestamp(3600),
+            'merge_status': 'can_be_merged',
+            'last_commit': commit(0, 10),
+            'labels': [{'id': n, 'title': f"label-{n}", 'color': '#428BCA'} for n in range(5)],
+        },
+        'labels': [{'id': n, 'title': f"label-{n}", 'color': '#428BCA'} for n in range(5)],
+        'changes': {'updated_at': {'previous': timestamp(0), 'current': timestamp(3600)}},
+        'repository': {'name': PROJECT['name'], 'url': PROJECT['url'], 'homepage': PROJECT['homepage']},
+        'assignees': [dict(USER, id=10 + n, username=f"assignee{n}") for n in range(2)],
+        'reviewers': [dict(USER, id=20 + n, username=f"reviewer{n}") for n in range(reviewers)],
+    }
+
+
+def build(index, stages):
+    return {
+        'id': 50000 + index,
+        'stage': stages[index % len(stages)],
+        'name': f"job-{index}",
+        'status': 'success',
+        'created_at': timestamp(index),
+        'started_at': timestamp(index + 5),
+        'finished_at': timestamp(index + 95),
+        'duration': 90.5,
+        'queued_duration': 4.2,
+        'failure_reason': None,
+        'when': 'on_success',
+        'manual': False,
+        'allow_failure': False,
+        'user': USER,
+        'runner': {
+            'id': 380987, 'description': 'shared-runners-manager-6.gitlab.com', 'runner_type': 'instance_type',
+            'active': True, 'is_shared': True, 'tags': ['linux', 'docker', 'shared'],
+        },
+        'artifacts_file': {'filename': None, 'size': None},
+        'environment': None,
+    }
+
+
+def pipeline_hook(builds=300, status='running'):
+    stages = ['build', 'test', 'lint', 'deploy']
+    return {
+        'object_kind': 'pipeline',
+        'object_attributes': {
+            'id': 31,
+            'iid': 3,
+            'name': 'Pipeline for branch: main',
+            'ref': 'main',
+            'tag': False,
+            'sha': sha('commit', 0),
+            'before_sha': sha('before'),
+            'source': 'push',
+            'status': status,
+            'detailed_status': status,
+            'stages': stages,
+            'created_at': timestamp(0),
+            'finished_at': None,
+            'duration': 93,
+            'queued_duration': 4,
+            'variables': [{'key': 'NESTOR_PROD_ENVIRONMENT', 'value': 'us-west-1'}],
+            'url': f"{PROJECT['web_url']}/-/pipelines/31",
+        },
+        'merge_request': None,
+        'user': USER,
+        'project': PROJECT,
+        'commit': {key: value for key, value in commit(0, 0).items() if key not in ('added', 'modified', 'removed')},
+        'source_pipeline': None,
+        'builds': [build(index, stages) for index in range(builds)],
+    }
+
+
+HOOKS = {
+    'Push Hook': push_hook,
+    'Merge Request Hook': merge_request_hook,
+    'Pipeline Hook': pipeline_hook,
+}
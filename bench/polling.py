@@ -0,0 +1,210 @@
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.fake_telegram import FakeTelegramServer
+from bench.isolation import setup_bench
+from bench.storm import percentile
+
+# Webhook vs getUpdates polling: the same stream of Telegram updates (group chatter with admin
+# commands mixed in) is fed at --rate updates per second, once POSTed to TelegramWebhookAPIView
+# and once queued in the fake Bot API for api.polling.Poller. Reports how long each command took
+# to be answered (from the moment its update was fed) and updates handled per second.
+#
+#   python -m bench.polling --updates 2000 --chats 50 --rate 500
+#   python -m bench.polling --rate 0      # everything at once: throughput only
+#
+# Runs against a throwaway database and a Redis DB of its own (bench.isolation).
+
+BASE_CHAT_ID = -1000000002000
+ADMIN_ID = 900000001
+USER_ID = 900000002
+WEBHOOK_PATH = '/api/telegram/webhook/'
+
+
+def configure(fake_url):
+    os.environ.update(
+        TELEGRAM_API_URL=fake_url,
+        TELEGRAM_GLOBAL_RATE='1000000',
+        TELEGRAM_GLOBAL_BURST='1000000',
+        TELEGRAM_CHAT_RATE_PER_MINUTE='60000000',
+        TELEGRAM_CHAT_BURST='1000000',
+    )
+    setup_bench()
+
+
+def setup_chats(chats):
+    from apps.models import TelegramAdmin, TelegramGroup
+
+    TelegramAdmin.objects.update_or_create(telegram_id=ADMIN_ID, defaults={'full_name': 'bench admin'})
+    for index in range(chats):
+        TelegramGroup.objects.update_or_create(
+            chat_id=BASE_CHAT_ID - index,
+            defaults={'chat_name': f"bench-polling-{index}", 'chat_type': 'supergroup', 'is_active': True},
+        )
+
+
+def build_messages(args):
+    rng = random.Random(args.seed)
+    messages = []
+    for index in range(args.updates):
+        chat_id = BASE_CHAT_ID - rng.randrange(args.chats)
+        if rng.random() < args.commands:
+            text, user = '/start', ADMIN_ID
+        else:
+            text, user = f"message {index}", USER_ID
+        messages.append({
+            'message_id': index + 1,
+            'date': int(time.time()),
+            'text': text,
+            'from': {'id': user, 'is_bot': False, 'first_name': 'bench'},
+            'chat': {'id': chat_id, 'type': 'supergroup', 'title': 'bench'},
+        })
+    return messages
+
+
+def schedule(args, count):
+    # seconds after the start at which each update is fed
+    if not args.rate:
+        return [0.0] * count
+    return [index / args.rate for index in range(count)]
+
+
+def answer_latencies(fake, messages, fed_at):
+    # a chat's answers come back in the order of its commands
+    fed = defaultdict(list)
+    for message, at in zip(messages, fed_at):
+        if message['text'] == '/start':
+            fed[message['chat']['id']].append(at)
+    answered = defaultdict(list)
+    for (method, data), at in zip(fake.messages, fake.message_times):
+        answered[int(data['chat_id'])].append(at)
+    return [answer - feed for chat_id in fed for feed, answer in zip(sorted(fed[chat_id]), answered[chat_id])]
+
+
+def wait_for_answers(fake, expected, timeout):
+    deadline = time.monotonic() + timeout
+    while len(fake.messages) < expected and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+
+def run_webhook(args, fake, messages):
+    from django.test import Client
+
+    local = threading.local()
+    offsets = schedule(args, len(messages))
+    fed_at = [0.0] * len(messages)
+    started = time.monotonic()
+
+    def post(index):
+        delay = started + offsets[index] - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        if not hasattr(local, 'client'):
+            local.client = Client()
+        # from the scheduled time, so updates waiting for a free thread count like queued ones
+        fed_at[index] = started + offsets[index]
+        body = json.dumps({'update_id': index + 1, 'message': messages[index]})
+        local.client.post(WEBHOOK_PATH, body, content_type='application/json')
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(post, range(len(messages))))
+    return started, fed_at
+
+
+def run_polling(args, fake, messages):
+    from api.polling import Poller, OFFSET_KEY
+    from django_redis import get_redis_connection
+
+    get_redis_connection('default').delete(OFFSET_KEY)
+    poller = Poller(concurrency=args.concurrency, timeout=args.poll_timeout)
+    thread = threading.Thread(target=poller.run, daemon=True)
+    thread.start()
+
+    offsets = schedule(args, len(messages))
+    fed_at = []
+    started = time.monotonic()
+    for message, offset in zip(messages, offsets):
+        delay = started + offset - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        fed_at.append(started + offset)
+        fake.push_update(message)
+
+    wait_for_answers(fake, sum(message['text'] == '/start' for message in messages), args.max_seconds)
+    poller.stop()
+    thread.join()
+    return started, fed_at
+
+
+def run(args, fake, mode, messages):
+    fake.messages.clear()
+    fake.message_times.clear()
+    fake.calls.clear()
+
+    runner = run_webhook if mode == 'webhook' else run_polling
+    started, fed_at = runner(args, fake, messages)
+    commands = sum(message['text'] == '/start' for message in messages)
+    wait_for_answers(fake, commands, args.max_seconds)
+    finished = max(fake.message_times, default=time.monotonic())
+
+    latencies = sorted(answer_latencies(fake, messages, fed_at)) or [0.0]
+    return {
+        'mode': mode,
+        'updates': len(messages),
+        'commands': commands,
+        'answered': len(fake.messages),
+        'seconds': finished - started,
+        'updates_per_second': len(messages) / (finished - started),
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'bot_calls': dict(fake.calls),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare webhook and getUpdates polling for bot commands.")
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--commands', type=float, default=0.2, help="share of updates that are commands")
+    parser.add_argument('--rate', type=float, default=500, help="updates fed per second, 0 = all at once")
+    parser.add_argument('--concurrency', type=int, default=8, help="webhook requests / polled chats at once")
+    parser.add_argument('--latency', type=float, default=0.02, help="fake Bot API latency in seconds")
+    parser.add_argument('--poll-timeout', type=int, default=1)
+    parser.add_argument('--max-seconds', type=float, default=60, help="give up waiting for answers after this")
+    parser.add_argument('--mode', choices=('webhook', 'polling', 'both'), default='both')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help="print results as json")
+    args = parser.parse_args()
+
+    fake = FakeTelegramServer(latency=args.latency).start()
+    configure(fake.url)
+    setup_chats(args.chats)
+    messages = build_messages(args)
+
+    modes = ('webhook', 'polling') if args.mode == 'both' else (args.mode,)
+    try:
+        results = [run(args, fake, mode, messages) for mode in modes]
+    finally:
+        fake.stop()
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+    for result in results:
+        print(f"{result['mode']:8} {result['updates']} updates ({result['commands']} commands, "
+              f"{result['answered']} answered) in {result['seconds']:.2f}s, "
+              f"{result['updates_per_second']:.0f} updates/s, answer latency p50 {result['p50_ms']:.1f}ms "
+              f"p95 {result['p95_ms']:.1f}ms p99 {result['p99_ms']:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+import argparse
+import os
+import timeit
+from itertools import count
+
+import django
+
+# Render time per event type: the string concatenation GitlabWebhookAPIView used to do (kept below as
+# legacy_build_message) against api.rendering's prebuilt templates. Every call gets a different
+# mention, as real hooks do.
+#
+#   python -m bench.render_bench --number 20000
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'root.settings')
+django.setup()
+
+from api.rendering import build_message  # noqa: E402
+from api.routing import ProjectRoute  # noqa: E402
+from api.services import parse_gitlab_event  # noqa: E402
+
+LEGACY_STATUS_EMOJI_MAP = {
+    'pushed': '✅', 'opened': '✨', 'pending': '⏳', 'running': '🏃', 'success': '🟢', 'failed': '🔴',
+    'canceled': '⚪', 'skipped': '⏭️', 'finished': '🏁', 'manual': '✋', 'approved': '👍', 'unapproved': '👎',
+    'approval': '✅', 'unapproval': '❌', 'merge': '🤝', 'pipeline started': '⏱️', 'open': '🔓', 'close': '🔒',
+    'reopen': '🔄', 'update': '📝', 'closed': '🔒',
+}
+
+
+def legacy_build_message(event, project, mention, assignee_mentions=(), reviewer_mentions=()):
+    status_text = event['status']
+    branch = event['branch']
+    message = f"🚀 *Event Update:* `{event['event_type']}`\n"
+    status_emoji_map = dict(LEGACY_STATUS_EMOJI_MAP)  # the view rebuilt the literal on every request
+    status_with_emoji = f"{status_text} {status_emoji_map.get(status_text, '')}"
+
+    if event['gitlab_event'] in ['push', 'pipeline']:
+        if project.show_project:
+            message += f"📣 *Project:* `{project.name}`\n"
+        if project.show_status:
+            message += f"📌 *Status:* `{status_with_emoji}`\n"
+        if project.show_branch:
+            message += f"🌿 *Branch:* `{branch}`\n"
+        if project.show_user:
+            message += f"👤 *User:* {mention}\n"
+        if project.show_duration:
+            message += f"⏳ *Duration:* `{event['duration']}s`\n"
+
+    if event['gitlab_event'] == 'merge':
+        if project.show_project:
+            message += f"📣 *Project:* `{project.name}`\n"
+            message += f"📑 *Is Draft:* `{event['draft']}`\n"
+        if project.show_status:
+            message += f"📌 *Status:* `{status_with_emoji}`\n"
+        if project.show_branch:
+            message += f"🌿 *Source:* `{branch}`\n"
+            message += f"🎯 *Target:* `{event['target_branch']}`\n"
+        if project.show_user:
+            message += f"👤 *User:* {mention}\n"
+            if assignee_mentions:
+                message += "👥 *Assignees*\n"
+                for assignee in assignee_mentions:
+                    message += f"  • {assignee}\n"
+            if reviewer_mentions:
+                message += "👁 *Reviewers:*\n"
+                for reviewer in reviewer_mentions:
+                    message += f"  • {reviewer}\n"
+        message += f"🔗 *Link:* [tap to view]({event['merge_url']})\n"
+
+        if project.show_duration:
+            message += f"⏳ *Duration:* `{event['duration']}s`\n"
+
+    return message
+
+
+PROJECT = ProjectRoute(
+    id=1, name='backend', chat_id=-100, thread_id=1, is_active=True,
+    show_user=True, show_project=True, show_branch=True, show_status=True, show_duration=True,
+)
+MENTION = "[`Jane Doe`](tg://user?id=123456)"
+ASSIGNEES = ["[John](tg://user?id=1)", "Alice"]
+REVIEWERS = [f"[Reviewer {i}](tg://user?id={i})" for i in range(8)]
+
+EVENTS = {
+    'push': parse_gitlab_event('Push Hook', {
+        'ref': 'refs/heads/main', 'user_username': 'jane', 'user_id': 1, 'user_name': 'Jane Doe',
+        'project': {'name': 'backend'},
+    }),
+    'merge': parse_gitlab_event('Merge Request Hook', {
+        'project': {'name': 'backend'}, 'user': {'id': 1, 'name': 'Jane Doe', 'username': 'jane'},
+        'object_attributes': {
+            'id': 42, 'source_branch': 'feature/x', 'target_branch': 'main', 'state': 'opened',
+            'action': 'open', 'url': 'https://gitlab.example.com/backend/-/merge_requests/42', 'draft': False,
+        },
+    }),
+    'pipeline': parse_gitlab_event('Pipeline Hook', {
+        'project': {'name': 'backend'}, 'user': {'id': 1, 'name': 'Jane Doe', 'username': 'jane'},
+        'object_attributes': {'id': 1001, 'ref': 'main', 'status': 'running', 'duration': 93},
+    }),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Message render time per event type, before and after.")
+    parser.add_argument('--number', type=int, default=20000)
+    args = parser.parse_args()
+
+    counter = count()
+
+    print(f"{'event':<10}{'legacy':>12}{'templates':>12}   (µs per render)")
+    for name, event in EVENTS.items():
+        legacy = timeit.timeit(
+            lambda: legacy_build_message(event, PROJECT, f"{MENTION}{next(counter)}", ASSIGNEES, REVIEWERS),
+            number=args.number,
+        )
+        templates = timeit.timeit(
+            lambda: build_message(event, PROJECT, f"{MENTION}{next(counter)}", ASSIGNEES, REVIEWERS),
+            number=args.number,
+        )
+        scale = 1e6 / args.number
+        print(f"{name:<10}{legacy * scale:>12.2f}{templates * scale:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+import uuid
+from pathlib import Path
+
+from bench.fake_telegram import FakeTelegramServer
+from bench.isolation import setup_bench
+
+# Replays a storm of GitLab hooks (built from the recorded fixtures in bench/fixtures) against
+# GitlabWebhookAPIView in-process, with the Bot API answered by bench.fake_telegram, and reports
+# p50/p95/p99 latency, database queries per request, Bot API calls per event and peak memory.
+#
+#   python -m bench.storm --events 1000 --latency 0.02 --rate-limit-ratio 0.05
+#   python -m bench.storm --save-baseline      # store the current numbers in bench/baseline.json
+#   python -m bench.storm --check              # exit 1 when a number regressed past the baseline
+#
+# Runs against a throwaway database and a Redis DB of its own (bench.isolation), never local.env's.
+
+FIXTURES_DIR = Path(__file__).resolve().parent / 'fixtures'
+BASELINE_PATH = Path(__file__).resolve().parent / 'baseline.json'
+
+PROJECT_NAME = 'bench-storm-project'
+BENCH_CHAT_ID = -1000000000002
+WEBHOOK_PATH = '/api/gitlab/webhook/'
+
+# metrics compared by --check: latency and memory within --tolerance, counts must not grow
+TIMED_METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'peak_memory_kb')
+COUNTED_METRICS = ('queries_per_request', 'bot_calls_per_event')
+
+
+def load_fixture(name):
+    with open(FIXTURES_DIR / f'{name}.json') as f:
+        payload = json.load(f)
+    payload['project']['name'] = PROJECT_NAME
+    return payload
+
+
+def build_storm(size, branches, duplicate_ratio, seed):
+    # a realistic mix: every push is followed by its pipeline going pending -> running -> success,
+    # and every fourth round updates a merge request
+    fixtures = {name: load_fixture(name) for name in ('push', 'merge_request', 'pipeline')}
+    rng = random.Random(seed)
+    run_id = int(time.time() * 1000)
+    deliveries = []
+
+    round_index = 0
+    while len(deliveries) < size:
+        branch = f"storm-{round_index % branches}"
+
+        push = copy.deepcopy(fixtures['push'])
+        push['ref'] = f"refs/heads/{branch}"
+        for commit in push['commits']:
+            commit['id'] = uuid.uuid4().hex + uuid.uuid4().hex[:8]
+        deliveries.append(('Push Hook', push))
+
+        for status in ('pending', 'running', 'success'):
+            pipeline = copy.deepcopy(fixtures['pipeline'])
+            pipeline['object_attributes'].update(id=run_id + round_index, ref=branch, status=status)
+            deliveries.append(('Pipeline Hook', pipeline))
+
+        if round_index % 4 == 0:
+            merge = copy.deepcopy(fixtures['merge_request'])
+            merge['object_attributes'].update(
+                id=run_id + round_index, source_branch=branch, action='update' if round_index else 'open',
+            )
+            deliveries.append(('Merge Request Hook', merge))
+
+        round_index += 1
+
+    storm = []
+    for event_type, payload in deliveries[:size]:
+        delivery = (event_type, json.dumps(payload).encode(), str(uuid.uuid4()))
+        storm.append(delivery)
+        # GitLab retrying a hook it thinks timed out
+        if rng.random() < duplicate_ratio:
+            storm.append(delivery)
+    return storm
+
+
+def setup_project(digest_window):
+    from api.routing import invalidate_routes
+    from apps.models import GitlabProject, TelegramGroup
+
+    group, _ = TelegramGroup.objects.update_or_create(
+        chat_id=BENCH_CHAT_ID,
+        defaults={'chat_name': 'bench', 'chat_type': 'supergroup', 'is_active': True},
+    )
+    GitlabProject.objects.update_or_create(
+        name=PROJECT_NAME, defaults={'telegram_group': group, 'push_digest_window': digest_window},
+    )
+    invalidate_routes(PROJECT_NAME)
+
+
+def drain_queue():
+    # delivers everything the storm queued, delayed jobs included, without waiting for their time
+    from django.conf import settings
+    from django_redis import get_redis_connection
+    from api.queue import DELAYED_KEY, deliver, queue_key
+
+    conn = get_redis_connection('default')
+    while True:
+        delivered = 0
+        for raw in conn.zrange(DELAYED_KEY, 0, -1):
+            if conn.zrem(DELAYED_KEY, raw):
+                deliver(json.loads(raw))
+                delivered += 1
+        for shard in range(settings.TELEGRAM_DELIVERY_WORKERS):
+            while (raw := conn.rpop(queue_key(shard))) is not None:
+                deliver(json.loads(raw))
+                delivered += 1
+        if not delivered:
+            return
+
+
+def replay(client, storm):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    latencies = []
+    queries = []
+    errors = 0
+    for event_type, body, delivery_id in storm:
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = client.post(WEBHOOK_PATH, body, content_type='application/json',
+                                   headers={'X-Gitlab-Event': event_type, 'X-Gitlab-Event-UUID': delivery_id})
+            latencies.append(time.perf_counter() - started)
+        queries.append(len(captured.captured_queries))
+        if response.status_code != 200:
+            errors += 1
+    return latencies, queries, errors
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(share * (len(ordered) - 1))))]
+
+
+def run(args, fake):
+    from django.test import Client
+    from api.sink import event_buffer
+
+    client = Client()
+    setup_project(args.digest_window)
+
+    # warm-up: imports, connections, compiled scripts
+    replay(client, build_storm(min(20, args.events), args.branches, 0, args.seed))
+    drain_queue()
+    fake.calls.clear()
+
+    storm = build_storm(args.events, args.branches, args.duplicate_ratio, args.seed)
+    latencies, queries, errors = replay(client, storm)
+    drain_queue()
+    event_buffer.flush()
+    bot_calls = sum(count for method, count in fake.calls.items() if method != '429')
+
+    peak = 0
+    if not args.no_memory:
+        tracemalloc.start()
+        replay(client, build_storm(args.events, args.branches, args.duplicate_ratio, args.seed + 1))
+        drain_queue()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {
+        'requests': len(storm),
+        'errors': errors,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'queries_per_request': sum(queries) / len(queries),
+        'max_queries': max(queries),
+        'bot_calls_per_event': bot_calls / len(storm),
+        'bot_calls': dict(fake.calls),
+        'peak_memory_kb': peak / 1024,
+    }
+
+
+def check(result, baseline, tolerance):
+    failures = []
+    for name in TIMED_METRICS:
+        if baseline.get(name) and result[name] > baseline[name] * (1 + tolerance):
+            failures.append(f"{name}: {result[name]:.2f} > {baseline[name]:.2f} (+{tolerance:.0%})")
+    for name in COUNTED_METRICS:
+        if name in baseline and result[name] > baseline[name] + 0.01:
+            failures.append(f"{name}: {result[name]:.2f} > {baseline[name]:.2f}")
+    if result['errors']:
+        failures.append(f"errors: {result['errors']}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a storm of GitLab hooks and measure the webhook hot path.")
+    parser.add_argument('--events', type=int, default=500)
+    parser.add_argument('--branches', type=int, default=5)
+    parser.add_argument('--duplicate-ratio', type=float, default=0.05, help="share of deliveries GitLab retries")
+    parser.add_argument('--latency', type=float, default=0.02, help="fake Bot API latency in seconds")
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0, help="share of Bot API calls answered with 429")
+    parser.add_argument('--delivery', choices=['inline', 'queue'], default='queue',
+                        help="queue: the view only enqueues, deliveries are drained after the storm")
+    parser.add_argument('--digest-window', type=int, default=0, help="push_digest_window of the bench project")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc pass")
+    parser.add_argument('--baseline', default=str(BASELINE_PATH))
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--check', action='store_true', help="fail when a metric regressed past the baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed latency/memory growth for --check")
+    parser.add_argument('--json', action='store_true', help="print results as json")
+    args = parser.parse_args()
+
+    # before the run: a missing baseline would only show up after minutes of storm
+    if args.check and not args.save_baseline and not os.path.exists(args.baseline):
+        parser.error(f"no baseline at {args.baseline}; create one with --save-baseline on the reference "
+                     f"machine first")
+
+    fake = FakeTelegramServer(latency=args.latency, rate_limit_ratio=args.rate_limit_ratio).start()
+    os.environ.update(
+        TELEGRAM_API_URL=fake.url,
+        TELEGRAM_DELIVERY_MODE=args.delivery,
+        TELEGRAM_GLOBAL_RATE='1000000',
+        TELEGRAM_GLOBAL_BURST='1000000',
+        TELEGRAM_CHAT_RATE_PER_MINUTE='60000000',
+        TELEGRAM_CHAT_BURST='1000000',
+    )
+    setup_bench()
+
+    try:
+        result = run(args, fake)
+    finally:
+        fake.stop()
+
+    if args.json:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    else:
+        print(f"{result['requests']} requests, {result['errors']} errors")
+        print(f"latency:  p50 {result['p50_ms']:.2f}ms, p95 {result['p95_ms']:.2f}ms, p99 {result['p99_ms']:.2f}ms")
+        print(f"queries:  {result['queries_per_request']:.2f} per request (max {result['max_queries']})")
+        print(f"Bot API:  {result['bot_calls_per_event']:.2f} calls per event {result['bot_calls']}")
+        if not args.no_memory:
+            print(f"memory:   peak {result['peak_memory_kb']:.0f}KB")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({name: round(result[name], 3) for name in TIMED_METRICS + COUNTED_METRICS}, f, indent=2)
+            f.write('\n')
+        print(f"baseline saved to {args.baseline}")
+
+    if args.check:
+        with open(args.baseline) as f:
+            failures = check(result, json.load(f), args.tolerance)
+        if failures:
+            print("REGRESSION:\n  " + "\n  ".join(failures))
+            sys.exit(1)
+        print("no regression against the baseline")
+
+
+if __name__ == '__main__':
+    main()
@@ -15,6 +15,86 @@ TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 BOT_USERNAME = os.getenv('BOT_USERNAME')
 PROJECT_URL = os.getenv('PROJECT_URL')
 
+# telegram delivery: 'queue' hands messages to run_delivery_workers, 'inline' sends them from the view
+TELEGRAM_DELIVERY_MODE = os.getenv('TELEGRAM_DELIVERY_MODE', 'queue')
+TELEGRAM_DELIVERY_WORKERS = int(os.getenv('TELEGRAM_DELIVERY_WORKERS', 4))
+TELEGRAM_DELIVERY_MAX_RETRIES = int(os.getenv('TELEGRAM_DELIVERY_MAX_RETRIES', 5))
+# one delivery per message at a time across processes and nodes (api/locks.py); a single node with
+# queued delivery is already serialized by its shards and may turn this off
+DELIVERY_LOCKS = os.getenv('DELIVERY_LOCKS', 'true').lower() in ('1', 'true', 'yes')
+DELIVERY_LOCK_TIMEOUT = float(os.getenv('DELIVERY_LOCK_TIMEOUT', 60))  # seconds
+# inline delivery of a hook routed to several chats: at most this many Bot API calls at once
+TELEGRAM_FANOUT_WORKERS = int(os.getenv('TELEGRAM_FANOUT_WORKERS', 8))
+
+# telegram bot api client
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
+TELEGRAM_CONNECT_TIMEOUT = float(os.getenv('TELEGRAM_CONNECT_TIMEOUT', 5))
+TELEGRAM_READ_TIMEOUT = float(os.getenv('TELEGRAM_READ_TIMEOUT', 15))
+TELEGRAM_POOL_SIZE = int(os.getenv('TELEGRAM_POOL_SIZE', 10))
+TELEGRAM_MAX_RETRIES = int(os.getenv('TELEGRAM_MAX_RETRIES', 3))  # retries after a 429
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', 30))  # messages per second for the whole bot
+TELEGRAM_GLOBAL_BURST = int(os.getenv('TELEGRAM_GLOBAL_BURST', 30))
+TELEGRAM_CHAT_RATE_PER_MINUTE = float(os.getenv('TELEGRAM_CHAT_RATE_PER_MINUTE', 20))
+TELEGRAM_CHAT_BURST = int(os.getenv('TELEGRAM_CHAT_BURST', 3))
+
+# poll_updates: getUpdates long polling instead of the webhook (api/polling.py)
+TELEGRAM_POLL_TIMEOUT = int(os.getenv('TELEGRAM_POLL_TIMEOUT', 25))  # seconds the server holds each call
+TELEGRAM_POLL_LIMIT = int(os.getenv('TELEGRAM_POLL_LIMIT', 100))  # updates per call, 1-100
+TELEGRAM_POLL_CONCURRENCY = int(os.getenv('TELEGRAM_POLL_CONCURRENCY', 8))  # chats handled at once
+
+# project routing cache (project name -> chat, thread and show_* flags)
+ROUTING_CACHE_TTL = int(os.getenv('ROUTING_CACHE_TTL', 60 * 60))  # redis, invalidated by signals
+ROUTING_LOCAL_TTL = float(os.getenv('ROUTING_LOCAL_TTL', 10))  # per-process LRU
+ROUTING_LOCAL_SIZE = int(os.getenv('ROUTING_LOCAL_SIZE', 1024))
+
+# gitlab_id -> telegram_id cache used for mentions, invalidated by signals
+MENTION_CACHE_TTL = int(os.getenv('MENTION_CACHE_TTL', 60 * 60 * 6))
+
+# telegram message ids of merge requests and pipelines (api/messages.py); refreshed while they get updates
+MESSAGE_ID_TTL = int(os.getenv('MESSAGE_ID_TTL', 60 * 60 * 24))
+
+# pipeline state machine: hooks arriving within the debounce window share one send/edit
+PIPELINE_DEBOUNCE_MS = int(os.getenv('PIPELINE_DEBOUNCE_MS', 400))
+PIPELINE_STATE_TTL = int(os.getenv('PIPELINE_STATE_TTL', 60 * 60 * 24))
+PIPELINE_FLUSH_FLAG_TTL = int(os.getenv('PIPELINE_FLUSH_FLAG_TTL', 60))  # seconds, in case a worker dies
+
+# merge request cards: one message per merge request, edited as approvals and pipelines come in
+MR_CARD_TTL = int(os.getenv('MR_CARD_TTL', 60 * 60 * 24 * 30))
+MR_CARD_DEBOUNCE_MS = int(os.getenv('MR_CARD_DEBOUNCE_MS', 400))
+
+# push digests (GitlabProject.push_digest_window > 0): one edit per interval, last N commits listed
+PUSH_DIGEST_EDIT_INTERVAL = int(os.getenv('PUSH_DIGEST_EDIT_INTERVAL', 5))
+PUSH_DIGEST_MAX_COMMITS = int(os.getenv('PUSH_DIGEST_MAX_COMMITS', 15))
+
+# GitLabEvent writes: 'sync' inserts in the request, 'memory'/'redis' buffer and bulk_create (api/sink.py)
+EVENT_SINK_MODE = os.getenv('EVENT_SINK_MODE', 'sync')
+EVENT_SINK_BATCH_SIZE = int(os.getenv('EVENT_SINK_BATCH_SIZE', 200))
+EVENT_SINK_FLUSH_INTERVAL = float(os.getenv('EVENT_SINK_FLUSH_INTERVAL', 2))
+EVENT_RETENTION_DAYS = int(os.getenv('EVENT_RETENTION_DAYS', 180))  # used by prune_events
+
+# event statistics (api/stats.py) on /api/stats/ and the /stats bot command; STATS_TOKEN requires a bearer token
+STATS_TOKEN = os.getenv('STATS_TOKEN')
+STATS_MAX_DAYS = int(os.getenv('STATS_MAX_DAYS', 366))
+STATS_HOURLY_RETENTION_DAYS = int(os.getenv('STATS_HOURLY_RETENTION_DAYS', 30))  # used by prune_events
+
+# X-Gitlab-Event-UUID / Idempotency-Key values already processed are remembered this long (seconds)
+WEBHOOK_DEDUP_TTL = int(os.getenv('WEBHOOK_DEDUP_TTL', 60 * 60 * 24))
+
+# checks on the gitlab webhook before the view runs (api/middleware.py WebhookGuardMiddleware)
+GITLAB_WEBHOOK_SECRET_TOKEN = os.getenv('GITLAB_WEBHOOK_SECRET_TOKEN')  # X-Gitlab-Token; unset = not checked
+# comma separated project names or globs ("backend/*"); empty allow list = every project
+WEBHOOK_ALLOWED_PROJECTS = [p.strip() for p in os.getenv('WEBHOOK_ALLOWED_PROJECTS', '').split(',') if p.strip()]
+WEBHOOK_DENIED_PROJECTS = [p.strip() for p in os.getenv('WEBHOOK_DENIED_PROJECTS', '').split(',') if p.strip()]
+# create a project on its first hook; off = projects have to be added in the admin first
+WEBHOOK_AUTO_CREATE_PROJECTS = os.getenv('WEBHOOK_AUTO_CREATE_PROJECTS', 'false').lower() in ('1', 'true', 'yes')
+WEBHOOK_RATE_LIMIT = int(os.getenv('WEBHOOK_RATE_LIMIT', 0))  # requests per minute per source ip, 0 = off
+# header holding the client ip behind a reverse proxy (e.g. X-Real-IP, X-Forwarded-For); unset = REMOTE_ADDR
+WEBHOOK_CLIENT_IP_HEADER = os.getenv('WEBHOOK_CLIENT_IP_HEADER')
+
+# prometheus metrics on /metrics (api/metrics.py); off by default, METRICS_TOKEN requires a bearer token
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
 ALLOWED_HOSTS = ['*']
 
 # Application definition
@@ -35,10 +115,11 @@ INSTALLED_APPS = [
 ]
 
 # CACHE
+REDIS_URL = os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/0')  # the benches point it at a DB of their own
 CACHES = {
     "default": {
         "BACKEND": "django_redis.cache.RedisCache",
-        "LOCATION": "redis://127.0.0.1:6379/0",
+        "LOCATION": REDIS_URL,
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
         }
@@ -78,6 +159,8 @@ SPECTACULAR_SETTINGS = {
 }
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
+    'api.middleware.WebhookGuardMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -0,0 +1,42 @@
+import os
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+django.setup()
+
+import pytest  # noqa: E402
+from django.db import transaction  # noqa: E402
+from django.test.utils import (  # noqa: E402
+    setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+from django_redis import get_redis_connection  # noqa: E402
+
+from api.commands import bot_state  # noqa: E402
+from api.routing import local_routes  # noqa: E402
+
+
+@pytest.fixture(scope='session', autouse=True)
+def django_test_environment():
+    setup_test_environment()
+    databases = setup_databases(verbosity=0, interactive=False)
+    yield
+    teardown_databases(databases, verbosity=0)
+    teardown_test_environment()
+
+
+@pytest.fixture
+def db():
+    # everything a test writes is rolled back
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+@pytest.fixture(autouse=True)
+def redis():
+    conn = get_redis_connection('default')
+    conn.flushall()
+    local_routes.clear()
+    bot_state.clear()
+    yield conn
@@ -0,0 +1,34 @@
+import fakeredis
+
+from root.settings import *  # noqa: F401,F403
+
+# the test suite runs on in-memory SQLite and fakeredis (Lua scripts included, through lupa)
+
+SECRET_KEY = 'tests'
+DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}}
+CACHES = {
+    "default": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": "redis://127.0.0.1:6379/0",
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            "CONNECTION_POOL_KWARGS": {
+                "connection_class": fakeredis.FakeRedisConnection,
+                "server": fakeredis.FakeServer(),
+            },
+        }
+    }
+}
+TELEGRAM_BOT_TOKEN = 'test'
+TELEGRAM_API_URL = 'http://telegram.invalid'
+TELEGRAM_DELIVERY_MODE = 'queue'
+EVENT_SINK_MODE = 'sync'
+METRICS_ENABLED = False
+# whatever local.env says, the webhook guard only checks what a test turns on
+GITLAB_WEBHOOK_SECRET_TOKEN = None
+WEBHOOK_RATE_LIMIT = 0
+WEBHOOK_ALLOWED_PROJECTS = []
+WEBHOOK_DENIED_PROJECTS = []
+WEBHOOK_AUTO_CREATE_PROJECTS = False
+# no migrations are committed: create the tables straight from the models
+MIGRATION_MODULES = {'apps': None}
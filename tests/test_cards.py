@@ -0,0 +1,59 @@
+from django.conf import settings
+
+from api.cards import CARD_SCHEDULED, CARD_UPDATED, card_key, load_card, update_card
+
+KEY = '42:merge:feature'
+
+
+def card(redis):
+    return load_card(redis, 1, KEY)[0]
+
+
+def test_pipeline_before_the_merge_request_has_no_card(redis):
+    assert update_card(1, KEY, pipeline='running', pipeline_id=10) == 0
+    assert load_card(redis, 1, KEY) == (None, None)
+
+
+def test_pipeline_only_card_expires(redis):
+    # merge requests opened before the deploy, or whose hook was lost, only ever get pipeline hooks
+    update_card(1, KEY, pipeline='running', pipeline_id=10)
+    assert 0 < redis.ttl(card_key(1, KEY)) <= settings.MR_CARD_TTL
+
+
+def test_hooks_within_a_flush_share_it():
+    assert update_card(1, KEY, text='open', updated_at='2024-05-01 10:00:00 UTC') == CARD_UPDATED
+    assert update_card(1, KEY, approval='add', approver='jane') == CARD_SCHEDULED
+
+
+def test_older_merge_request_hook_keeps_the_text(redis):
+    update_card(1, KEY, text='new', updated_at='2024-05-01 10:00:05 UTC')
+    update_card(1, KEY, text='old', updated_at='2024-05-01 10:00:00 UTC')
+    assert card(redis)['text'] == 'new'
+
+
+def test_approvals_are_added_and_removed(redis):
+    update_card(1, KEY, text='open\n', updated_at='1')
+    update_card(1, KEY, approval='add', approver='jane')
+    update_card(1, KEY, approval='add', approver='bob')
+    update_card(1, KEY, approval='remove', approver='jane')
+    assert load_card(redis, 1, KEY)[1] == 'open\n👍 *Approved by:* bob\n'
+
+
+def pipeline_after(redis, hooks):
+    update_card(1, KEY, text='open\n', updated_at='1')
+    for pipeline_id, status in hooks:
+        update_card(1, KEY, pipeline=status, pipeline_id=pipeline_id)
+    return card(redis)['pipeline']
+
+
+def test_late_pipeline_hook_does_not_roll_back_the_status(redis):
+    assert pipeline_after(redis, [(10, 'running'), (10, 'success'), (10, 'running')]) == 'success'
+    assert pipeline_after(redis, [(11, 'pending'), (11, 'running'), (11, 'pending')]) == 'running'
+
+
+def test_newer_pipeline_replaces_the_status(redis):
+    assert pipeline_after(redis, [(10, 'success'), (11, 'pending')]) == 'pending'
+
+
+def test_older_pipeline_is_ignored(redis):
+    assert pipeline_after(redis, [(11, 'running'), (10, 'failed')]) == 'running'
@@ -0,0 +1,30 @@
+import pytest
+from django.test import override_settings
+
+from api.client import TelegramClient
+
+
+@pytest.fixture
+def client():
+    return TelegramClient('token', 'http://telegram.invalid', 1, 1, 1, 0)
+
+
+@override_settings(TELEGRAM_GLOBAL_RATE=1000, TELEGRAM_GLOBAL_BURST=1000, TELEGRAM_CHAT_RATE_PER_MINUTE=60,
+                   TELEGRAM_CHAT_BURST=3)
+def test_chat_bucket_lets_a_burst_through_then_queues(client):
+    waits = [client.reserve(-100) for _ in range(5)]
+    assert waits[:3] == [0, 0, 0]
+    # one token a second: the 4th caller waits about a second, the 5th about two
+    assert waits[3] == pytest.approx(1, abs=0.1)
+    assert waits[4] == pytest.approx(2, abs=0.1)
+    # another chat has a bucket of its own
+    assert client.reserve(-200) == 0
+
+
+@override_settings(TELEGRAM_GLOBAL_RATE=10, TELEGRAM_GLOBAL_BURST=2, TELEGRAM_CHAT_RATE_PER_MINUTE=6000,
+                   TELEGRAM_CHAT_BURST=100)
+def test_global_bucket_is_shared_by_every_chat(client):
+    waits = [client.reserve(-100 - index) for index in range(4)]
+    assert waits[:2] == [0, 0]
+    assert waits[2] == pytest.approx(0.1, abs=0.05)
+    assert waits[3] == pytest.approx(0.2, abs=0.05)
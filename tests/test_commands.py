@@ -0,0 +1,44 @@
+from unittest import mock
+
+import pytest
+
+from api.commands import handle_update
+from apps.models import GitlabUser
+
+
+def private(text, telegram_id=100):
+    return {'message': {'chat': {'id': telegram_id, 'type': 'private'}, 'from': {'id': telegram_id}, 'text': text}}
+
+
+@pytest.fixture
+def answers():
+    with mock.patch('api.commands.bot_answer') as bot_answer:
+        yield bot_answer
+
+
+def test_plain_text_is_ignored_unless_an_id_is_awaited(db, answers):
+    assert handle_update(private('hello')) == 'ignored'
+    answers.assert_not_called()
+
+
+def test_non_digit_reply_keeps_waiting(db, answers):
+    handle_update(private('/start'))
+
+    assert handle_update(private('jane')) == 'Gitlab ID must contain only digits!'
+    assert "raqamlardan" in answers.call_args.args[1]
+    assert handle_update(private(' 42 ')) == 'registered'
+    assert GitlabUser.objects.get(gitlab_id=42).telegram_id == '100'
+
+
+def test_imported_member_claims_their_row(db, answers):
+    GitlabUser.objects.create(gitlab_id=42, gitlab_username='jane')
+    handle_update(private('/start'))
+
+    assert handle_update(private('42')) == 'registered'
+    assert GitlabUser.objects.get(gitlab_id=42).telegram_id == '100'
+
+
+def test_taken_id(db, answers):
+    GitlabUser.objects.create(gitlab_id=42, telegram_id='200')
+    handle_update(private('/start'))
+    assert handle_update(private('42')) == 'gitlab_id taken'
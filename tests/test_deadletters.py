@@ -0,0 +1,82 @@
+from datetime import datetime, timezone
+from io import StringIO
+from unittest import mock
+
+import pytest
+from django.core.management import call_command
+
+from api.client import TelegramError
+from apps.models import DeadLetter, GitlabProject
+
+
+def letter(text, project=None, created_at=datetime(2024, 5, 1, 10, tzinfo=timezone.utc), error_class='TelegramError',
+           error_code=502, **fields):
+    return DeadLetter.objects.create(project=project, chat_id=-100, kind='message', text=text, job={},
+                                     error_class=error_class, error_code=error_code, error='Bad Gateway',
+                                     created_at=created_at, **fields)
+
+
+@pytest.fixture
+def send():
+    with mock.patch('api.queue.send_message', return_value={'message_id': 1}) as send:
+        yield send
+
+
+def replay(*args):
+    out = StringIO()
+    call_command('replay_dead_letters', '--rate', '1000', *args, stdout=out, stderr=StringIO())
+    return out.getvalue()
+
+
+def sent(send):
+    return [call.args[2] for call in send.call_args_list]
+
+
+def test_oldest_first_and_only_once(db, send):
+    letter('second', created_at=datetime(2024, 5, 2, tzinfo=timezone.utc))
+    letter('first')
+    letter('', error_class='ConnectionError')  # nothing to send
+
+    assert 'Replayed 2 dead letters, 0 failed.' in replay()
+    assert sent(send) == ['first', 'second']
+    assert not DeadLetter.objects.filter(text__gt='', replayed_at__isnull=True).exists()
+
+    replay()
+    assert len(sent(send)) == 2
+    replay('--include-replayed')
+    assert len(sent(send)) == 4
+
+
+@pytest.mark.parametrize('args, expected', [
+    (['--project', 'backend'], ['backend']),
+    (['--since', '2024-05-02'], ['may 2', 'may 3']),
+    (['--until', '2024-05-02T12:00'], ['backend', 'may 2']),
+    (['--error', 'ConnectionError'], ['may 3']),
+    (['--error-code', '429', '--error-code', '403'], ['may 2']),
+    (['--limit', '1'], ['backend']),
+])
+def test_filters(db, send, args, expected):
+    letter('backend', project=GitlabProject.objects.create(name='backend'))
+    letter('may 2', created_at=datetime(2024, 5, 2, 9, tzinfo=timezone.utc), error_code=429)
+    letter('may 3', created_at=datetime(2024, 5, 3, tzinfo=timezone.utc), error_class='ConnectionError',
+           error_code=None)
+
+    replay(*args)
+    assert sent(send) == expected
+
+
+def test_dry_run_sends_nothing(db, send):
+    letter('text')
+    assert '1 dead letters would be replayed.' in replay('--dry-run')
+    send.assert_not_called()
+
+
+def test_stops_after_failures_in_a_row(db, send):
+    for index in range(4):
+        letter(f'text {index}')
+    send.side_effect = TelegramError('sendMessage', 403, 'bot was kicked')
+
+    assert 'Replayed 0 dead letters, 2 failed.' in replay('--max-failures', '2')
+    failed = DeadLetter.objects.filter(attempts=1)
+    assert failed.count() == 2
+    assert set(failed.values_list('error_code', flat=True)) == {403}
@@ -0,0 +1,36 @@
+from django.test import override_settings
+
+from api.digests import DIGEST_SCHEDULED, DIGEST_UPDATED, load_push_digest, update_push_digest
+
+KEY = '1:push:main'
+
+
+def push(commits):
+    return {'commits': [{'id': f"{index:08x}", 'title': f"commit {index}", 'author': 'jane'} for index in commits],
+            'total_commits': len(commits)}
+
+
+def test_pushes_add_up_within_the_window(redis):
+    assert update_push_digest(KEY, push([1, 2]), 'first\n', window=60) == DIGEST_UPDATED
+    assert update_push_digest(KEY, push([3]), 'second\n', window=60) == DIGEST_SCHEDULED
+
+    state, text = load_push_digest(redis, KEY)
+    assert (state['pushes'], state['commits'], state['text']) == ('2', '3', 'second\n')
+    assert text.startswith('second\n🔁 *Pushes:* `2`\n📝 *Commits (3):*\n')
+    assert text.count('commit ') == 3
+
+
+@override_settings(PUSH_DIGEST_MAX_COMMITS=2)
+def test_only_the_last_commits_are_kept(redis):
+    update_push_digest(KEY, push([1, 2, 3]), 'text\n', window=60)
+    update_push_digest(KEY, push([4]), 'text\n', window=60)
+
+    state, text = load_push_digest(redis, KEY)
+    assert 'commit 4' in text and 'commit 3' in text and 'commit 2' not in text
+    assert text.endswith('  … +2\n')
+
+
+@override_settings(PUSH_DIGEST_EDIT_INTERVAL=5)
+def test_the_window_slides(redis):
+    update_push_digest(KEY, push([1]), 'text\n', window=60)
+    assert 60 < redis.ttl(f"gitlab_bot:push_digest:{KEY}") <= 65
@@ -0,0 +1,60 @@
+from api.fanout import Target, compile_rules, get_targets
+from api.routing import ProjectRoute, RouteRule
+
+
+def project(rules=(), chat_id=-100, is_active=True):
+    return ProjectRoute(id=1, name='backend', chat_id=chat_id, thread_id=None, is_active=is_active,
+                        show_user=True, show_project=True, show_branch=True, show_status=True, show_duration=True,
+                        push_digest_window=0, rules=tuple(rules))
+
+
+def rule(chat_id, gitlab_event='', branch='', status='', thread_id=None):
+    return RouteRule(gitlab_event, branch, status, chat_id, thread_id, True)
+
+
+def event(gitlab_event='pipeline', branch='main', status='success'):
+    return {'gitlab_event': gitlab_event, 'branch': branch, 'status': status}
+
+
+def chats(targets):
+    return [target.chat_id for target in targets]
+
+
+def test_default_group_comes_first_then_matching_routes():
+    rules = [rule(-200), rule(-300, gitlab_event='push'), rule(-400, status='failed')]
+    for gitlab_event, status, expected in (('pipeline', 'success', {-200}), ('push', 'pushed', {-200, -300}),
+                                           ('pipeline', 'failed', {-200, -400})):
+        targets = chats(get_targets(project(rules), event(gitlab_event, status=status)))
+        assert targets[0] == -100
+        assert sorted(targets[1:]) == sorted(expected)
+
+
+def test_branch_filters_exact_and_glob():
+    rules = [rule(-200, branch='main'), rule(-300, branch='release/*'), rule(-400, branch='release/1.?')]
+    assert chats(get_targets(project(rules), event(branch='main'))) == [-100, -200]
+    assert chats(get_targets(project(rules), event(branch='release/1.2'))) == [-100, -300, -400]
+    assert chats(get_targets(project(rules), event(branch='release/10'))) == [-100, -300]
+    assert chats(get_targets(project(rules), event(branch='mainline'))) == [-100]
+
+
+def test_filters_combine():
+    rules = [rule(-200, gitlab_event='pipeline', branch='main', status='failed')]
+    assert chats(get_targets(project(rules), event(status='failed'))) == [-100, -200]
+    assert chats(get_targets(project(rules), event(status='success'))) == [-100]
+    assert chats(get_targets(project(rules), event('push', status='failed'))) == [-100]
+
+
+def test_one_target_per_chat_and_topic():
+    rules = [rule(-100), rule(-200), rule(-200, branch='main'), rule(-200, thread_id=5)]
+    targets = get_targets(project(rules), event())
+    assert [(target.chat_id, target.thread_id) for target in targets] == [(-100, None), (-200, None), (-200, 5)]
+
+
+def test_project_without_group_uses_routes_only():
+    assert get_targets(project([rule(-200)], chat_id=None), event()) == [Target(-200, None, True)]
+    assert get_targets(project(chat_id=None), event()) == []
+
+
+def test_rule_index_is_shared_by_equal_rules():
+    rules = (rule(-200), rule(-300, branch='dev'))
+    assert compile_rules(rules) is compile_rules(tuple(rules))
@@ -0,0 +1,43 @@
+from unittest import mock
+
+import pytest
+
+from api.idempotency import get_delivery_id
+from apps.models import GitLabEvent
+from bench.payloads import push_hook
+from tests.test_views import URLS, post, project  # noqa: F401
+
+UUID = {'X-Gitlab-Event-UUID': '5f3c-delivery'}
+
+
+def test_delivery_id_headers():
+    assert get_delivery_id({'X-Gitlab-Event-UUID': 'a', 'Idempotency-Key': 'b'}) == 'a'
+    assert get_delivery_id({'Idempotency-Key': 'b'}) == 'b'
+    assert get_delivery_id({}) is None
+
+
+@pytest.mark.parametrize('view', URLS)
+def test_retried_delivery_is_a_duplicate(view, project):  # noqa: F811
+    payload = push_hook(commits=1, files=1)
+    assert post(view, 'Push Hook', payload, **UUID).json() == {'status': 'ok'}
+    assert post(view, 'Push Hook', payload, **UUID).json() == {'status': 'duplicate'}
+    assert GitLabEvent.objects.count() == 1
+
+    # without an id every delivery is handled
+    post(view, 'Push Hook', payload)
+    assert GitLabEvent.objects.count() == 2
+
+
+@pytest.mark.parametrize('view', URLS)
+def test_invalid_body_releases_the_claim(view, project):  # noqa: F811
+    assert post(view, 'Push Hook', '{"project": ', **UUID).status_code == 400
+    assert post(view, 'Push Hook', push_hook(commits=1, files=1), **UUID).json() == {'status': 'ok'}
+
+
+@pytest.mark.parametrize('view', URLS)
+def test_failed_hook_releases_the_claim(view, project):  # noqa: F811
+    payload = push_hook(commits=1, files=1)
+    with mock.patch('api.views.record_event', side_effect=RuntimeError('database down')), \
+            mock.patch('api.async_views.arecord_event', side_effect=RuntimeError('database down')):
+        assert post(view, 'Push Hook', payload, **UUID).status_code == 500
+    assert post(view, 'Push Hook', payload, **UUID).json() == {'status': 'ok'}
@@ -0,0 +1,71 @@
+import threading
+import time
+from unittest import mock
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.test import override_settings
+
+from api.client import DeliveryError
+from api.locks import aevent_lock, event_lock, get_lock
+from api.queue import deliver, make_job
+
+
+@override_settings(DELIVERY_LOCK_TIMEOUT=0.1)
+def test_a_held_lock_times_out():
+    with event_lock(1, 'mr:1'):
+        with pytest.raises(DeliveryError):
+            with event_lock(1, 'mr:1'):
+                pass
+        # other messages, or the same key of another project, don't wait
+        with event_lock(1, 'mr:2'), event_lock(2, 'mr:1'):
+            pass
+
+
+@override_settings(DELIVERY_LOCK_TIMEOUT=0.1)
+def test_async_lock_shares_the_key():
+    async def hold():
+        async with aevent_lock(1, 'mr:1'):
+            with pytest.raises(DeliveryError):
+                with event_lock(1, 'mr:1'):
+                    pass
+
+    async_to_sync(hold)()
+    with event_lock(1, 'mr:1'):
+        pass
+
+
+def test_messages_without_a_key_take_no_lock(redis):
+    with event_lock(1, None), event_lock(1, ''):
+        assert not redis.keys('gitlab_bot:lock:*')
+
+
+@override_settings(DELIVERY_LOCKS=False)
+def test_locks_can_be_turned_off(redis):
+    with event_lock(1, 'mr:1'):
+        assert not redis.keys('gitlab_bot:lock:*')
+
+
+def test_release_after_expiry_only_warns(redis, caplog):
+    with event_lock(1, 'mr:1'):
+        redis.delete(get_lock(1, 'mr:1').name)
+    assert 'expired before its delivery finished' in caplog.text
+
+
+def test_concurrent_deliveries_send_once(redis):
+    # both miss the message id without the lock; with it, the second one finds it and edits
+    def slow_send(chat_id, thread_id, text):
+        time.sleep(0.05)
+        return {'message_id': 7}
+
+    jobs = [make_job(-100, None, f'text {index}', 'mr:1', False, project_id=1) for index in range(2)]
+    with mock.patch('api.queue.send_message', side_effect=slow_send) as send, \
+            mock.patch('api.queue.edit_message') as edit:
+        threads = [threading.Thread(target=deliver, args=(job,)) for job in jobs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert send.call_count == 1
+    assert edit.call_count == 1
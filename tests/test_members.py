@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+from api.members import Member, MembersFormatError, parse_members, sync_members
+from apps.models import GitlabProject, GitlabUser
+
+
+def test_parse_api_output():
+    content = json.dumps([{'id': 1, 'username': 'jane', 'state': 'active'},
+                          {'id': 2, 'username': 'bob', 'state': 'blocked'}])
+    assert parse_members(content, 'members.json', project='backend') == {'backend': [Member(1, 'jane', None)]}
+
+
+def test_parse_object_of_projects():
+    content = json.dumps({'backend': [{'id': 1, 'username': 'jane'}], 'frontend': [{'id': 2, 'username': 'bob'}]})
+    assert parse_members(content) == {'backend': [Member(1, 'jane', None)], 'frontend': [Member(2, 'bob', None)]}
+
+
+def test_parse_csv():
+    content = b'\xef\xbb\xbfgitlab_id,username,project,telegram_id\n1,jane,backend,100\n2,bob,,\n'
+    assert parse_members(content, 'members.csv', project='frontend') == {
+        'backend': [Member(1, 'jane', '100')],
+        'frontend': [Member(2, 'bob', None)],
+    }
+
+
+@pytest.mark.parametrize('content, project', [
+    ('[{"id": 1}]', None),
+    ('[{"username": "jane"}]', 'backend'),
+])
+def test_parse_errors(content, project):
+    with pytest.raises(MembersFormatError):
+        parse_members(content, project=project)
+
+
+def test_sync_creates_updates_and_links(db):
+    backend = GitlabProject.objects.create(name='backend')
+    GitlabUser.objects.create(gitlab_id=1, gitlab_username='jane-old', telegram_id='100')
+
+    result = sync_members({'backend': [Member(1, 'jane', None), Member(2, 'bob', None)], 'missing': []})
+
+    assert (result['created'], result['updated'], result['linked']) == (1, 1, 2)
+    assert result['unknown_projects'] == ['missing']
+    jane = GitlabUser.objects.get(gitlab_id=1)
+    # a registered member keeps their telegram_id
+    assert (jane.gitlab_username, jane.telegram_id) == ('jane', '100')
+    assert set(backend.users.values_list('gitlab_id', flat=True)) == {1, 2}
+
+    again = sync_members({'backend': [Member(1, 'jane', None), Member(2, 'bob', None)]})
+    assert (again['created'], again['updated'], again['linked']) == (0, 0, 0)
+
+
+def test_renamed_username_is_taken_over(db):
+    GitlabUser.objects.create(gitlab_id=1, gitlab_username='jane')
+    GitlabProject.objects.create(name='backend')
+
+    result = sync_members({'backend': [Member(2, 'jane', None)]})
+
+    assert result['usernames_freed'] == 1
+    assert GitlabUser.objects.get(gitlab_id=1).gitlab_username is None
+    assert GitlabUser.objects.get(gitlab_id=2).gitlab_username == 'jane'
+
+
+def test_prune_and_dry_run(db):
+    backend = GitlabProject.objects.create(name='backend')
+    sync_members({'backend': [Member(1, 'jane', None), Member(2, 'bob', None)]})
+
+    result = sync_members({'backend': [Member(1, 'jane', None)]}, prune=True, dry_run=True)
+    assert result['unlinked'] == 1
+    assert backend.users.count() == 2
+
+    sync_members({'backend': [Member(1, 'jane', None)]}, prune=True)
+    assert list(backend.users.values_list('gitlab_id', flat=True)) == [1]
+    assert GitlabUser.objects.filter(gitlab_id=2).exists()
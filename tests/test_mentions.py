@@ -0,0 +1,56 @@
+from asgiref.sync import async_to_sync
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from api.mentions import aresolve_mentions, resolve_mentions
+from apps.models import GitlabUser
+
+
+def event():
+    return {
+        'user_id': 1, 'user_name': 'jane',
+        'assignees': [{'id': 2, 'username': 'bob'}, {'id': 1, 'username': 'jane'}],
+        'reviewers': [{'id': 3, 'username': 'ann'}, {'id': 4, 'username': 'renamed'}],
+    }
+
+
+def users():
+    GitlabUser.objects.create(gitlab_id=1, gitlab_username='jane', telegram_id='100')
+    GitlabUser.objects.create(gitlab_id=2, gitlab_username='bob')
+    # imported before the GitLab id was known: matched by username
+    GitlabUser.objects.create(gitlab_id=99, gitlab_username='renamed', telegram_id='400')
+
+
+def test_one_query_then_none(db):
+    users()
+    with CaptureQueriesContext(connection) as queries:
+        assert resolve_mentions(event()) == {1: '100', 4: '400'}
+    assert len(queries.captured_queries) == 1
+
+    # unregistered users are cached too
+    with CaptureQueriesContext(connection) as queries:
+        assert resolve_mentions(event()) == {1: '100', 4: '400'}
+    assert not queries.captured_queries
+
+
+def test_async_variant(db):
+    users()
+    assert async_to_sync(aresolve_mentions)(event()) == {1: '100', 4: '400'}
+    assert resolve_mentions(event()) == {1: '100', 4: '400'}
+
+
+def test_saved_user_is_resolved_again(db):
+    users()
+    resolve_mentions(event())
+
+    bob = GitlabUser.objects.get(gitlab_id=2)
+    bob.telegram_id = '200'
+    bob.save()
+    assert resolve_mentions(event())[2] == '200'
+
+    bob.delete()
+    assert 2 not in resolve_mentions(event())
+
+
+def test_event_without_users():
+    assert resolve_mentions({'user_id': None}) == {}
@@ -0,0 +1,51 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import override_settings
+
+from api.messages import (
+    delete_message_id, get_message_id, messages_key, prune_message_ids, save_message_id,
+)
+
+
+def at(now):
+    # the clock of api.messages only; fakeredis keeps the real one for key expiry
+    return mock.patch('api.messages.time', mock.Mock(time=mock.Mock(return_value=now)))
+
+
+def test_saved_ids_are_read_per_project():
+    save_message_id(1, '7:merge:main', 100)
+    save_message_id(2, '7:merge:main', 200)
+    assert get_message_id(1, '7:merge:main') == 100
+    assert get_message_id(2, '7:merge:main') == 200
+    delete_message_id(1, '7:merge:main')
+    assert get_message_id(1, '7:merge:main') is None
+
+
+@override_settings(MESSAGE_ID_TTL=100)
+def test_expired_entries_are_missing_and_pruned(redis):
+    with at(1000):
+        save_message_id(1, 'old', 1)
+    with at(1050):
+        save_message_id(1, 'new', 2)
+    with at(1120):
+        assert get_message_id(1, 'old') is None
+        assert get_message_id(1, 'new') == 2
+        assert prune_message_ids(1) == 1
+    assert redis.hkeys(messages_key(1)) == [b'new']
+
+
+@override_settings(MESSAGE_ID_TTL=100)
+def test_an_entry_read_after_half_its_ttl_is_extended(redis):
+    with at(1000):
+        save_message_id(1, 'key', 5)
+    with at(1060):
+        assert get_message_id(1, 'key') == 5
+    assert redis.hget(messages_key(1), 'key') == b'5:1160'
+
+
+def test_legacy_top_level_key_is_moved_into_the_hash(redis):
+    cache.set('7:pipeline:main', 300)
+    assert get_message_id(1, '7:pipeline:main') == 300
+    assert cache.get('7:pipeline:main') is None
+    assert redis.hexists(messages_key(1), '7:pipeline:main')
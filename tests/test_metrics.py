@@ -0,0 +1,46 @@
+import pytest
+from django.test import Client, override_settings
+
+from api.metrics import collect, count, series
+from bench.payloads import push_hook
+from tests.test_views import post, project  # noqa: F401
+
+
+def scrape(**headers):
+    return Client().get('/metrics', headers=headers)
+
+
+def test_off_by_default():
+    assert scrape().status_code == 404
+
+
+@override_settings(METRICS_ENABLED=True, METRICS_TOKEN='secret')
+def test_token_is_required():
+    assert scrape().status_code == 401
+    assert scrape(Authorization='Bearer wrong').status_code == 401
+    assert scrape(Authorization='Bearer secret').status_code == 200
+
+
+@override_settings(METRICS_ENABLED=True)
+@pytest.mark.parametrize('view', ['sync', 'async'])
+def test_webhook_requests_are_measured(view, project):  # noqa: F811
+    post(view, 'Push Hook', push_hook(commits=1, files=1))
+    post(view, 'Note Hook', {})
+
+    text = scrape().content.decode()
+    url_name = 'gitlab-webhook' if view == 'sync' else 'gitlab-webhook-async'
+    # labeled with what the view learned: the push by its event and project, the ignored hook by neither
+    push = f'event_type="push",project="backend",view="{url_name}"'
+    assert f'gitlab_bot_http_requests_total{{code="200",{push}}} 1.0' in text
+    assert f'gitlab_bot_http_requests_total{{code="200",view="{url_name}"}} 1.0' in text
+    assert f'gitlab_bot_http_request_seconds_count{{{push}}} 1.0' in text
+    assert 'gitlab_bot_stage_seconds_count{event_type="push",project="backend",stage="render"} 1.0' in text
+    assert '# TYPE gitlab_bot_http_request_seconds histogram' in text
+
+
+@override_settings(METRICS_ENABLED=True)
+def test_labels_are_escaped():
+    with collect():
+        count('errors_total', exception='Bad "quote"\n')
+    assert 'gitlab_bot_errors_total{exception="Bad \\"quote\\"\\n"} 1.0' in scrape().content.decode()
+    assert series('errors_total', {}) == 'gitlab_bot_errors_total'
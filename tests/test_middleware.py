@@ -0,0 +1,73 @@
+from unittest import mock
+
+import pytest
+from django.test import override_settings
+
+from api.middleware import project_allowed, project_name
+from bench.payloads import push_hook
+from tests.test_views import URLS, post, project  # noqa: F401
+
+
+def push(name='backend'):
+    payload = push_hook(commits=1, files=1)
+    payload['project'] = {**payload['project'], 'name': name}
+    return payload
+
+
+@pytest.mark.parametrize('view', URLS)
+@override_settings(GITLAB_WEBHOOK_SECRET_TOKEN='secret')
+def test_token(view, project):  # noqa: F811
+    assert post(view, 'Push Hook', push()).status_code == 401
+    assert post(view, 'Push Hook', push(), **{'X-Gitlab-Token': 'wrong'}).status_code == 401
+    assert post(view, 'Push Hook', push(), **{'X-Gitlab-Token': 'secret'}).json() == {'status': 'ok'}
+
+
+@pytest.mark.parametrize('view', URLS)
+@override_settings(WEBHOOK_RATE_LIMIT=2, WEBHOOK_CLIENT_IP_HEADER='X-Forwarded-For')
+def test_rate_limit_per_ip(view, project):  # noqa: F811
+    statuses = [post(view, 'Push Hook', push()).status_code for _ in range(3)]
+    assert statuses == [200, 200, 429]
+    # the proxy's own hop is the last one, whatever the client put before it
+    other = post(view, 'Push Hook', push(), **{'X-Forwarded-For': '127.0.0.1, 10.0.0.7'})
+    assert other.status_code == 200
+
+
+@pytest.mark.parametrize('view', URLS)
+@override_settings(WEBHOOK_DENIED_PROJECTS=['legacy-*'], WEBHOOK_AUTO_CREATE_PROJECTS=True)
+def test_denied_project(view, db):
+    assert post(view, 'Push Hook', push('legacy-api')).status_code == 403
+    assert post(view, 'Push Hook', push('backend')).status_code == 200
+
+
+@pytest.mark.parametrize('view', URLS)
+def test_unknown_project_is_turned_away_before_the_view(view, db):
+    with mock.patch('api.views.load_hook') as load_hook, mock.patch('api.async_views.load_hook') as aload_hook:
+        response = post(view, 'Push Hook', push('missing'))
+    assert (response.status_code, response.json()) == (403, {'error': 'Unknown project'})
+    load_hook.assert_not_called()
+    aload_hook.assert_not_called()
+
+
+@pytest.mark.parametrize('view', URLS)
+@override_settings(WEBHOOK_RATE_LIMIT=1, WEBHOOK_DENIED_PROJECTS=['missing'])
+def test_ignored_event_types_skip_the_checks(view, db, redis):
+    for _ in range(3):
+        response = post(view, 'Note Hook', push('missing'))
+        assert (response.status_code, response.json()) == (200, {'status': 'ignored'})
+    assert not redis.keys('gitlab_bot:webhook_rate:*')
+
+
+def test_project_name_must_be_a_string():
+    assert project_name(b'{"object_kind": "push", "project": {"name": "backend"}, "commits": [') == 'backend'
+    assert project_name(b'{"project": {"name": ["backend"]}}') is None
+    assert project_name(b'{"project": {"name": 7}}') is None
+    assert project_name(b'{"project": "backend"}') is None
+    assert project_name(b'not json') is None
+
+
+@override_settings(WEBHOOK_ALLOWED_PROJECTS=['backend', 'web-*'], WEBHOOK_DENIED_PROJECTS=['web-old'])
+def test_allow_and_deny_lists():
+    assert project_allowed('backend')
+    assert project_allowed('web-shop')
+    assert not project_allowed('web-old')
+    assert not project_allowed('backend-2')
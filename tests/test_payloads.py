@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+from api.payloads import HOOK_KEYS, extract_keys, load_hook
+
+
+def test_only_wanted_keys_are_returned():
+    document = json.dumps({'a': 1, 'b': {'c': [1, 2]}, 'd': 'x'})
+    assert extract_keys(document, {'a', 'd'}) == {'a': 1, 'd': 'x'}
+
+
+def test_nested_values_are_decoded_whole():
+    value = {'name': 'backend', 'nested': {'list': [{'x': None}, [1, [2, {'y': '}'}]]], 'ok': True}}
+    document = json.dumps({'skip': {'deep': [[[{'z': '{'}]]]}, 'project': value})
+    assert extract_keys(document, {'project'}) == {'project': value}
+
+
+def test_escaped_keys_and_strings():
+    # an escaped key still matches, braces and quotes inside strings don't end the value
+    document = '{"sk\\"ip": "a \\"}\\" b", "proj\\u0065ct": {"name": "\\u00e9 \\\\ \\n"}}'
+    assert extract_keys(document, {'project'}) == {'project': {'name': 'é \\ \n'}}
+
+
+def test_whitespace_everywhere():
+    document = ' \n{ \t"a" \r\n:\n 1 ,\n "b" : [ 1 , 2 ] \n} '
+    assert extract_keys(document, {'a', 'b'}) == {'a': 1, 'b': [1, 2]}
+
+
+def test_missing_keys_are_left_out():
+    assert extract_keys('{"a": 1}', {'a', 'b'}) == {'a': 1}
+    assert extract_keys('{}', {'a'}) == {}
+    assert extract_keys(' { } ', {'a'}) == {}
+
+
+def test_scan_stops_once_every_key_is_found():
+    # whatever follows the last wanted key is never read
+    assert extract_keys('{"a": 1, "b": [broken', {'a'}) == {'a': 1}
+
+
+@pytest.mark.parametrize('document', [
+    '',
+    '[1, 2]',
+    '"text"',
+    '{"a" 1}',
+    '{"a": 1 "b": 2}',
+    '{"a": }',
+    '{"a": 1,',
+    '{"a": [1, 2}',
+    '{1: 2}',
+    '{"a": "unterminated}',
+    '{"a": 1, }',
+])
+def test_malformed_documents_raise_value_error(document):
+    with pytest.raises(ValueError):
+        extract_keys(document, {'a', 'b'})
+
+
+def test_load_hook_matches_json_loads():
+    payload = {
+        'object_kind': 'pipeline',
+        'object_attributes': {'id': 1, 'ref': 'main', 'status': 'running'},
+        'merge_request': None,
+        'user': {'id': 7, 'name': 'Jane', 'username': 'jane'},
+        'project': {'name': 'backend'},
+        'builds': [{'id': index, 'name': f"job {index}"} for index in range(50)],
+    }
+    body = json.dumps(payload).encode()
+    assert load_hook('pipeline', body) == {key: payload[key] for key in HOOK_KEYS['pipeline']}
@@ -0,0 +1,67 @@
+from unittest import mock
+
+import pytest
+
+from api.pipelines import (
+    PIPELINE_SCHEDULED, PIPELINE_STALE, PIPELINE_UPDATED, flush_pipeline, pipeline_text, state_key,
+    update_pipeline_state,
+)
+
+KEY = '1001:pipeline:main'
+PROJECT = 1
+
+
+def test_first_hook_schedules_a_flush_and_later_ones_join_it():
+    assert update_pipeline_state(PROJECT, KEY, 'pending', 'pending text') == PIPELINE_UPDATED
+    assert update_pipeline_state(PROJECT, KEY, 'running', 'running text') == PIPELINE_SCHEDULED
+    assert pipeline_text(PROJECT, KEY) == 'running text'
+
+
+@pytest.mark.parametrize('statuses, expected', [
+    (['pending', 'running', 'success'], 'success'),
+    # late hooks never move the pipeline back
+    (['running', 'pending'], 'running'),
+    (['success', 'running'], 'success'),
+    (['failed', 'pending', 'running'], 'failed'),
+    # a final status may replace another one (a retried job)
+    (['failed', 'success'], 'success'),
+    # unknown statuses rank lowest
+    (['created', 'unknown', 'pending'], 'pending'),
+])
+def test_status_never_goes_back(statuses, expected):
+    for status in statuses:
+        update_pipeline_state(PROJECT, KEY, status, status)
+    assert pipeline_text(PROJECT, KEY) == expected
+
+
+def test_stale_hook_is_reported():
+    update_pipeline_state(PROJECT, KEY, 'success', 'success')
+    assert update_pipeline_state(PROJECT, KEY, 'running', 'running') == PIPELINE_STALE
+
+
+def test_pipelines_are_independent():
+    update_pipeline_state(PROJECT, KEY, 'success', 'success')
+    assert update_pipeline_state(PROJECT, '1002:pipeline:main', 'running', 'running') == PIPELINE_UPDATED
+    assert pipeline_text(PROJECT, '1002:pipeline:main') == 'running'
+
+
+def test_same_pipeline_id_in_another_project_has_its_own_state():
+    update_pipeline_state(PROJECT, KEY, 'success', 'backend success')
+    assert update_pipeline_state(2, KEY, 'running', 'frontend running') == PIPELINE_UPDATED
+    assert pipeline_text(PROJECT, KEY) == 'backend success'
+    assert pipeline_text(2, KEY) == 'frontend running'
+
+
+def test_flush_sends_once_then_edits_only_on_change(redis):
+    job = {'chat_id': -100, 'thread_id': None, 'event_key': KEY, 'project_id': PROJECT}
+    update_pipeline_state(PROJECT, KEY, 'running', 'running')
+    with mock.patch('api.pipelines.send_message', return_value={'message_id': 55}) as send, \
+            mock.patch('api.pipelines.edit_message') as edit:
+        flush_pipeline(job)
+        flush_pipeline(job)
+        update_pipeline_state(PROJECT, KEY, 'success', 'success')
+        flush_pipeline(job)
+
+    send.assert_called_once_with(-100, None, 'running')
+    edit.assert_called_once_with(-100, 55, 'success')
+    assert redis.hget(state_key(PROJECT, KEY), 'status') == b'success'
@@ -0,0 +1,77 @@
+from unittest import mock
+
+import pytest
+
+from api.client import TelegramError
+from api.polling import OFFSET_KEY, Poller, by_chat
+
+
+def update(update_id, chat_id):
+    return {'update_id': update_id, 'message': {'chat': {'id': chat_id}, 'text': f'/start {update_id}'}}
+
+
+def run(poller, batches, handle=None):
+    # get_updates answers the batches in turn, then the poller is stopped
+    offsets = []
+
+    def get_updates(offset, timeout, limit, allowed_updates):
+        offsets.append(offset)
+        if not batches:
+            poller.stop()
+            return []
+        batch = batches.pop(0)
+        if isinstance(batch, Exception):
+            raise batch
+        return batch
+
+    with mock.patch('api.polling.get_updates', side_effect=get_updates), \
+            mock.patch('api.polling.handle_update', side_effect=handle) as handle_update, \
+            mock.patch.object(poller.stopping, 'wait') as wait:
+        poller.run()
+    return offsets, handle_update, wait
+
+
+def test_offset_follows_the_last_update_and_survives_a_restart(redis):
+    offsets, handle_update, _ = run(Poller(concurrency=2), [[update(5, -1), update(6, -2)], [update(7, -1)]])
+    assert offsets == [None, 7, 8]
+    assert handle_update.call_count == 3
+    assert redis.get(OFFSET_KEY) == b'8'
+
+    offsets, _, _ = run(Poller(), [])
+    assert offsets == [8]
+
+
+def test_empty_batches_keep_the_offset(redis):
+    redis.set(OFFSET_KEY, 3)
+    offsets, _, _ = run(Poller(), [[], [update(3, -1)]])
+    assert offsets == [3, 3, 4]
+
+
+def test_failed_command_does_not_hold_the_batch_back(redis):
+    def handle(update):
+        if update['update_id'] == 1:
+            raise RuntimeError('boom')
+
+    poller = Poller()
+    offsets, handle_update, _ = run(poller, [[update(1, -1), update(2, -1)]], handle)
+    assert handle_update.call_count == 2
+    assert offsets == [None, 3]
+    assert poller.handled == 2
+
+
+def test_get_updates_failures_back_off(redis):
+    error = ConnectionError('network')
+    offsets, _, wait = run(Poller(), [error, error, [update(1, -1)], error])
+    assert [call.args[0] for call in wait.call_args_list] == [1, 2, 1]
+    assert offsets == [None, None, None, 2, 2]
+
+
+@pytest.mark.parametrize('code', [401, 409])
+def test_fatal_errors_stop_the_poller(redis, code):
+    with pytest.raises(TelegramError):
+        run(Poller(), [TelegramError('getUpdates', code, 'Conflict')])
+
+
+def test_updates_are_grouped_by_chat_in_order():
+    updates = [update(1, -1), update(2, -2), update(3, -1), {'update_id': 4, 'edited_message': {'chat': {'id': -2}}}]
+    assert [[u['update_id'] for u in chat] for chat in by_chat(updates)] == [[1, 3], [2, 4]]
@@ -0,0 +1,112 @@
+import json
+from unittest import mock
+
+import pytest
+from django.db import DatabaseError
+from django.test import override_settings
+
+from api.client import TelegramError
+from api.queue import DELAYED_KEY, enqueue_message, get_shard, processing_key, work_once
+from apps.models import DeadLetter
+
+
+@pytest.fixture
+def bot():
+    with mock.patch('api.queue.send_message') as send, mock.patch('api.queue.edit_message') as edit:
+        send.return_value = {'message_id': 7}
+        yield send, edit
+
+
+def make_due(conn):
+    # delayed jobs become due now instead of after their backoff
+    for raw in conn.zrange(DELAYED_KEY, 0, -1):
+        conn.zadd(DELAYED_KEY, {raw: 0})
+
+
+def delayed(conn):
+    return [(json.loads(raw), score) for raw, score in conn.zrange(DELAYED_KEY, 0, -1, withscores=True)]
+
+
+def test_send_then_edit(bot, redis):
+    send, edit = bot
+    job = enqueue_message(-100, None, 'opened', event_key='mr:1')
+    enqueue_message(-100, None, 'merged', event_key='mr:1', final=True)
+
+    assert work_once(redis, get_shard(job)) and work_once(redis, get_shard(job))
+    send.assert_called_once_with(-100, None, 'opened')
+    edit.assert_called_once_with(-100, 7, 'merged')
+    assert not redis.llen(processing_key(get_shard(job)))
+
+
+@override_settings(TELEGRAM_DELIVERY_MAX_RETRIES=10)
+def test_failed_delivery_backs_off(bot, redis):
+    send, _ = bot
+    send.side_effect = ConnectionError('telegram down')
+    job = enqueue_message(-100, None, 'text')
+
+    delays = []
+    for attempt in range(1, 8):
+        with mock.patch('api.queue.time.time', return_value=1000.0):
+            work_once(redis, get_shard(job))
+        [(retried, score)] = delayed(redis)
+        assert retried['attempts'] == attempt
+        delays.append(score - 1000)
+        make_due(redis)
+    assert delays == [2, 4, 8, 16, 32, 60, 60]
+
+
+@override_settings(TELEGRAM_DELIVERY_MAX_RETRIES=1)
+def test_dead_letter_once_retries_run_out(bot, redis, db):
+    send, _ = bot
+    send.side_effect = ConnectionError('telegram down')
+    job = enqueue_message(-100, None, 'text', project_id=None)
+
+    work_once(redis, get_shard(job))
+    make_due(redis)
+    work_once(redis, get_shard(job))
+
+    assert not delayed(redis)
+    letter = DeadLetter.objects.get()
+    assert (letter.text, letter.attempts, letter.error_class) == ('text', 2, 'ConnectionError')
+
+
+def test_permanent_error_is_not_retried(bot, redis, db):
+    send, _ = bot
+    send.side_effect = TelegramError('sendMessage', 400, "can't parse entities")
+    job = enqueue_message(-100, None, 'text')
+
+    work_once(redis, get_shard(job))
+
+    assert not delayed(redis)
+    assert DeadLetter.objects.get().error_code == 400
+
+
+def test_job_is_kept_when_its_dead_letter_cant_be_stored(bot, redis, db):
+    send, _ = bot
+    send.side_effect = TelegramError('sendMessage', 403, 'bot was kicked')
+    job = enqueue_message(-100, None, 'text')
+
+    with mock.patch('api.deadletters.DeadLetter.objects.create', side_effect=DatabaseError('database down')):
+        work_once(redis, get_shard(job))
+
+    [(kept, _)] = delayed(redis)
+    assert kept['id'] == job['id']
+    assert not redis.llen(processing_key(get_shard(job)))
+
+
+def test_retry_does_not_overwrite_a_newer_edit(bot, redis):
+    send, edit = bot
+    first = enqueue_message(-100, None, 'opened', event_key='mr:1')
+    shard = get_shard(first)
+    work_once(redis, shard)
+
+    edit.side_effect = [ConnectionError('timeout'), None]
+    enqueue_message(-100, None, 'approved', event_key='mr:1')
+    enqueue_message(-100, None, 'merged', event_key='mr:1')
+    work_once(redis, shard)
+    work_once(redis, shard)
+    make_due(redis)
+    work_once(redis, shard)
+
+    assert [call.args[2] for call in edit.call_args_list] == ['approved', 'merged']
+    assert not delayed(redis)
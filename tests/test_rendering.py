@@ -0,0 +1,42 @@
+from itertools import product
+
+import pytest
+
+from api.rendering import FLAGS, build_card, build_digest, build_message
+from api.routing import ProjectRoute
+from api.services import parse_gitlab_event
+from bench.render_bench import EVENTS, legacy_build_message
+
+MENTIONS = (
+    ((), ()),
+    (["[John](tg://user?id=1)", "Alice"], ()),
+    (["Alice"], [f"[Reviewer {i}](tg://user?id={i})" for i in range(3)]),
+)
+
+
+def project(values):
+    return ProjectRoute(id=1, name='backend', chat_id=-100, thread_id=None, is_active=True,
+                        **dict(zip(FLAGS, values)))
+
+
+# every event type, flag combination and assignee/reviewer list renders exactly as the view used to
+@pytest.mark.parametrize('name, values, mentions', list(product(EVENTS, product((False, True), repeat=len(FLAGS)),
+                                                                MENTIONS)))
+def test_same_text_as_the_legacy_view(name, values, mentions):
+    assignees, reviewers = mentions
+    args = (EVENTS[name], project(values), "[`Jane Doe`](tg://user?id=123456)", assignees, reviewers)
+    assert build_message(*args) == legacy_build_message(*args)
+
+
+def test_values_are_not_formatted_again():
+    event = parse_gitlab_event('Push Hook', {'ref': 'refs/heads/%(branch)s', 'user_name': '%s',
+                                             'project': {'name': 'backend'}})
+    text = build_message(event, project((True,) * len(FLAGS)), '100% {mention}')
+    assert "`%(branch)s`" in text and "*User:* 100% {mention}" in text
+
+
+def test_card_and_digest_add_to_the_message():
+    assert build_card("text\n", {'bob', 'al_ice'}, 'running') == \
+        "text\n👍 *Approved by:* al\\_ice, bob\n🔧 *Pipeline:* `running 🏃`\n"
+    assert build_digest("text\n", 3, 4, ["  • a\n", "  • b\n"]) == \
+        "text\n🔁 *Pushes:* `3`\n📝 *Commits (4):*\n  • a\n  • b\n  … +2\n"
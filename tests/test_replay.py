@@ -0,0 +1,23 @@
+import json
+
+import pytest
+
+from api.replay import to_hook
+
+
+def test_capture_record():
+    payload = {'object_kind': 'push', 'ref': 'refs/heads/main'}
+    record = {'event': 'Push Hook', 'body': json.dumps(payload), 'received_at': '2024-05-01T10:00:00+00:00'}
+    event_type, hook, received_at = to_hook(record)
+    assert (event_type, hook) == ('Push Hook', payload)
+    assert received_at.isoformat() == '2024-05-01T10:00:00+00:00'
+
+
+@pytest.mark.parametrize('body', ['[1, 2]', '"text"', 'null', [1, 2]])
+def test_capture_body_that_is_not_an_object(body):
+    with pytest.raises(ValueError):
+        to_hook({'event': 'Push Hook', 'body': body})
+
+
+def test_unknown_records_are_skipped():
+    assert to_hook({'something': 'else'}) == (None, None, None)
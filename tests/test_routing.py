@@ -0,0 +1,91 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from api.routing import get_route, local_routes, migrate_chat, route_key
+from apps.models import GitlabProject, GitlabRoute, TelegramGroup
+
+
+def group(chat_id, is_active=True, chat_type='group'):
+    return TelegramGroup.objects.create(chat_id=chat_id, chat_name=str(chat_id), chat_type=chat_type,
+                                        is_active=is_active)
+
+
+def test_route_follows_saved_changes(db):
+    project = GitlabProject.objects.create(name='backend', telegram_group=group(-1))
+    assert get_route('backend').chat_id == -1
+
+    project.show_user = False
+    project.save()
+    assert get_route('backend').show_user is False
+
+
+def test_unknown_project_is_not_created_on_request(db):
+    assert get_route('missing', create=False) is None
+    assert not GitlabProject.objects.filter(name='missing').exists()
+    assert get_route('missing').chat_id is None
+    assert GitlabProject.objects.filter(name='missing').exists()
+
+
+def test_route_is_cached_in_both_tiers(db):
+    GitlabProject.objects.create(name='backend', telegram_group=group(-1))
+    get_route('backend')
+    assert local_routes.get('backend').chat_id == -1
+    assert cache.get(route_key('backend')) is not None
+
+    # another process: only Redis is warm
+    local_routes.clear()
+    with CaptureQueriesContext(connection) as queries:
+        assert get_route('backend').chat_id == -1
+    assert not queries.captured_queries
+
+
+def test_routes_change_with_their_rules(db):
+    project = GitlabProject.objects.create(name='backend', telegram_group=group(-1))
+    assert get_route('backend').rules == ()
+
+    route = GitlabRoute.objects.create(project=project, telegram_group=group(-2), branch='main')
+    assert [rule.chat_id for rule in get_route('backend').rules] == [-2]
+    route.delete()
+    assert get_route('backend').rules == ()
+
+
+def test_renamed_project_is_gone_under_its_old_name(db):
+    project = GitlabProject.objects.create(name='backend', telegram_group=group(-1))
+    get_route('backend')
+
+    project.name = 'api'
+    project.save()
+
+    assert get_route('backend', create=False) is None
+    assert get_route('api').chat_id == -1
+
+
+def test_migrate_chat_moves_the_group(db):
+    GitlabProject.objects.create(name='backend', telegram_group=group(-1))
+    get_route('backend')
+
+    migrate_chat(-1, -1001)
+    assert get_route('backend').chat_id == -1001
+    assert TelegramGroup.objects.get().chat_type == 'supergroup'
+
+
+def test_migrate_chat_to_a_registered_chat_moves_projects_and_routes(db):
+    old = group(-1)
+    group(-1001, is_active=False, chat_type='supergroup')
+    GitlabProject.objects.create(name='backend', telegram_group=old)
+    routed = GitlabProject.objects.create(name='frontend')
+    GitlabRoute.objects.create(project=routed, telegram_group=old)
+    get_route('backend'), get_route('frontend')
+
+    migrate_chat(-1, -1001)
+
+    assert list(TelegramGroup.objects.values_list('chat_id', 'is_active')) == [(-1001, True)]
+    assert get_route('backend').chat_id == -1001
+    assert get_route('backend').is_active
+    assert [rule.chat_id for rule in get_route('frontend').rules] == [-1001]
+
+
+def test_migrate_unknown_chat_does_nothing(db):
+    migrate_chat(-1, -1001)
+    assert not TelegramGroup.objects.exists()
@@ -0,0 +1,52 @@
+from api.pipelines import pipeline_text
+from api.services import parse_gitlab_event, plan_delivery
+from tests.test_fanout import project, rule
+
+
+def pipeline(status, pipeline_id=7):
+    return parse_gitlab_event('Pipeline Hook', {
+        'project': {'name': 'backend'},
+        'user': {'id': 1, 'name': 'Jane', 'username': 'jane'},
+        'object_attributes': {'id': pipeline_id, 'ref': 'main', 'status': status, 'duration': 10},
+    })
+
+
+def keys(jobs):
+    return {job['chat_id']: job['event_key'] for job in jobs}
+
+
+def test_default_group_keeps_the_plain_key():
+    result, jobs = plan_delivery(pipeline('running'), project([rule(-200)]), 'running')
+    assert keys(jobs) == {-100: '7:pipeline:main', -200: '7:pipeline:main@-200:None'}
+
+
+def test_routed_key_does_not_depend_on_a_stopped_default_group():
+    _, jobs = plan_delivery(pipeline('running', 8), project([rule(-200)], is_active=False), 'running')
+    assert keys(jobs) == {-200: '8:pipeline:main@-200:None'}
+
+
+def test_routed_state_does_not_move_when_the_default_group_stops():
+    # with the default group stopped, the routed chat must keep its own key (and state)
+    routes = project([rule(-200)])
+    plan_delivery(pipeline('running'), routes, 'running')
+
+    plan_delivery(pipeline('success'), routes._replace(is_active=False), 'success')
+    assert pipeline_text(1, '7:pipeline:main@-200:None') == 'success'
+    assert pipeline_text(1, '7:pipeline:main') == 'running'
+
+
+def test_routed_keys_do_not_depend_on_the_order_of_routes():
+    _, jobs = plan_delivery(pipeline('running', 1), project([rule(-200), rule(-300)]), 'text')
+    _, reordered = plan_delivery(pipeline('running', 2), project([rule(-300), rule(-200)]), 'text')
+    assert keys(jobs)[-300] == '1:pipeline:main@-300:None'
+    assert keys(reordered)[-300] == '2:pipeline:main@-300:None'
+
+
+def test_stopped_targets_get_nothing():
+    assert plan_delivery(pipeline('running'), project(is_active=False), 'text') == ('telegram group is stopped', [])
+    assert plan_delivery(pipeline('running'), project(chat_id=None), 'text') == ('no telegram group', [])
+
+
+def test_replay_suffix_keeps_sandbox_state_apart():
+    _, jobs = plan_delivery(pipeline('running'), project(), 'text', key_suffix='@sandbox')
+    assert keys(jobs) == {-100: '7:pipeline:main@sandbox'}
@@ -0,0 +1,31 @@
+from unittest import mock
+
+import pytest
+from django.db import DatabaseError
+
+from api.sink import EVENTS_BUFFER_KEY, flush_redis_buffer, to_json
+from apps.models import GitlabProject, GitLabEvent
+
+
+@pytest.fixture
+def buffered(db, redis):
+    project = GitlabProject.objects.create(name='backend')
+    for index in range(5):
+        event = GitLabEvent(gitlab_event='push', project=project, status=str(index), branch='main', user_name='jane')
+        redis.lpush(EVENTS_BUFFER_KEY, to_json(event))
+    return project
+
+
+def test_flush_writes_in_arrival_order(buffered):
+    assert flush_redis_buffer() == 5
+    assert list(GitLabEvent.objects.order_by('id').values_list('status', flat=True)) == ['0', '1', '2', '3', '4']
+
+
+def test_failed_write_puts_the_batch_back(buffered, redis):
+    before = redis.lrange(EVENTS_BUFFER_KEY, 0, -1)
+    with mock.patch('api.sink.write_events', side_effect=DatabaseError), pytest.raises(DatabaseError):
+        flush_redis_buffer()
+    assert redis.lrange(EVENTS_BUFFER_KEY, 0, -1) == before
+
+    assert flush_redis_buffer() == 5
+    assert redis.llen(EVENTS_BUFFER_KEY) == 0
@@ -0,0 +1,74 @@
+from collections import Counter
+from datetime import timedelta
+
+import pytest
+from django.test import override_settings
+from django.utils import timezone
+
+from api.sink import write_events
+from api.stats import HISTOGRAM_FIELDS, get_stats, percentile, rebuild_stats
+from apps.models import DailyEventStats, GitlabProject, GitLabEvent, HourlyEventStats
+
+
+def test_percentile_interpolates_within_a_bucket():
+    # 10 durations of at most 30s, 10 between 30s and 60s
+    histogram = Counter({'duration_le_30': 10, 'duration_le_60': 10})
+    assert percentile(histogram, 20, 0.5) == 30
+    assert percentile(histogram, 20, 0.25) == 15
+    assert percentile(histogram, 20, 0.75) == 45
+    assert percentile(Counter(), 0, 0.5) is None
+
+
+def test_percentile_of_the_open_bucket_is_its_lower_bound():
+    histogram = Counter({'duration_over': 4})
+    assert percentile(histogram, 4, 0.95) == 3600
+    assert set(histogram) <= set(HISTOGRAM_FIELDS)
+
+
+@pytest.fixture
+def project(db):
+    return GitlabProject.objects.create(name='backend')
+
+
+def pipelines(project, durations, status='success', ago=timedelta(0)):
+    return [GitLabEvent(gitlab_event='pipeline', project=project, status=status, branch='main', user_name='jane',
+                        duration=duration, created_at=timezone.now() - ago) for duration in durations]
+
+
+def test_bulk_and_single_writes_are_counted(project):
+    write_events(pipelines(project, [10, 20, 40, 50]) + pipelines(project, [100], status='failed'))
+    GitLabEvent.objects.create(gitlab_event='push', project=project, status='pushed', branch='main',
+                               user_name='bob')
+
+    stats = get_stats(timezone.now() - timedelta(days=7))['projects']['backend']
+    assert stats['pipelines']['total'] == 5
+    assert stats['pipelines']['success_rate'] == 0.8
+    assert stats['pipelines']['duration']['avg'] == 44
+    assert stats['pipelines']['duration']['p50'] == 38
+    assert stats['pushes'] == {'total': 1, 'by_user': {'bob': 1}}
+
+
+def test_short_windows_read_the_hourly_table(project):
+    write_events(pipelines(project, [10], ago=timedelta(hours=5)) + pipelines(project, [10]))
+    stats = get_stats(timezone.now() - timedelta(hours=2))
+    assert stats['granularity'] == 'hour'
+    assert stats['projects']['backend']['pipelines']['total'] == 1
+
+
+def test_projects_filter(project):
+    other = GitlabProject.objects.create(name='frontend')
+    write_events(pipelines(project, [10]) + pipelines(other, [10]))
+    assert list(get_stats(timezone.now() - timedelta(days=1), projects=['frontend'])['projects']) == ['frontend']
+
+
+@override_settings(STATS_HOURLY_RETENTION_DAYS=30)
+def test_rebuild_matches_the_incremental_counts(project):
+    write_events([event for days in range(60) for event in pipelines(project, [days], ago=timedelta(days=days))])
+    daily = sorted(DailyEventStats.objects.values_list('bucket', 'events', 'duration_sum'))
+    HourlyEventStats.objects.filter(bucket__lt=timezone.now() - timedelta(days=30)).delete()
+
+    assert rebuild_stats(timezone.now() - timedelta(days=50)) == 51
+    assert sorted(DailyEventStats.objects.values_list('bucket', 'events', 'duration_sum')) == daily
+    # hourly rows are only rebuilt as far back as prune_events keeps them
+    oldest = HourlyEventStats.objects.order_by('bucket').first().bucket
+    assert timezone.now() - oldest <= timedelta(days=31)
@@ -0,0 +1,86 @@
+import json
+from unittest import mock
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.test import AsyncClient, Client, override_settings
+
+from apps.models import GitlabProject, GitLabEvent, TelegramGroup
+from bench.payloads import merge_request_hook, pipeline_hook, push_hook
+
+URLS = {'sync': '/api/gitlab/webhook/', 'async': '/api/async/gitlab/webhook/'}
+
+
+@pytest.fixture
+def bot():
+    # every Bot API call of both clients, answered with a new message id
+    calls = []
+
+    def call(method, data, **kwargs):
+        calls.append((method, data))
+        return {'message_id': len(calls)}
+
+    async def acall(method, data, **kwargs):
+        return call(method, data)
+
+    with mock.patch('api.bot.get_client', return_value=mock.Mock(call=call)), \
+            mock.patch('api.bot.get_async_client', return_value=mock.Mock(call=acall)):
+        yield calls
+
+
+@pytest.fixture
+def project(db):
+    group = TelegramGroup.objects.create(chat_id=-100, chat_name='team', chat_type='group', is_active=True)
+    return GitlabProject.objects.create(name='backend', telegram_group=group)
+
+
+def post(view, event_type, payload, **headers):
+    body = payload if isinstance(payload, (str, bytes)) else json.dumps(payload)
+    if view == 'sync':
+        return Client().post(URLS[view], body, content_type='application/json', headers={
+            'X-Gitlab-Event': event_type, **headers})
+    return async_to_sync(AsyncClient().post)(URLS[view], body, content_type='application/json', headers={
+        'X-Gitlab-Event': event_type, **headers})
+
+
+@pytest.mark.parametrize('view', URLS)
+@pytest.mark.parametrize('event_type, payload, status, gitlab_event', [
+    ('Push Hook', push_hook(commits=3, files=4), 'ok', 'push'),
+    ('Merge Request Hook', merge_request_hook(reviewers=2), 'card queued', 'merge'),
+    ('Pipeline Hook', pipeline_hook(builds=5, status='running'), 'running queued', 'pipeline'),
+])
+@override_settings(TELEGRAM_DELIVERY_MODE='inline')
+def test_hook_is_recorded_and_sent(view, event_type, payload, status, gitlab_event, project, bot):
+    response = post(view, event_type, payload)
+
+    assert response.status_code == 200
+    assert response.json() == {'status': status}
+    assert GitLabEvent.objects.get().gitlab_event == gitlab_event
+    assert [(method, data['chat_id']) for method, data in bot] == [('sendMessage', -100)]
+    assert 'backend' in bot[0][1]['text']
+
+
+@pytest.mark.parametrize('view', URLS)
+def test_queued_delivery(view, project, redis):
+    response = post(view, 'Push Hook', push_hook(commits=1, files=1))
+    assert response.json() == {'status': 'ok'}
+    assert sum(redis.llen(key) for key in redis.keys('gitlab_bot:queue:*') if redis.type(key) == b'list') == 1
+
+
+@pytest.mark.parametrize('view', URLS)
+def test_other_event_types_are_ignored(view, project):
+    assert post(view, 'Note Hook', {'project': {'name': 'backend'}}).json() == {'status': 'ignored'}
+    assert not GitLabEvent.objects.exists()
+
+
+@pytest.mark.parametrize('view', URLS)
+def test_invalid_body(view, project):
+    response = post(view, 'Push Hook', '{"project": ')
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('view', URLS)
+def test_unknown_project(view, db):
+    response = post(view, 'Push Hook', push_hook(commits=1, files=1))
+    assert response.status_code == 403
+    assert not GitlabProject.objects.exists()